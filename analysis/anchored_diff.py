@@ -0,0 +1,94 @@
+import bisect
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import Levenshtein
+
+# substrings this long that occur once in each text are anchors. long enough to be unique in most running text, even
+# with spaces removed, and short enough that some fit between differences
+ANCHOR_LENGTH = 32
+HASH_BASE = 1_000_003
+# below this fraction of the longer text in matching blocks, the texts differ too much for the anchors to be trusted
+MIN_ANCHORED_COVERAGE = 0.5
+
+def substring_hashes(text, length):
+    """A hash of each substring text[i:i+length], as a uint64 array (overflow wraps around)"""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    powers = np.array([pow(HASH_BASE, length - 1 - t, 2**64) for t in range(length)], dtype=np.uint64)
+    return sliding_window_view(codes, length) @ powers
+
+def unique_substrings(text, length):
+    """(hashes, positions) of the substrings of [length] whose hash occurs exactly once in [text], sorted by hash"""
+    if len(text) < length: return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    hashes, positions, counts = np.unique(substring_hashes(text, length), return_index=True, return_counts=True)
+    return hashes[counts == 1], positions[counts == 1]
+
+def anchor_runs(text1, text2, length):
+    """(i, j, length) of each run of anchors, i.e. substrings of [length] that are unique in both texts, on one diagonal:
+    text1[i:i+length] == text2[j:j+length], sorted by i"""
+    hashes1, positions1 = unique_substrings(text1, length)
+    hashes2, positions2 = unique_substrings(text2, length)
+    _, indexes1, indexes2 = np.intersect1d(hashes1, hashes2, assume_unique=True, return_indices=True)
+    order = np.argsort(positions1[indexes1])
+    i, j = positions1[indexes1][order], positions2[indexes2][order]
+    # a run continues while both positions step by one
+    run_starts = np.flatnonzero(np.concatenate([[True], (np.diff(i) != 1) | (np.diff(j) != 1)])) if len(i) > 0 else np.empty(0, dtype=np.int64)
+    run_ends = np.append(run_starts[1:], len(i))
+    runs = []
+    for start, end in zip(run_starts, run_ends):
+        start_i, start_j, run_length = int(i[start]), int(j[start]), int(end - start) + length - 1
+        # hashes can collide, so check the text
+        if text1[start_i:start_i+run_length] == text2[start_j:start_j+run_length]: runs.append((start_i, start_j, run_length))
+    return runs
+
+def heaviest_increasing_run(runs):
+    """The subsequence of [runs] ((i, j, length), sorted by i) with increasing j that covers the most characters, so a
+    long block moved past short matching runs is kept, not the short runs. A Fenwick tree over the js holds the heaviest
+    chain ending below each j"""
+    if len(runs) == 0: return []
+    js = sorted(j for _, j, _ in runs)
+    tree = [(0, None)] * (len(js) + 1)     # (weight, index of the last run) of the heaviest chain in each node's range
+    weights, previous = [0] * len(runs), [None] * len(runs)
+    for index, (_, j, length) in enumerate(runs):
+        rank = bisect.bisect_left(js, j)    # runs with a j below this one are in nodes 1..rank
+        best, node = (0, None), rank
+        while node > 0:
+            if tree[node][0] > best[0]: best = tree[node]
+            node -= node & -node
+        weights[index], previous[index] = best[0] + length, best[1]
+        node = rank + 1
+        while node <= len(js):
+            if weights[index] > tree[node][0]: tree[node] = (weights[index], index)
+            node += node & -node
+    result, index = [], max(range(len(runs)), key=weights.__getitem__)
+    while index is not None:
+        result.append(runs[index])
+        index = previous[index]
+    return result[::-1]
+
+def matching_blocks(text1, text2, anchor_length=ANCHOR_LENGTH):
+    """Non-overlapping (i, j, length) blocks with text1[i:i+length] == text2[j:j+length], in order in both texts,
+    from the substrings that are unique in both (patience diff on characters)"""
+    blocks = []
+    for i, j, length in heaviest_increasing_run(anchor_runs(text1, text2, anchor_length)):
+        if len(blocks) > 0:
+            # only the part after the previous block is kept
+            block_i, block_j, block_length = blocks[-1]
+            skip = max(block_i + block_length - i, block_j + block_length - j, 0)
+            if skip >= length: continue
+            i, j, length = i + skip, j + skip, length - skip
+        blocks.append((i, j, length))
+    return blocks
+
+def anchored_editops(text1, text2, anchor_length=ANCHOR_LENGTH):
+    """Levenshtein.editops(text1, text2), computed only inside the hunks between matching blocks. Near-linear when the
+    texts are mostly the same. Levenshtein.editops on the whole texts when the blocks cover less than MIN_ANCHORED_COVERAGE"""
+    blocks = matching_blocks(text1, text2, anchor_length)
+    if sum(length for _, _, length in blocks) < MIN_ANCHORED_COVERAGE * max(len(text1), len(text2)):
+        return Levenshtein.editops(text1, text2)
+    ops, start1, start2 = [], 0, 0
+    for i, j, length in blocks + [(len(text1), len(text2), 0)]:
+        hunk1, hunk2 = text1[start1:i], text2[start2:j]
+        if hunk1 != hunk2:
+            ops += [(action, src_index + start1, dest_index + start2) for action, src_index, dest_index in Levenshtein.editops(hunk1, hunk2)]
+        start1, start2 = i + length, j + length
+    return ops
@@ -2,14 +2,16 @@ import os
 import fitz  # imports the pymupdf library
 import Levenshtein
 import pandas as pd
+from collections import Counter
 from typing import Dict, Any
 
 from pandas.core.api import DataFrame
 
-from config import COMPILED_FOLDER
+from config import COMPILED_FOLDER, ANCHORED_EDIT_OPS
 from utils.logger import ANALYSIS_LOGGER as LOGGER, pad_with_char
 import analysis.helpers as helpers
 import analysis.text_transformer as Ttr
+from analysis.anchored_diff import anchored_editops
 from utils.tex_engine_utils import get_engine_name, TEX_ENGINES as ENGINES, DIFF_ENGINE_PAIRS as COMPARISON
 
 DF_COMPARISON_INDEX = 'comparison'
@@ -125,8 +127,8 @@ def transform_op(edit_op, s1, s2):
             LOGGER.warn(f'unknown op: {action}')
             return None
 
-def get_edit_ops(text1, text2):
-    ops = Levenshtein.editops(text1, text2)
+def get_edit_ops(text1, text2, anchored=ANCHORED_EDIT_OPS):
+    ops = anchored_editops(text1, text2) if anchored else Levenshtein.editops(text1, text2)
     transformed_ops = [transform_op(op, text1, text2) for op in ops]
     return [x for x in transformed_ops if x is not None]
 
@@ -171,6 +173,76 @@ def group_edit_ops(edit_ops):
     dest_edits_grouped.pop((-100,-100))
     return src_edits_grouped, dest_edits_grouped
 
+class TextComparison:
+    """Comparison of two texts. The Levenshtein alignment (editops) is computed once, on first use, and the edit ops and
+    their summaries are all derived from it, as is the distance unless [anchored] (then Levenshtein.distance, computed once)"""
+    def __init__(self, text1, text2, anchored=ANCHORED_EDIT_OPS):
+        self.text1, self.text2 = text1, text2
+        self.anchored = anchored
+        self._edit_ops = None
+        self._distance = None
+        self._ratio = None
+
+    @property
+    def edit_ops(self):
+        """(action, src index, dest index, src char, dest char) of every insert, delete and replace"""
+        if self._edit_ops is None: self._edit_ops = get_edit_ops(self.text1, self.text2, self.anchored)
+        return self._edit_ops
+
+    @property
+    def distance(self):
+        # the plain alignment is minimal, so its length is the distance. the anchored one is not always, e.g. where a
+        # substring unique in both texts is not where an optimal alignment matches it
+        if not self.anchored: return len(self.edit_ops)
+        if self._distance is None: self._distance = Levenshtein.distance(self.text1, self.text2)
+        return self._distance
+
+    @property
+    def normalised_distance(self):
+        max_length = max(len(self.text1), len(self.text2))
+        if max_length == 0: return 1
+        return 1 - (self.distance / max_length)
+
+    @property
+    def ratio(self):
+        # based on the indel distance (a replace counts as an insert and a delete), so not derived from the alignment
+        if self._ratio is None: self._ratio = Levenshtein.ratio(self.text1, self.text2)
+        return self._ratio
+
+    @property
+    def hamming(self):
+        return Levenshtein.hamming(self.text1, self.text2)
+
+    @property
+    def hamming_normalised(self):
+        return normalise(Levenshtein.hamming)(self.text1, self.text2)
+
+    @property
+    def collated_edit_ops(self):
+        """{ (action, src char, dest char): count }"""
+        return collate_edit_ops(self.edit_ops)
+
+    @property
+    def edit_ops_df(self):
+        """The collated edit ops as a df of action, from, to, count, most frequent first"""
+        data = [ ( *op, counts ) for op, counts in self.collated_edit_ops.items() ]
+        df = pd.DataFrame(data, columns=pd.Index(['action', 'from', 'to', 'count']))
+        return df.sort_values(by=['count'], ascending=False)
+
+    @property
+    def grouped_edit_ops(self):
+        """(src, dest) edit ops grouped by location, for debugging"""
+        return group_edit_ops(self.edit_ops)
+
+    @property
+    def insert_minus_delete(self):
+        actions = Counter(action for action, _, _, _, _ in self.edit_ops)
+        return actions['insert'] - actions['delete']
+
+def compare_texts(pdf_texts, anchored=ANCHORED_EDIT_OPS):
+    """{ cmp: TextComparison } for each pair of engines with texts"""
+    return { f'{e1}{e2}': TextComparison(pdf_texts[e1], pdf_texts[e2], anchored) for e1, e2 in COMPARISON if e1 in pdf_texts and e2 in pdf_texts }
+
 def analyse_edit_opts_results(edit_ops_results):
     RESULTS = {}
     for cmp_engines, df in edit_ops_results.items():
@@ -189,57 +261,43 @@ def characterise_common_edit_op(action, old_c, new_c):
 
 def clean_edit_ops_results(edit_ops_results):
     """clean out changes in whitespace, upper/lower case, simple movements"""
-    def find_corresponding_delete_index(char, deletions_df):
-        matching_indexes = deletions_df.index[deletions_df['from'] == char]
-        if len(matching_indexes) == 0: return None
-        assert len(matching_indexes) == 1
-        return matching_indexes[0]
-
-    summary = { 'whitespace': 0, 'lower-upper': 0, 'upper-lower': 0, 'movements': 0 }
-    indexes_to_keep = []
-    # create a new df without the common trivial edit ops
-    for index, row in edit_ops_results.iterrows():
-        type_of_edit_op = characterise_common_edit_op(row['action'], row['from'], row['to'])
+    actions, from_chars, to_chars = edit_ops_results['action'].tolist(), edit_ops_results['from'].tolist(), edit_ops_results['to'].tolist()
+    counts = edit_ops_results['count'].tolist()
+    summary = Counter({ 'whitespace': 0, 'lower-upper': 0, 'upper-lower': 0, 'movements': 0 })
+    rows_to_keep = []
+    # drop the common trivial edit ops
+    for row, (action, from_char, to_char) in enumerate(zip(actions, from_chars, to_chars)):
+        type_of_edit_op = characterise_common_edit_op(action, from_char, to_char)
         if type_of_edit_op is not None: summary[type_of_edit_op] += 1
-        else: indexes_to_keep.append(index)
-    cleaned_results = edit_ops_results.loc[indexes_to_keep]
-    # remove simple movements from the new df
-    insertions, deletions = cleaned_results[cleaned_results['action'] == 'insert'], cleaned_results[cleaned_results['action'] == 'delete']
-    for index, row in insertions.iterrows():
-        corresponding_delete_index = find_corresponding_delete_index(row['to'], deletions)
-        if corresponding_delete_index is None: continue
-        delete_count = cleaned_results.loc[corresponding_delete_index, 'count']
-        num_movements = min(row['count'], delete_count)
-        cleaned_results.loc[index, 'count'] -= num_movements
-        cleaned_results.loc[corresponding_delete_index, 'count'] -= num_movements
+        else: rows_to_keep.append(row)
+    # remove simple movements: an insertion of a char cancels out a deletion of it. the ops are collated, so there is one
+    # deletion row per char
+    deletion_rows = { from_chars[row]: row for row in rows_to_keep if actions[row] == 'delete' }
+    for row in rows_to_keep:
+        if actions[row] != 'insert' or to_chars[row] not in deletion_rows: continue
+        delete_row = deletion_rows[to_chars[row]]
+        num_movements = min(counts[row], counts[delete_row])
+        counts[row] -= num_movements
+        counts[delete_row] -= num_movements
         summary['movements'] += num_movements
-    cleaned_results = cleaned_results.loc[cleaned_results['count'] > 0]
-    return cleaned_results, summary
+    rows_to_keep = [row for row in rows_to_keep if counts[row] > 0]
+    cleaned_results = edit_ops_results.iloc[rows_to_keep].copy()
+    cleaned_results['count'] = pd.Series([counts[row] for row in rows_to_keep], index=cleaned_results.index, dtype=edit_ops_results['count'].dtype)
+    return cleaned_results, dict(summary)
 
 # </ edit_op helpers > --------------------------------------------------------
 
 # < runners > -----------------------------------------------------------------
 
-def compute_edit_ops(pdf_texts):
-    """Compute Levenshtein edit ops (insert/delete/replace)"""
-    def compute_edit_ops_for_engine(e1, e2):
-        edit_ops = get_edit_ops(pdf_texts[e1], pdf_texts[e2])
-        collated_ops = collate_edit_ops(edit_ops)
-        data = [ ( *op, counts ) for op, counts in collated_ops.items() ]
-        df = pd.DataFrame(data, columns=pd.Index(['action', 'from', 'to', 'count']))
-        return df.sort_values(by=['count'], ascending=False)
-    RESULTS = {}
-    for e1, e2 in COMPARISON:
-        if e1 not in pdf_texts or e2 not in pdf_texts: continue
-        RESULTS[f'{e1}{e2}']  = compute_edit_ops_for_engine(e1, e2)
-    return RESULTS
+def compute_edit_ops(comparisons):
+    """Compute Levenshtein edit ops (insert/delete/replace) of each TextComparison"""
+    return { cmp: comparison.edit_ops_df for cmp, comparison in comparisons.items() }
 
-def compute_debug_edit_ops(pdf_texts):
+def compute_debug_edit_ops(comparisons):
     EDIT_OPS_DEBUG = {}
     for e1, e2 in COMPARISON:
-        if e1 not in pdf_texts or e2 not in pdf_texts: continue
-        edit_ops = get_edit_ops(pdf_texts[e1], pdf_texts[e2])
-        debug_ops_e1, debug_ops_e2 = group_edit_ops(edit_ops)
+        if f'{e1}{e2}' not in comparisons: continue
+        debug_ops_e1, debug_ops_e2 = comparisons[f'{e1}{e2}'].grouped_edit_ops
         EDIT_OPS_DEBUG[f'{e1}{e2}'] = { f'{e1}': debug_ops_e1, f'{e2}': debug_ops_e2 }
     return EDIT_OPS_DEBUG
 
@@ -254,10 +312,11 @@ def compute_cleaned_edit_ops(edit_ops_results):
         cleaned_results[cmp] = cleaned_ops.sort_values(by=['count'], ascending=False)
     return cleaned_results, summary
 
-def compute_text_comparison_metrics(COMPARE_METHODS, pdf_texts, df):
+def compute_text_comparison_metrics(COMPARE_METHODS, comparisons, df):
+    """[COMPARE_METHODS]: { method name: f(TextComparison) }"""
     RESULTS = []
     for method_name, f in COMPARE_METHODS.items():
-        row = compare_texts_with_method(pdf_texts, f)
+        row = { cmp: f(comparison) for cmp, comparison in comparisons.items() }
         row[DF_COMPARISON_INDEX] = method_name
         RESULTS.append(row)
     # save compare text results to a df
@@ -320,13 +379,10 @@ def compute_image_comparison_metrics(pdf_images, df):
     df = pd.concat([df, pd.DataFrame.from_records(rows, index=DF_COMPARISON_INDEX)])
     return df
 
-def compute_edit_ops_metrics(edit_ops_results, results_df):
+def compute_edit_ops_metrics(comparisons, results_df):
     row : Dict[str, Any] = { 'comparison': 'insert_minus_delete' }
-    for cmp_engines, df in edit_ops_results.items():
-        grouped = df.groupby('action', as_index=True)['count'].sum()
-        insertions = 0 if 'insert' not in grouped.index else grouped.at['insert']
-        deletions = 0 if 'delete' not in grouped.index else grouped.at['delete']
-        row[cmp_engines] = insertions - deletions
+    for cmp_engines, comparison in comparisons.items():
+        row[cmp_engines] = comparison.insert_minus_delete
     results_df = pd.concat([results_df, pd.DataFrame.from_records([row], index=DF_COMPARISON_INDEX)])
     return results_df
 
@@ -338,11 +394,11 @@ def get_text_and_images_from_pdf(arxiv_id, transformer):
 # </ runners > -----------------------------------------------------------------
 
 COMPARE_METHODS = {
-    'levenshtein': Levenshtein.distance,
-    'hamming': Levenshtein.hamming,
-    'levenshtein_ratio': Levenshtein.ratio,
-    'levenshtein_normalised': normalise(Levenshtein.distance),
-    'hamming_normalised': normalise(Levenshtein.hamming),
+    'levenshtein': lambda comparison: comparison.distance,
+    'hamming': lambda comparison: comparison.hamming,
+    'levenshtein_ratio': lambda comparison: comparison.ratio,
+    'levenshtein_normalised': lambda comparison: comparison.normalised_distance,
+    'hamming_normalised': lambda comparison: comparison.hamming_normalised,
 }
 
 DEFAULT_TRANSFORMER = Ttr.transformer_ignore_hyphenbreak_pagebreak_linebreak
@@ -362,15 +418,16 @@ def main(arxiv_id):
     LOGGER.debug(pad_with_char(f'[{arxiv_id}]: running comparison', '='))
     pdf_texts, pdf_images = get_text_and_images_from_pdf(arxiv_id, transformer=DEFAULT_TRANSFORMER)
 
-    edit_ops_results = compute_edit_ops(pdf_texts)
+    comparisons = compare_texts(pdf_texts)
+    edit_ops_results = compute_edit_ops(comparisons)
     analysed_edit_opts_results = analyse_edit_opts_results(edit_ops_results)
     cleaned_results, summary = compute_cleaned_edit_ops(edit_ops_results)
 
     RESULTS = helpers.init_df_with_cols([DF_COMPARISON_INDEX] + [f'{e1}{e2}' for e1, e2 in COMPARISON], DF_COMPARISON_INDEX)
-    RESULTS = compute_text_comparison_metrics(COMPARE_METHODS, pdf_texts, RESULTS)
+    RESULTS = compute_text_comparison_metrics(COMPARE_METHODS, comparisons, RESULTS)
     RESULTS = compute_levenshtein_cleaned_and_edit_ops_summary(cleaned_results, summary, RESULTS)
     RESULTS = compute_image_comparison_metrics(pdf_images, RESULTS)
-    RESULTS = compute_edit_ops_metrics(edit_ops_results, RESULTS)
+    RESULTS = compute_edit_ops_metrics(comparisons, RESULTS)
 
     for e1, e2 in COMPARISON:
         cmp = f'{e1}{e2}'
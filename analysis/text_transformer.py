@@ -1,10 +1,77 @@
+import re
+
+# rules whose olds could share chars in a text: one contains the other, or one ends with the start of the other
+def olds_overlap(old1, old2):
+    if old1 in old2 or old2 in old1: return True
+    return any(old1.endswith(old2[:i]) or old2.endswith(old1[:i]) for i in range(1, min(len(old1), len(old2))))
+
+# whether applying [earlier] then [later] (each an (old, new) rule) can differ from applying both in one pass: their
+# olds overlap, or the earlier one's new could make a match of the later one (deleting joins up the chars either side)
+def order_matters(earlier, later):
+    (old1, new1), (old2, _) = earlier, later
+    if olds_overlap(old1, old2): return True
+    if new1 == '': return len(old2) > 1
+    return any(char in old2 for char in new1)
+
+# an alternation of [olds] factored by their first chars, e.g. ´A|´E as ´[AE], so fewer branches are tried at each position
+def olds_pattern(olds):
+    groups = {}
+    for old in olds: groups.setdefault(old[0], []).append(old[1:])
+    branches = []
+    for first, rests in groups.items():
+        if rests == ['']: branches.append(re.escape(first))
+        elif all(len(rest) == 1 for rest in rests): branches.append(re.escape(first) + '[' + ''.join(re.escape(rest) for rest in rests) + ']')
+        else: branches.append(re.escape(first) + '(?:' + olds_pattern(rests) + ')')
+    return '|'.join(branches)
+
+# applying transformations rule by rule with str.replace copies the text once per rule. this groups consecutive rules
+# into passes with the same result: rules of several chars (e.g. the accents) are matched with one regex per run of rules
+# whose order doesn't matter, and rules of a single char are still str.replace'd, which is faster than str.translate on
+# non-ascii text and needs no regex match per char (e.g. per space)
+class CompiledTransform:
+    def __init__(self, transformations):
+        self.transformations = list(transformations)
+        self.passes = [CompiledTransform.compile_pass(rules) for rules in CompiledTransform.split_into_passes(self.transformations)]
+
+    @staticmethod
+    def split_into_passes(transformations):
+        passes = []
+        for rule in transformations:
+            single_char = len(rule[0]) <= 1
+            if len(passes) > 0 and single_char == (len(passes[-1][0][0]) <= 1) \
+                    and (single_char or not any(order_matters(earlier, rule) for earlier in passes[-1])):
+                passes[-1].append(rule)
+            else:
+                passes.append([rule])
+        return passes
+
+    @staticmethod
+    def compile_pass(rules):
+        if len(rules) == 1 or len(rules[0][0]) <= 1:
+            def replace_each(text):
+                for old, new in rules:
+                    text = text.replace(old, new)
+                return text
+            return replace_each
+        replacements = dict(rules)
+        pattern = re.compile(olds_pattern(list(replacements)))
+        return lambda text: pattern.sub(lambda match: replacements[match.group()], text)
+
+    def __call__(self, text):
+        for apply_pass in self.passes:
+            text = apply_pass(text)
+        return text
+
 class TextTransformer:
     # pre-/post-transformations: applied before/after joining pages
     def __init__(self, pre_transformations, page_break_delimiter, post_transformations):
         self.page_break_delimiter = page_break_delimiter
         self.pre_transformations = pre_transformations
         self.post_transformations = post_transformations
+        self.pre_transform = CompiledTransform(pre_transformations)
+        self.post_transform = CompiledTransform(post_transformations)
 
+    # one str.replace per rule, in order. CompiledTransform gives the same result in fewer passes
     @staticmethod
     def apply_transform(text, transformations):
         for old, new in transformations:
@@ -12,9 +79,9 @@ class TextTransformer:
         return text
 
     def process(self, pages_arr):
-        processed_pages = [TextTransformer.apply_transform(page, self.pre_transformations) for page in pages_arr]
+        processed_pages = [self.pre_transform(page) for page in pages_arr]
         text = self.page_break_delimiter.join(processed_pages)
-        return TextTransformer.apply_transform(text, self.post_transformations)
+        return self.post_transform(text)
 
 # common transforms ======================================================================
 HYPHEN_BREAKS_TO_LINE_BREAK = ('-\n', '\n')  # check behaviour when used with line breaks
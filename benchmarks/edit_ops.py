@@ -0,0 +1,91 @@
+import os
+import time
+import pandas as pd
+from analysis import compare_text_similarity as cts
+from text_based_comparison import compare_text
+from benchmarks.text_comparison import make_synthetic_texts
+
+"""clean_edit_ops_results as it was, on the rows of the df"""
+def legacy_clean_edit_ops_results(edit_ops_results):
+    def find_corresponding_delete_index(char, deletions_df):
+        matching_indexes = deletions_df.index[deletions_df['from'] == char]
+        if len(matching_indexes) == 0: return None
+        assert len(matching_indexes) == 1
+        return matching_indexes[0]
+
+    summary = { 'whitespace': 0, 'lower-upper': 0, 'upper-lower': 0, 'movements': 0 }
+    indexes_to_keep = []
+    for index, row in edit_ops_results.iterrows():
+        type_of_edit_op = cts.characterise_common_edit_op(row['action'], row['from'], row['to'])
+        if type_of_edit_op is not None: summary[type_of_edit_op] += 1
+        else: indexes_to_keep.append(index)
+    cleaned_results = edit_ops_results.loc[indexes_to_keep]
+    insertions, deletions = cleaned_results[cleaned_results['action'] == 'insert'], cleaned_results[cleaned_results['action'] == 'delete']
+    for index, row in insertions.iterrows():
+        corresponding_delete_index = find_corresponding_delete_index(row['to'], deletions)
+        if corresponding_delete_index is None: continue
+        delete_count = cleaned_results.loc[corresponding_delete_index, 'count']
+        num_movements = min(row['count'], delete_count)
+        cleaned_results.loc[index, 'count'] -= num_movements
+        cleaned_results.loc[corresponding_delete_index, 'count'] -= num_movements
+        summary['movements'] += num_movements
+    cleaned_results = cleaned_results.loc[cleaned_results['count'] > 0]
+    return cleaned_results, summary
+
+"""find_different_chars as it was, on the rows of the dfs"""
+def legacy_find_different_chars(edit_ops):
+    different_chars, different_chars_count, different_chars_count_uniq = {}, { 'comparison': 'chars_diff_nett' }, { 'comparison': 'chars_diff_uniq' }
+    for cmp, edit_ops_df in edit_ops.items():
+        char_counts = {}
+        for _, row in edit_ops_df.iterrows():
+            from_char, to_char, char_count = row['from'], row['to'], row['count']
+            if from_char not in char_counts: char_counts[from_char] = 0
+            if to_char not in char_counts: char_counts[to_char] = 0
+            char_counts[from_char] -= char_count
+            char_counts[to_char] += char_count
+        if '' in char_counts: char_counts.pop('')
+        different_chars[cmp] = { k:v for k, v in char_counts.items() if v != 0 and not k.isspace() }
+        different_chars_count[cmp] = sum(different_chars[cmp].values())
+        different_chars_count_uniq[cmp] = len(different_chars[cmp].keys())
+    return different_chars, [ different_chars_count, different_chars_count_uniq ]
+
+"""Extracted and transformed texts of up to [max_papers] papers of a folder of compiled pdfs, as in the analysis"""
+def load_corpus_texts(compiled_folder, max_papers):
+    corpus = []
+    for arxiv_id in sorted(os.listdir(compiled_folder))[:max_papers]:
+        pdf_pages, _ = cts.extract_pages_and_images_from_pdfs(compiled_folder, arxiv_id)
+        pdf_texts = cts.process_pages_to_string(pdf_pages, cts.DEFAULT_TRANSFORMER)
+        if len(pdf_texts) > 1: corpus.append(pdf_texts)
+    return corpus
+
+def make_synthetic_corpus(num_papers, num_pages):
+    return [make_synthetic_texts(num_pages, seed) for seed in range(num_papers)]
+
+"""Clean the edit ops and find the different chars of every engine pair of every paper in [corpus] (a list of { engine: text })
+as before and with the Counter-based implementation, and check that the results are identical"""
+def run(corpus, repeat=3):
+    edit_ops = [cts.compute_edit_ops(cts.compare_texts(pdf_texts)) for pdf_texts in corpus]
+    num_rows = sum(df.shape[0] for paper_edit_ops in edit_ops for df in paper_edit_ops.values())
+    print(f'edit ops: {len(edit_ops)} papers, {num_rows} collated edit op rows')
+    implementations = {
+        'rows': (legacy_clean_edit_ops_results, legacy_find_different_chars),
+        'counter': (cts.clean_edit_ops_results, compare_text.find_different_chars),
+    }
+    times, results = {}, {}
+    for name, (clean, find_different_chars) in implementations.items():
+        run_times = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            results[name] = [({ cmp: clean(df) for cmp, df in paper_edit_ops.items() }, find_different_chars(paper_edit_ops)) for paper_edit_ops in edit_ops]
+            run_times.append(time.perf_counter() - start_time)
+        times[name] = min(run_times)
+        print(f'{name:>8}: {times[name]:.3f}s')
+    print(f"speedup: {times['rows'] / times['counter']:.1f}x")
+    mismatches = []
+    for paper, ((cleaned_before, chars_before), (cleaned_after, chars_after)) in enumerate(zip(results['rows'], results['counter'])):
+        for cmp, (df_before, summary_before) in cleaned_before.items():
+            df_after, summary_after = cleaned_after[cmp]
+            if not df_before.equals(df_after) or not df_before.index.equals(df_after.index) or summary_before != summary_after: mismatches.append((paper, cmp))
+        if chars_before != chars_after: mismatches.append((paper, 'different chars'))
+    print('cleaned edit ops, summaries and different chars are identical' if len(mismatches) == 0 else f'DIFFERENT for (paper, comparison): {mismatches}')
+    return mismatches
@@ -0,0 +1,94 @@
+import os
+import time
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pipeline.fetcher import Fetcher
+
+BODY = os.urandom(1 << 18)
+STALL_SECONDS = 2
+
+"""A local server whose paths fail in the ways a download can, the first [failures] times each path is requested:
+/ok, /rate-limited (429 with Retry-After), /unavailable (503 with a Retry-After far beyond any backoff), /stalled (the body
+stops halfway for STALL_SECONDS), /truncated (the connection closes halfway through the body) and /missing (404, always)"""
+class FlakyServer:
+    def __init__(self, failures=2):
+        self.failures = failures
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *_):
+                pass
+
+            def send_body_headers(self, status=200, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(BODY) if status == 200 else 0))
+                for name, value in (headers or {}).items(): self.send_header(name, value)
+                self.end_headers()
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests[self.path] += 1
+                    failing = server.requests[self.path] <= server.failures
+                if self.path == '/missing': return self.send_body_headers(404)
+                if failing and self.path == '/rate-limited': return self.send_body_headers(429, { 'Retry-After': '1' })
+                if failing and self.path == '/unavailable': return self.send_body_headers(503, { 'Retry-After': '3600' })
+                if failing and self.path in ('/stalled', '/truncated'):
+                    self.send_body_headers()
+                    self.wfile.write(BODY[:len(BODY) // 2])
+                    self.wfile.flush()
+                    if self.path == '/stalled': time.sleep(STALL_SECONDS)
+                    self.close_connection = True
+                    return
+                self.send_body_headers()
+                self.wfile.write(BODY)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}{path}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+"""Download each path of a FlakyServer with a Fetcher, checking that the complete body is written after the expected number
+of requests, that Retry-After is capped at the longest backoff, and that 404s are not retried. Returns the failing paths"""
+def run(folder, num_retries=3, backoff=0.1, read_timeout=0.5, failures=2):
+    os.makedirs(folder, exist_ok=True)
+    longest_delay = backoff * (2 ** num_retries)
+    failing = []
+    with FlakyServer(failures) as server, Fetcher(4, 0, num_retries, backoff, timeout=(1, read_timeout)) as fetcher:
+        for path, max_seconds in [('/ok', 1), ('/rate-limited', 2 * 1 + 1), ('/unavailable', 2 * longest_delay + 1),
+                                  ('/stalled', 2 * read_timeout + 2 * longest_delay + 1), ('/truncated', 2 * longest_delay + 1), ('/missing', 1)]:
+            file_path = os.path.join(folder, path.strip('/'))
+            start_time = time.perf_counter()
+            try:
+                fetcher.download(server.url(path), file_path)
+                error = None
+            except RuntimeError as e:
+                error = e
+            seconds = time.perf_counter() - start_time
+            expected_requests = 1 if path in ('/ok', '/missing') else failures + 1
+            if path == '/missing': ok = error is not None and not os.path.exists(file_path)
+            else: ok = error is None and read_file(file_path) == BODY
+            ok = ok and server.requests[path] == expected_requests and seconds <= max_seconds and not os.path.exists(file_path + '.part')
+            if not ok: failing.append(path)
+            print(f"{path:>14}: {server.requests[path]} requests (expected {expected_requests}), {seconds:.2f}s (at most {max_seconds:.2f}s)"
+                  f"{'' if error is None else f', {error}'}{'' if ok else '  FAILED'}")
+    print('all downloads behave as expected' if len(failing) == 0 else f'{len(failing)} failing: {", ".join(failing)}')
+    return failing
@@ -0,0 +1,79 @@
+import os
+import time
+import random
+import shutil
+import tempfile
+from constants.engine_primitives import PDFTEX_PRIMITIVES, PDFTEX_CHECK
+from pipeline import compile_tex_files
+from pipeline.source_index import is_tex_file
+
+"""The line-by-line implementation that process_file replaced, without logging"""
+def legacy_process_file(file):
+    with open(file, 'r', errors='ignore') as fp:
+        lines = fp.readlines()
+    with open(file, 'w', errors='ignore') as fp:
+        for line in lines:
+            if PDFTEX_CHECK not in line: fp.write(line)
+            elif not any(primitive in line for primitive in PDFTEX_PRIMITIVES): fp.write(line)
+
+def current_process_file(file):
+    compile_tex_files.process_file(file, 'benchmark')
+
+"""Write a corpus of [num_papers] folders of tex files, with primitives, near-miss macros (e.g. \\pdfoutputfoo) and plain text"""
+def make_synthetic_corpus(folder, num_papers=200, files_per_paper=5, lines_per_file=500, seed=0):
+    rng = random.Random(seed)
+    words = ['lorem', 'ipsum', '\\cite{a}', '$x^2$', '\\textbf{b}', '\\pdfbookmark', '\\section{s}', 'dolor', '\\ref{fig}']
+    for i in range(num_papers):
+        paper_folder = os.path.join(folder, f'2306.{i:05d}')
+        os.makedirs(paper_folder, exist_ok=True)
+        for j in range(files_per_paper):
+            lines = []
+            for _ in range(lines_per_file):
+                r = rng.random()
+                if r < 0.005: lines.append(rng.choice(PDFTEX_PRIMITIVES) + '=1')
+                elif r < 0.01: lines.append(rng.choice(PDFTEX_PRIMITIVES) + 'foo{x}')
+                else: lines.append(' '.join(rng.choice(words) for _ in range(12)))
+            with open(os.path.join(paper_folder, f'section{j}.tex'), 'w') as file:
+                file.write('\n'.join(lines) + '\n')
+    return folder
+
+def get_tex_files(corpus_folder):
+    return [os.path.relpath(os.path.join(root, f), corpus_folder) for root, _, files in os.walk(corpus_folder) for f in files if is_tex_file(f)]
+
+def time_implementation(process, corpus_folder, tex_files, work_folder):
+    shutil.copytree(corpus_folder, work_folder)
+    start_time = time.perf_counter()
+    for tex_file in tex_files: process(os.path.join(work_folder, tex_file))
+    return time.perf_counter() - start_time
+
+"""Files whose output differs between the implementations. Returns (path, lines only removed by legacy, lines only removed by current)"""
+def compare_outputs(tex_files, legacy_folder, current_folder):
+    differences = []
+    for tex_file in tex_files:
+        with open(os.path.join(legacy_folder, tex_file), 'rb') as file: legacy = file.read().splitlines()
+        with open(os.path.join(current_folder, tex_file), 'rb') as file: current = file.read().splitlines()
+        if legacy == current: continue
+        legacy_set, current_set = set(legacy), set(current)
+        differences.append((tex_file, [l for l in current if l not in legacy_set], [l for l in legacy if l not in current_set]))
+    return differences
+
+"""Time both implementations over every tex file of the corpus (best of [repeat]) and check where their outputs differ"""
+def run(corpus_folder, repeat=3):
+    tex_files = get_tex_files(corpus_folder)
+    num_bytes = sum(os.path.getsize(os.path.join(corpus_folder, f)) for f in tex_files)
+    print(f'process_file: {len(tex_files)} tex files, {num_bytes / 1e6:.1f} MB from {corpus_folder}')
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        for name, process in [('legacy', legacy_process_file), ('current', current_process_file)]:
+            times = []
+            for i in range(repeat):
+                work_folder = os.path.join(tmp_folder, f'{name}_{i}')
+                times.append(time_implementation(process, corpus_folder, tex_files, work_folder))
+            results[name] = min(times)
+            print(f'{name:>8}: {results[name]:.3f}s ({num_bytes / 1e6 / results[name]:.1f} MB/s)')
+        print(f'speedup: {results["legacy"] / results["current"]:.2f}x')
+        differences = compare_outputs(tex_files, os.path.join(tmp_folder, 'legacy_0'), os.path.join(tmp_folder, 'current_0'))
+    print(f'{len(differences)} files differ (lines kept by current but removed by legacy are near-miss macros, e.g. \\pdfoutputfoo)')
+    for tex_file, kept, removed in differences[:5]:
+        print(f'\t{tex_file}: kept {len(kept)} lines, e.g. {kept[:2]}; removed {len(removed)} lines, e.g. {removed[:2]}')
+    return results, differences
@@ -0,0 +1,66 @@
+import time
+import numpy as np
+from skimage.metrics import structural_similarity
+from config import SIM_IMAGE_SIZE
+from img_comparison.batch_ssim import ssim_pairs
+from img_comparison.raster_store import RasterStore
+
+"""A word-like page: white with lines of dark blocks"""
+def make_page(rng):
+    width, height = SIM_IMAGE_SIZE
+    page = np.full((height, width), 255, dtype=np.uint8)
+    for top in range(60, height - 60, 18):
+        left = 80
+        while left < width - 120:
+            word_width = int(rng.integers(15, 70))
+            page[top:top+10, left:left+word_width] = rng.integers(0, 80)
+            left += word_width + 8
+    return page
+
+"""Pages of [num_groups] comparison groups like a converted paper: a baseline page, one engine's page with some words
+shifted by a pixel and, for [identical_fraction] of the groups, another engine's page equal to the baseline (else also shifted).
+Returns (pages, pairs of rows to compare)"""
+def make_synthetic_pages(num_groups, identical_fraction=0.5, seed=0):
+    rng = np.random.default_rng(seed)
+    pages, pairs = [], []
+    for g in range(num_groups):
+        baseline = make_page(rng)
+        shifted = baseline.copy()
+        for top in rng.choice(np.arange(60, baseline.shape[0] - 60, 18), 5):
+            shifted[top:top+10] = np.roll(baseline[top:top+10], 1, axis=1)
+        other = baseline.copy() if g < identical_fraction * num_groups else np.roll(shifted, 1, axis=0)
+        pairs += [(len(pages), len(pages) + 1), (len(pages), len(pages) + 2)]
+        pages += [baseline, shifted, other]
+    return np.stack(pages), pairs
+
+"""Every baseline (xelatex) and engine page pair in the raster store of a converted paper"""
+def load_store_pages(img_subdir):
+    store = RasterStore.open(img_subdir)
+    if store is None: raise ValueError(f'no raster store in {img_subdir}')
+    pairs = []
+    for members in store.cmp_groups().values():
+        if 'xelatex' not in members or len(members) < 2: continue
+        baseline_row = members.pop('xelatex')
+        pairs += [(baseline_row, row) for row in members.values()]
+    return store.pages, pairs
+
+"""Time skimage's structural_similarity, one pair at a time, against ssim_pairs on all pairs at once (best of [repeat])"""
+def run(pages, pairs, repeat=3):
+    num_equal = sum(np.array_equal(pages[i], pages[j]) for i, j in pairs)
+    print(f'ssim: {len(pairs)} page pairs of {pages.shape[2]}x{pages.shape[1]} ({num_equal} of equal pages) over {len(pages)} pages')
+    def per_pair():
+        return np.array([structural_similarity(pages[i], pages[j]) for i, j in pairs])
+    def batched():
+        return ssim_pairs(pages, pairs)
+    results, scores = {}, {}
+    for name, compute in [('per-pair', per_pair), ('batched', batched)]:
+        times = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            scores[name] = compute()
+            times.append(time.perf_counter() - start_time)
+        results[name] = min(times)
+        print(f'{name:>9}: {results[name]:.3f}s ({len(pairs) / results[name]:.1f} pairs/s)')
+    print(f'speedup: {results["per-pair"] / results["batched"]:.2f}x')
+    print(f'max difference in SSIM: {np.max(np.abs(scores["per-pair"] - scores["batched"])):.2e}')
+    return results
@@ -0,0 +1,104 @@
+import time
+import random
+import string
+import Levenshtein
+from analysis import compare_text_similarity as cts
+from analysis.anchored_diff import anchored_editops
+from utils.tex_engine_utils import DIFF_ENGINE_PAIRS, TEX_ENGINES
+
+WORDS = ['the', 'engine', 'of', 'figure', 'office', 'affine', 'theorem', 'proof', 'and', 'we', 'show', 'that', 'flow',
+         'efficient', 'is', 'a', 'for', 'Section', 'Lemma', 'with', 'bound', 'ﬁnite', 'graph', 'in', 'by', 'ﬂuid']
+CHARS_PER_PAGE = 3000
+
+"""Texts of a paper of [num_pages] pages per engine, like the extracted texts of one paper: the first engine's text, and
+for the others the same text with differences like those between engines (ligatures, case, hyphens, moved words)"""
+def make_synthetic_texts(num_pages, seed=0):
+    rng = random.Random(seed)
+    words, num_chars = [], 0
+    while num_chars < num_pages * CHARS_PER_PAGE:
+        words.append(rng.choice(WORDS))
+        num_chars += len(words[-1]) + 1
+    texts = { TEX_ENGINES[0]: ' '.join(words) }
+    for engine in TEX_ENGINES[1:]:
+        engine_words = list(words)
+        for _ in range(num_pages * 5):
+            i = rng.randrange(len(engine_words))
+            match rng.randrange(4):
+                case 0: engine_words[i] = engine_words[i].replace('ﬁ', 'fi').replace('ﬂ', 'fl')
+                case 1: engine_words[i] = engine_words[i].capitalize()
+                case 2: engine_words[i] = engine_words[i][:2] + '-' + engine_words[i][2:]
+                case 3: engine_words.insert(rng.randrange(len(engine_words)), engine_words.pop(i))
+        texts[engine] = ' '.join(engine_words)
+    return texts
+
+"""Texts where the other engines move a long block past short matching runs, like a float placed on another page:
+a block of random text followed by short chunks in the first engine's text, and the chunks (separated differently)
+followed by the block in the others"""
+def make_moved_block_texts(block_length=3000, num_chunks=6, chunk_length=40, seed=0):
+    rng = random.Random(seed)
+    def random_text(length): return ''.join(rng.choice(string.ascii_letters) for _ in range(length))
+    block, chunks = random_text(block_length), [random_text(chunk_length) for _ in range(num_chunks)]
+    texts = { TEX_ENGINES[0]: block + 'Q'.join(chunks) }
+    for engine in TEX_ENGINES[1:]: texts[engine] = 'Z'.join(chunks) + block
+    return texts
+
+"""The metrics and edit ops as computed before TextComparison: editops once for the edit ops and again for the debug
+edit ops, and each metric from the texts"""
+def legacy_text_comparison(pdf_texts):
+    metrics = { 'levenshtein': Levenshtein.distance, 'hamming': Levenshtein.hamming, 'levenshtein_ratio': Levenshtein.ratio,
+                'levenshtein_normalised': cts.normalise(Levenshtein.distance), 'hamming_normalised': cts.normalise(Levenshtein.hamming) }
+    results = {}
+    for e1, e2 in DIFF_ENGINE_PAIRS:
+        text1, text2 = pdf_texts[e1], pdf_texts[e2]
+        collated = cts.collate_edit_ops(cts.get_edit_ops(text1, text2))
+        grouped = cts.group_edit_ops(cts.get_edit_ops(text1, text2))
+        inserts = sum(count for (action, _, _), count in collated.items() if action == 'insert')
+        deletes = sum(count for (action, _, _), count in collated.items() if action == 'delete')
+        results[f'{e1}{e2}'] = ({ name: f(text1, text2) for name, f in metrics.items() }, collated, grouped, inserts - deletes)
+    return results
+
+def text_comparison(pdf_texts):
+    results = {}
+    for cmp, comparison in cts.compare_texts(pdf_texts).items():
+        metrics = { name: f(comparison) for name, f in cts.COMPARE_METHODS.items() }
+        results[cmp] = (metrics, comparison.collated_edit_ops, comparison.grouped_edit_ops, comparison.insert_minus_delete)
+    return results
+
+"""Time the metrics, edit ops and debug edit ops of every engine pair, computed as before and with TextComparison (best of [repeat])"""
+def run(pdf_texts, repeat=3):
+    print(f"text comparison: {len(DIFF_ENGINE_PAIRS)} engine pairs of {', '.join(f'{len(text)}' for text in pdf_texts.values())} chars")
+    times, results = {}, {}
+    for name, compare in [('before', legacy_text_comparison), ('single pass', text_comparison)]:
+        run_times = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            results[name] = compare(pdf_texts)
+            run_times.append(time.perf_counter() - start_time)
+        times[name] = min(run_times)
+        print(f'{name:>11}: {times[name]:.2f}s')
+    print(f"speedup: {times['before'] / times['single pass']:.2f}x")
+    print('results are identical' if results['before'] == results['single pass'] else 'RESULTS DIFFER')
+    return times
+
+"""Time Levenshtein.editops on whole texts against anchored_editops for every engine pair (best of [repeat]), and check
+that they find as many edit ops, of the same kinds, as the Levenshtein distance"""
+def run_alignment(pdf_texts, repeat=3):
+    times, same = { 'whole text': 0, 'anchored': 0 }, True
+    for e1, e2 in DIFF_ENGINE_PAIRS:
+        text1, text2 = pdf_texts[e1], pdf_texts[e2]
+        ops = {}
+        for name, editops in [('whole text', Levenshtein.editops), ('anchored', anchored_editops)]:
+            run_times = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                ops[name] = editops(text1, text2)
+                run_times.append(time.perf_counter() - start_time)
+            times[name] += min(run_times)
+        collated = { name: cts.collate_edit_ops([cts.transform_op(op, text1, text2) for op in pair_ops]) for name, pair_ops in ops.items() }
+        pair_same = collated['whole text'] == collated['anchored'] and len(ops['anchored']) == Levenshtein.distance(text1, text2)
+        print(f"{e1}{e2}: {len(ops['whole text'])} edit ops on the whole text, {len(ops['anchored'])} anchored, "
+              f"{'same' if pair_same else 'DIFFERENT'} counts of each (action, from, to)")
+        same = same and pair_same
+    for name, seconds in times.items(): print(f'{name:>11}: {seconds:.2f}s')
+    print(f"speedup: {times['whole text'] / times['anchored']:.2f}x")
+    return same
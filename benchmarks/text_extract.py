@@ -0,0 +1,64 @@
+import os
+import time
+import hashlib
+import tracemalloc
+import fitz
+from text_based_comparison import extract
+from benchmarks.tile_diff import make_pdf
+
+"""get_text_fonts_images as it was: the text, formatting and debug content of every span of the whole document, built at once"""
+def legacy_get_text_fonts_images(pdf_path):
+    pdf_document = fitz.Document(pdf_path)
+    debug_content = []
+    full_text, text_with_formatting, fonts_used, images, num_pages = [], {}, set(), [], pdf_document.page_count
+    for page_num in range(pdf_document.page_count):
+        page = pdf_document[page_num]
+        images += [extract.ImageInfo( imginfo['digest'], (imginfo['width'], imginfo['height']) ) for imginfo in page.get_image_info(hashes=True)]
+        blocks = page.get_text("dict", sort=True, flags=extract.TEXT_EXTRACTION_FLAGS)['blocks']
+        for block in blocks:
+            if block['type'] == 1:
+                debug_content.append(extract.ImageInfo(hashlib.md5(block['image']).hexdigest(), (block['width'], block['height'])))
+                continue
+            for line in block['lines']:
+                for span in line['spans']:
+                    font_information = extract.FontInformation(span['font'], span['flags'], span['color'], round(span['size']*2)/2)
+                    fonts_used.add(font_information)
+                    debug_content.append( (font_information, span['text']) )
+                    if font_information not in text_with_formatting: text_with_formatting[font_information] = []
+                    text_with_formatting[font_information].append(span['text'])
+                    full_text.append(span['text'].replace(' ', '\n'))
+    pdf_document.close()
+    return extract.PdfContent('\n'.join(full_text), text_with_formatting, fonts_used, images, num_pages), debug_content
+
+"""A pdf of [num_pages] pages of text, with a bold heading and an image on each page"""
+def make_sample_pdf(path, num_pages):
+    def add_heading_and_image(page, page_number):
+        page.insert_text((72, 60), f'Section {page_number + 1}', fontname='hebo', fontsize=14)
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 200, 150), 0)
+        pix.clear_with(page_number % 256)
+        page.insert_image(fitz.Rect(72, 600, 272, 750), pixmap=pix)
+    make_pdf(path, num_pages, add_heading_and_image)
+
+"""(result, seconds, peak bytes allocated by python)"""
+def measure(f):
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = f()
+    seconds = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+"""Extract each pdf of [pdf_paths] as before and page by page, without and with debug content, and check the contents are identical"""
+def run(pdf_paths):
+    same = True
+    for pdf_path in pdf_paths:
+        (legacy_content, legacy_debug), legacy_seconds, legacy_peak = measure(lambda: legacy_get_text_fonts_images(pdf_path))
+        content, seconds, peak = measure(lambda: extract.get_text_fonts_images(pdf_path))
+        debug = []
+        debug_content = extract.get_text_fonts_images(pdf_path, extract.PAGE_FIELDS, on_page=lambda page: debug.extend(page.debug))
+        pdf_same = content == legacy_content._replace(text_with_formatting=None) and debug_content == legacy_content and debug == legacy_debug
+        same = same and pdf_same
+        print(f'{os.path.basename(pdf_path)} ({legacy_content.num_pages} pages): {legacy_seconds:.2f}s -> {seconds:.2f}s, '
+              f"peak {legacy_peak / 1e6:.1f}MB -> {peak / 1e6:.1f}MB, {'identical' if pdf_same else 'DIFFERENT'} content")
+    return same
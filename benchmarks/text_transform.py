@@ -0,0 +1,71 @@
+import os
+import time
+import random
+import analysis.text_transformer as Ttr
+from analysis.compare_text_similarity import extract_pages_and_images_from_pdfs
+from text_based_comparison.compare_text import TEXT_TRANSFORM
+from benchmarks.text_comparison import make_synthetic_texts
+
+ACCENT_MARKS = '`¨¯´¸ˆˇ˘˙˚˜˝'
+
+"""Pages of extracted text per engine, from the synthetic texts of text_comparison with some separated accents and line breaks"""
+def make_synthetic_pages(num_pages, seed=0):
+    rng = random.Random(seed)
+    engine_pages = {}
+    for engine, text in make_synthetic_texts(num_pages, seed).items():
+        words = text.split(' ')
+        for _ in range(num_pages * 20):
+            i = rng.randrange(len(words))
+            words[i] = rng.choice(ACCENT_MARKS) + words[i]
+        lines = [' '.join(words[i:i+12]) for i in range(0, len(words), 12)]
+        engine_pages[engine] = ['\n'.join(lines[i:i+40]) for i in range(0, len(lines), 40)]
+    return engine_pages
+
+"""Extracted pages of up to [max_papers] papers of a folder of compiled pdfs, per engine"""
+def load_corpus_pages(compiled_folder, max_papers):
+    engine_pages = []
+    for arxiv_id in sorted(os.listdir(compiled_folder))[:max_papers]:
+        pdf_pages, _ = extract_pages_and_images_from_pdfs(compiled_folder, arxiv_id)
+        engine_pages += pdf_pages.values()
+    return engine_pages
+
+"""TextTransformer.process as it was: one str.replace per rule"""
+def legacy_process(transformer, pages):
+    processed_pages = [Ttr.TextTransformer.apply_transform(page, transformer.pre_transformations) for page in pages]
+    return Ttr.TextTransformer.apply_transform(transformer.page_break_delimiter.join(processed_pages), transformer.post_transformations)
+
+"""Random short strings of the chars of the rules of [compiled], where the order of the rules matters most"""
+def same_on_random_strings(compiled, num_strings=20000, seed=0):
+    rng = random.Random(seed)
+    alphabet = sorted(set(''.join(old + new for old, new in compiled.transformations)) | set('ab -\n'))
+    for _ in range(num_strings):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randrange(12)))
+        if compiled(text) != Ttr.TextTransformer.apply_transform(text, compiled.transformations): return False
+    return True
+
+"""Time the analysis transformer and text_based_comparison's transformation with one str.replace per rule against the
+compiled passes on [papers_pages] (a list of lists of pages, best of [repeat]), and check the texts are identical"""
+def run(papers_pages, repeat=3):
+    transformer = Ttr.transformer_ignore_hyphenbreak_pagebreak_linebreak
+    num_chars = sum(len(page) for pages in papers_pages for page in pages)
+    print(f'text transform: {len(papers_pages)} documents, {num_chars} chars')
+    implementations = {
+        'per rule': lambda pages: (legacy_process(transformer, pages), Ttr.TextTransformer.apply_transform('\n'.join(pages), TEXT_TRANSFORM.transformations)),
+        'compiled': lambda pages: (transformer.process(pages), TEXT_TRANSFORM('\n'.join(pages))),
+    }
+    times, results = {}, {}
+    for name, transform in implementations.items():
+        run_times = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            results[name] = [transform(pages) for pages in papers_pages]
+            run_times.append(time.perf_counter() - start_time)
+        times[name] = min(run_times)
+        print(f'{name:>9}: {times[name]:.3f}s')
+    print(f"speedup: {times['per rule'] / times['compiled']:.2f}x")
+    for compiled in [transformer.pre_transform, transformer.post_transform, TEXT_TRANSFORM]:
+        print(f'{len(compiled.transformations)} rules in {len(compiled.passes)} passes, '
+              f"{'same' if same_on_random_strings(compiled) else 'DIFFERENT'} results on random strings of their chars")
+    same = results['per rule'] == results['compiled']
+    print('texts are identical' if same else 'TEXTS DIFFER')
+    return same
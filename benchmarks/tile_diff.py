@@ -0,0 +1,84 @@
+import os
+import time
+import shutil
+import subprocess
+from collections import Counter
+import fitz
+from pipeline import pdf_diff
+
+TEXT = ('Structural similarity compares local patterns of pixel intensities that have been normalised for luminance '
+        'and contrast. The engines differ in font loading, hyphenation and the handling of primitives, so most pages '
+        'either match exactly or differ in a handful of glyphs. ') * 6
+
+"""Writes a pdf of [num_pages] pages of text, with [edit](page, page number) applied to each page"""
+def make_pdf(path, num_pages=3, edit=None):
+    doc = fitz.open()
+    for page_number in range(num_pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(72, 72, 523, 770), f'{page_number + 1}. {TEXT}', fontsize=10, fontname='helv')
+        if edit is not None: edit(page, page_number)
+    doc.save(path)
+
+"""A fixed sample of pdf pairs with differences from none to whole pages, including ones too small to show at a low dpi.
+Returns { name: (path1, path2) }"""
+def make_sample_pdfs(folder):
+    def on_page(page_number, draw):
+        return lambda page, i: draw(page) if i == page_number else None
+    edits = {
+        'identical': None,
+        'changed-word': on_page(1, lambda page: page.insert_text((300, 400), 'hyphenation', fontsize=10)),
+        'tiny-shift': on_page(0, lambda page: page.insert_text((100.02, 780), '.', fontsize=10)),
+        # a shift too small for the coarse pass on a page that also differs visibly elsewhere
+        'shift-and-word': on_page(0, lambda page: (page.insert_text((100.03, 780), '.', fontsize=10), page.insert_text((300, 400), 'hyphenation', fontsize=10))),
+        'hairline': on_page(2, lambda page: page.draw_line((72, 790), (523, 790), width=0.05)),
+        'faint-dot': on_page(0, lambda page: page.draw_rect(fitz.Rect(500, 60, 500.3, 60.3), color=(0.9, 0.9, 0.9), fill=(0.9, 0.9, 0.9), width=0)),
+        'other-font': lambda page, i: page.insert_textbox(fitz.Rect(72, 72, 523, 770), 'x', fontsize=10, fontname='tiro'),
+    }
+    os.makedirs(folder, exist_ok=True)
+    baseline = os.path.join(folder, 'baseline.pdf')
+    make_pdf(baseline, edit=lambda page, i: page.insert_text((100, 780), '.', fontsize=10) if i == 0 else None)
+    pairs = {}
+    for name, edit in edits.items():
+        path = os.path.join(folder, f'{name}.pdf')
+        if name in ('tiny-shift', 'shift-and-word'): make_pdf(path, edit=edit)
+        else: make_pdf(path, edit=lambda page, i, edit=edit: (page.insert_text((100, 780), '.', fontsize=10) if i == 0 else None, edit(page, i) if edit else None))
+        pairs[name] = (baseline, path)
+    extra_page = os.path.join(folder, 'extra-page.pdf')
+    make_pdf(extra_page, num_pages=4, edit=lambda page, i: page.insert_text((100, 780), '.', fontsize=10) if i == 0 else None)
+    pairs['extra-page'] = (baseline, extra_page)
+    return pairs
+
+"""Diff one pair, returning (equal, { page number: differing pixels }, seconds)"""
+def diff_pair(path1, path2, dpi, tolerance, coarse_dpi=None, tile_size=32, stats=None):
+    regions = {}
+    start_time = time.perf_counter()
+    equal = pdf_diff.diff_pdfs({ 1: path1, 2: path2 }, [(1, 2)], dpi, tolerance, regions=regions, stats=stats, coarse_dpi=coarse_dpi, tile_size=tile_size)[(1, 2)]
+    seconds = time.perf_counter() - start_time
+    counts = Counter()
+    for page_index, (_, _, _, _, num_pixels) in regions.get((1, 2), []): counts[page_index + 1] += num_pixels
+    return equal, dict(counts), seconds
+
+"""Whether diff-pdf finds the pair equal, or None if diff-pdf is not installed"""
+def diff_pdf_verdict(path1, path2, dpi, tolerance):
+    if shutil.which('diff-pdf') is None: return None
+    return subprocess.run(['diff-pdf', '-s', f'--dpi={dpi}', f'--per-page-pixel-tolerance={tolerance}', path1, path2], capture_output=True).returncode == 0
+
+"""Diff each pair (name -> (path1, path2)) at full [dpi] and with the coarse pass, and check that they agree with each other
+and with diff-pdf (if installed) on equality and on the differing pixels of each page. Returns the names of pairs that disagree"""
+def run(pairs, dpi, tolerance, coarse_dpi, tile_size=32):
+    mismatches = []
+    total_times, stats = Counter(), Counter()
+    for name, (path1, path2) in pairs.items():
+        full_equal, full_counts, full_time = diff_pair(path1, path2, dpi, tolerance)
+        tiled_equal, tiled_counts, tiled_time = diff_pair(path1, path2, dpi, tolerance, coarse_dpi, tile_size, stats)
+        diff_pdf_equal = diff_pdf_verdict(path1, path2, dpi, tolerance)
+        total_times['full'] += full_time
+        total_times['tiled'] += tiled_time
+        agrees = full_equal == tiled_equal and full_counts == tiled_counts and diff_pdf_equal in (None, tiled_equal)
+        if not agrees: mismatches.append(name)
+        print(f"{name:>14}: equal={tiled_equal} (full: {full_equal}, diff-pdf: {'-' if diff_pdf_equal is None else diff_pdf_equal}), "
+              f"differing pixels per page {tiled_counts} (full: {full_counts}){'' if agrees else '  MISMATCH'}")
+    print(f"tiles rendered at {dpi} dpi: {stats['tiles_rendered']}/{stats['tiles']}")
+    print(f"full: {total_times['full']:.2f}s, coarse {coarse_dpi} dpi then tiles: {total_times['tiled']:.2f}s")
+    print('all verdicts and page counts agree' if len(mismatches) == 0 else f'disagreements: {mismatches}')
+    return mismatches
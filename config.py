@@ -13,17 +13,60 @@ COMPILED_FOLDER = os.path.join(PROJECT_BIN, 'compiled_tex_pdf')
 # COMPILED_FOLDER = os.path.join(PROJECT_BIN, 'version_compiled_pdf')
 COMPILED_FOLDER_2020 = os.path.join(PROJECT_BIN, 'version_compiled_pdf_2020')
 DIFFS_FOLDER = os.path.join(PROJECT_BIN, 'diff_pdfs')
+HIGHLIGHTED_DIFFS_FOLDER = os.path.join(PROJECT_BIN, 'highlighted_diffs')   # pngs of highlighted diff pages
+MANIFEST_PATH = os.path.join(PROJECT_BIN, 'manifest.sqlite')   # records completed stages, for resuming runs
 
 YEAR_AND_MONTH = '2306'
 NUM_ATTEMPTS = 3
 TEX_FILE_DOWNLOAD_XPATH = '//*[@id="dlpage"]/dl'
+ARXIV_BASE_URL = 'https://arxiv.org'
+DOWNLOAD_JOBS = 4           # concurrent connections for listing pages and downloads
+DOWNLOAD_RATE_LIMIT = 4     # max requests per second, across all connections
+DOWNLOAD_RETRIES = 3        # retries per request, with exponential backoff
+DOWNLOAD_TIMEOUT = (10, 60) # seconds to connect, and between bytes read. a timed out request is retried
 # leave this empty if running for all
 DOWNLOAD_BY_ARXIV_IDS = [ '2306.00036', '2306.00207', '2306.00417', '2306.00001', '2306.00002', '2306.00057', '2306.01691', '2306.00004', '2306.00022', '2306.01308' ]
 # DOWNLOAD_BY_ARXIV_IDS = []
 
 PIXEL_TOLERANCE = 500
+DIFF_BACKEND = 'native'     # 'native' (PyMuPDF, each pdf rendered once), 'tiled' (native, with a coarse pass first) or 'diff-pdf' (subprocess per pair)
+DIFF_DPI = 300
+DIFF_COARSE_DPI = 60    # for 'tiled': pages are rendered at this dpi first (must divide DIFF_DPI), then only differing tiles at DIFF_DPI
+DIFF_TILE_SIZE = 32     # for 'tiled': in coarse pixels
+STRUCTURAL_PRECHECK = True  # skip rasterizing pages whose glyphs, drawings and images are identical
+DIFF_REGIONS_PATH = os.path.join(PROJECT_BIN, 'diff_regions.sqlite')  # bounding boxes of differing regions, from the native diff backend
+DIFF_REGION_MERGE_DISTANCE = 10  # pixels at DIFF_DPI: differing pixels closer than this are one region, e.g. a word or a line
+
+NUM_JOBS = 1    # number of worker processes for extraction and compilation. override with `python main.py -jobs N`
+
+# for compilation
+COMPILE_TIMEOUT = 60    # seconds, per (arxiv_id, engine) job, until the cost model has enough samples
+ADAPTIVE_COMPILE_TIMEOUT = True     # predict per-job timeouts from COMPILE_STATS_PATH
+COMPILE_TIMEOUT_MIN = 30
+COMPILE_TIMEOUT_MAX = 600
+COMPILE_COST_MODEL_MIN_SAMPLES = 20
+COMPILE_STATS_PATH = os.path.join(PROJECT_BIN, 'compile_stats.csv')  # wall time, latexmk rules and peak RSS per job
+CONCURRENT_ENGINES = False  # with -jobs 1, still run the engines of each paper concurrently
+TEXMF_CACHE_FOLDER = os.path.join(PROJECT_BIN, 'texmf_cache')   # per-engine TEXMFVAR and font caches
+SOURCE_INDEX_FOLDER = os.path.join(PROJECT_BIN, 'source_index')  # entrypoint detection, cached per archive hash
+USE_COMPILE_CACHE = True
+COMPILE_CACHE_FOLDER = os.path.join(PROJECT_BIN, 'compile_cache')
+COMPILE_CACHE_MAX_BYTES = 20 * 1024**3
 
 # for img comparison
 CONVERTED_IMG_FOLDER = os.path.join(PROJECT_BIN, 'converted_img')
 CONVERT_FIRST_N_PAGES = 3
 CONVERT_LAST_N_PAGES = 3
+SIM_IMAGE_SIZE = (1295, 1000)  # cv2.resize dsize, i.e. (width, height): pages are compared as 1000 rows x 1295 columns
+SAVE_CONVERTED_JPEGS = False    # pages are compared from a grayscale store (pages.npy), jpegs are only for viewing
+USE_RASTER_CACHE = True     # rendered pages of image comparison, cached in gray unless SAVE_CONVERTED_JPEGS
+CACHE_DIFF_RASTERS = False  # also cache the rgb pages of diffing and highlighting (~25MB per page at DIFF_DPI), only read again when a paper is diffed again
+RASTER_CACHE_FOLDER = os.path.join(PROJECT_BIN, 'raster_cache')
+RASTER_CACHE_MAX_BYTES = 10 * 1024**3
+IMG_CMP_PAGES_PER_TASK = 2  # with -jobs N, a paper's cmp pages are compared in tasks of this many pages
+
+# for text comparison
+ANCHORED_EDIT_OPS = False   # Levenshtein edit ops only between substrings that are unique in both texts (analysis/anchored_diff.py), not over whole documents
+# the anchored edit ops have the same counts of each (action, from, to) as whole-text ones, but where equally cheap
+# alignments exist ops can be at other positions, changing the grouped edit ops (debug output, saved editops_*.txt).
+# those always use whole-text edit ops
@@ -2,6 +2,7 @@ import os
 from typing import Dict, List, Set
 from tqdm import tqdm
 from config import COMPILED_FOLDER, COMPILED_FOLDER_2020
+from pipeline.compile_stats import RUNNING_RULE_PATTERN, RUNNING_RULE_PATTERN_2020
 import re
 import pandas as pd
 import csv
@@ -23,8 +24,6 @@ def count_latexmk_rule_runs() -> tuple[
         Dict[str, Dict[str, List[str]]],  # named_runs = { '2020': ['pdftex', 'bibtex'], '2021': ... }
         Dict[str, Dict[str, int]]  # number_of_bibtex_errors = { '2020': 1, '2021': 2, ... }
     ]:
-    RUNNING_RULE_PATTERN_2020 = re.compile(r"Latexmk: applying rule '(.+)'...")
-    RUNNING_RULE_PATTERN = re.compile(r"------------\s*\n\s*Run number \d+ of rule '(.+)'")
     BIBTEX_ERRORS_PATTERN = re.compile(r"\(There were (\d+) error messages\)")
     print('running for 2020')
     number_of_runs = {}
@@ -0,0 +1,62 @@
+import numpy as np
+from scipy.ndimage import uniform_filter, gaussian_filter
+
+# defaults of skimage.metrics.structural_similarity, which this reproduces for stacks of 2d pages
+WIN_SIZE = 7
+K1, K2 = 0.01, 0.03
+GAUSSIAN_SIGMA, GAUSSIAN_TRUNCATE = 1.5, 3.5
+# pairs per chunk. each page of SIM_IMAGE_SIZE takes ~10MB per float64 intermediate, and there are a few per page and pair
+BATCH_SIZE = 4
+
+# SSIM of pairs of pages of one (N, H, W) stack, e.g. every engine pair of every page of a paper. [pairs] is a list of
+# (i, j) rows of [pages], which may be a memory-mapped array: only the pages of one chunk of pairs are loaded at a time.
+# matches structural_similarity(pages[i], pages[j]) with the same arguments: uniform 7x7 window (or gaussian with sigma 1.5),
+# sample covariance, and the mean taken without the window radius at the borders. the window means and variances of a page
+# are computed once per chunk however many pairs it is in, and pairs of equal pages are 1 without filtering.
+# returns an array of mean SSIMs, one per pair, and with [full] also the (len(pairs), H, W) SSIM maps, e.g. to locate differences
+def ssim_pairs(pages, pairs, data_range=None, gaussian_weights=False, full=False, batch_size=BATCH_SIZE):
+    if pages.ndim != 3: raise ValueError(f'expected a stack of pages, got shape {pages.shape}')
+    if data_range is None:
+        if not np.issubdtype(pages.dtype, np.integer): raise ValueError('data_range is required for floating point pages')
+        data_range = np.iinfo(pages.dtype).max - np.iinfo(pages.dtype).min
+    win_size = 2 * int(GAUSSIAN_TRUNCATE * GAUSSIAN_SIGMA + 0.5) + 1 if gaussian_weights else WIN_SIZE
+    if min(pages.shape[1:]) < win_size: raise ValueError(f'pages must be at least {win_size}x{win_size}')
+    # filter within each page only: nothing along the stack axis
+    if gaussian_weights:
+        def filter_func(img): return gaussian_filter(img, sigma=(0, GAUSSIAN_SIGMA, GAUSSIAN_SIGMA), truncate=GAUSSIAN_TRUNCATE, mode='reflect')
+    else:
+        def filter_func(img): return uniform_filter(img, size=(1, win_size, win_size))
+    num_window_pixels = win_size ** 2
+    cov_norm = num_window_pixels / (num_window_pixels - 1)
+    C1, C2 = (K1 * data_range) ** 2, (K2 * data_range) ** 2
+    pad = (win_size - 1) // 2
+    height, width = pages.shape[1:]
+
+    mssims = np.ones(len(pairs))
+    ssim_maps = np.ones((len(pairs), height, width)) if full else None
+    # S is exactly 1 everywhere for equal pages
+    to_compute = [k for k, (i, j) in enumerate(pairs) if i != j and not np.array_equal(pages[i], pages[j])]
+    for start in range(0, len(to_compute), batch_size):
+        chunk = to_compute[start:start+batch_size]
+        rows = sorted({ row for k in chunk for row in pairs[k] })
+        position = { row: p for p, row in enumerate(rows) }
+        X = pages[rows].astype(np.float64)
+        # per page
+        u = filter_func(X)
+        v = cov_norm * (filter_func(X * X) - u * u)
+        # per pair
+        first = [position[pairs[k][0]] for k in chunk]
+        second = [position[pairs[k][1]] for k in chunk]
+        ux, uy, vx, vy = u[first], u[second], v[first], v[second]
+        vxy = cov_norm * (filter_func(X[first] * X[second]) - ux * uy)
+        S = ((2 * ux * uy + C1) * (2 * vxy + C2)) / ((ux ** 2 + uy ** 2 + C1) * (vx + vy + C2))
+        mssims[chunk] = S[:, pad:height-pad, pad:width-pad].mean(axis=(1, 2), dtype=np.float64)
+        if full: ssim_maps[chunk] = S
+    return (mssims, ssim_maps) if full else mssims
+
+# SSIM of every pair of pages (x[i], y[i]) of two (N, H, W) stacks, see ssim_pairs
+def batch_ssim(x, y, data_range=None, gaussian_weights=False, full=False, batch_size=BATCH_SIZE):
+    x, y = np.asarray(x), np.asarray(y)
+    if x.shape != y.shape or x.ndim != 3: raise ValueError(f'expected two stacks of pages of the same shape, got {x.shape} and {y.shape}')
+    pairs = [(i, len(x) + i) for i in range(len(x))]
+    return ssim_pairs(np.concatenate([x, y]), pairs, data_range, gaussian_weights, full, batch_size)
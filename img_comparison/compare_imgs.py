@@ -1,20 +1,21 @@
 import os
 import cv2
+from collections import OrderedDict
 from PIL import Image
 from skimage.metrics import structural_similarity
 import ssim.ssimlib as pyssim
-from config import CONVERTED_IMG_FOLDER
+from config import CONVERTED_IMG_FOLDER, SIM_IMAGE_SIZE
+from img_comparison.raster_store import RasterStore
+from img_comparison.batch_ssim import ssim_pairs
 from utils.logger import COMPARISON_LOGGER as LOGGER
 from utils.tex_engine_utils import TEX_ENGINES
 
-SIM_IMAGE_SIZE = (1295, 1000)  # height*width. roughly a4 paper dimensions
-
-# comparison algos
+# comparison algos. [ids] identify the two pages (e.g. a raster store row) for caching per-page work, or are None
 CMP_ALGORITHMS = {
-    'SSIM': lambda i1,i2: { 'SSIM': structural_similarity(i1,i2) },
-    'CWSSIM': lambda i1,i2: { 'CWSSIM': pyssim.SSIM(Image.fromarray(i1)).cw_ssim_value(Image.fromarray(i2)) },
-    'ORB': lambda i1,i2: compare_with_score_calculation(i1, i2, 'ORB'),
-    'SIFT': lambda i1,i2: compare_with_score_calculation(i1, i2, 'SIFT'),
+    'SSIM': lambda i1,i2,ids=(None,None): { 'SSIM': structural_similarity(i1,i2) },
+    'CWSSIM': lambda i1,i2,ids=(None,None): { 'CWSSIM': pyssim.SSIM(Image.fromarray(i1)).cw_ssim_value(Image.fromarray(i2)) },
+    'ORB': lambda i1,i2,ids=(None,None): compare_with_score_calculation(i1, i2, 'ORB', ids),
+    'SIFT': lambda i1,i2,ids=(None,None): compare_with_score_calculation(i1, i2, 'SIFT', ids),
 }
 CMP_ALGO_THRESHOLDS = {
     'SSIM': 0.7,
@@ -24,19 +25,47 @@ CMP_ALGO_THRESHOLDS = {
 }
 assert(CMP_ALGORITHMS.keys() == CMP_ALGO_THRESHOLDS.keys())
 
-def compare_with_score_calculation(img1, img2, cmp_method):
+# keypoint detectors, created once per process
+DETECTOR_FACTORIES = { 'ORB': cv2.ORB_create, 'SIFT': cv2.SIFT_create }
+DETECTOR_PARAMS = { 'ORB': { 'nfeatures': 1000 }, 'SIFT': { 'nfeatures': 1000 } }
+ALGO_NORM_METHODS = { 'ORB': cv2.NORM_HAMMING, 'SIFT': cv2.NORM_L1 }
+# pages whose descriptors are kept. a page is only compared within its paper, so this only has to hold a paper's pages
+DESCRIPTOR_CACHE_SIZE = 64
+_DETECTORS = {}
+
+def get_detector(cmp_method):
+    if cmp_method not in _DETECTORS: _DETECTORS[cmp_method] = DETECTOR_FACTORIES[cmp_method](**DETECTOR_PARAMS[cmp_method])
+    return _DETECTORS[cmp_method]
+
+# (number of keypoints, descriptors) per (page id, algorithm, detector params), so that e.g. the xelatex baseline page is
+# only described once, however many engines it is compared with. least recently used pages are dropped first
+class DescriptorCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def get(self, img, img_id, cmp_method):
+        key = None if img_id is None else (img_id, cmp_method, tuple(sorted(DETECTOR_PARAMS[cmp_method].items())))
+        if key is not None and key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        kps, des = get_detector(cmp_method).detectAndCompute(img, None)
+        if key is not None:
+            self.entries[key] = (len(kps), des)
+            if len(self.entries) > self.max_entries: self.entries.popitem(last=False)
+        return len(kps), des
+
+DESCRIPTOR_CACHE = DescriptorCache(DESCRIPTOR_CACHE_SIZE)
+
+def compare_with_score_calculation(img1, img2, cmp_method, img_ids=(None, None)):
     result = {}
-    ALGOS = {
-        'ORB': cv2.ORB_create(nfeatures=1000),
-        'SIFT': cv2.SIFT_create(nfeatures=1000),
-    }
-    ALGO_NORM_METHODS = { 'ORB': cv2.NORM_HAMMING, 'SIFT': cv2.NORM_L1 }
-    assert(cmp_method in ALGOS and cmp_method in CMP_ALGO_THRESHOLDS and cmp_method in ALGO_NORM_METHODS)
-    # Read imgs and compare
-    cmp_algo = ALGOS[cmp_method]
-    kps1, des1 = cmp_algo.detectAndCompute(img1,None)
-    kps2, des2 = cmp_algo.detectAndCompute(img2,None)
-    num_kps1, num_kps2 = len(kps1), len(kps2)
+    assert(cmp_method in DETECTOR_FACTORIES and cmp_method in CMP_ALGO_THRESHOLDS and cmp_method in ALGO_NORM_METHODS)
+    # describe (or look up) both imgs and compare
+    num_kps1, des1 = DESCRIPTOR_CACHE.get(img1, img_ids[0], cmp_method)
+    num_kps2, des2 = DESCRIPTOR_CACHE.get(img2, img_ids[1], cmp_method)
     # initialise BFMatcher
     bf = cv2.BFMatcher(normType=ALGO_NORM_METHODS[cmp_method], crossCheck=True)
     # matches = bf.knnMatch(des1,des2, k=2)
@@ -60,40 +89,91 @@ def compare_with_score_calculation(img1, img2, cmp_method):
             result[cmp_method] = similarity_count/min(num_kps1, num_kps2)
     return result
 
-def get_similarity_scores(img1, img2, algorithm='SSIM'):
+def get_similarity_scores(img1, img2, algorithm='SSIM', img_ids=(None, None)):
     assert(algorithm in CMP_ALGORITHMS)
     cmp_method = CMP_ALGORITHMS[algorithm]
-    return cmp_method(img1, img2)
+    return cmp_method(img1, img2, img_ids)
 
 def run_img_comparisons(imgpath1, imgpath2, algorithms=list(CMP_ALGORITHMS.keys())):
     i1 = cv2.resize(cv2.imread(imgpath1, cv2.IMREAD_GRAYSCALE), SIM_IMAGE_SIZE)
     i2 = cv2.resize(cv2.imread(imgpath2, cv2.IMREAD_GRAYSCALE), SIM_IMAGE_SIZE)
+    img_ids = tuple((path, os.stat(path).st_mtime_ns) for path in (imgpath1, imgpath2))
+    return run_img_comparisons_on_arrays(i1, i2, algorithms, f'{os.path.basename(imgpath1)}<>{os.path.basename(imgpath2)}', img_ids=img_ids)
+
+# [i1] and [i2] are grayscale pages of SIM_IMAGE_SIZE. [precomputed] maps algorithm -> scores that were computed already
+def run_img_comparisons_on_arrays(i1, i2, algorithms, label, precomputed={}, img_ids=(None, None)):
     scores = {}
     for algo in algorithms:
-        algo_scores = get_similarity_scores(i1, i2, algo)
+        algo_scores = precomputed[algo] if algo in precomputed else get_similarity_scores(i1, i2, algo, img_ids)
         for score_name, score_value in algo_scores.items():
-            LOGGER.debug(f'{score_name}: {score_value} for {os.path.basename(imgpath1)}<>{os.path.basename(imgpath2)}')
+            LOGGER.debug(f'{score_name}: {score_value} for {label}')
             scores[score_name] = score_value
     return scores
 
-def main(arxiv_id, algos):  # arxiv_id including YYMM
-    img_subdir = os.path.join(CONVERTED_IMG_FOLDER, arxiv_id)
-    if not os.path.exists(img_subdir) or not os.path.isdir(img_subdir):
-        LOGGER.debug(f'{img_subdir} not found - skipping')
-        return {}
-    images_in_dir = os.listdir(img_subdir)
-    # split the images into comparison groups
+# compare pages from the paper's raster store, sliced from one memory-mapped array.
+# SSIM is computed for every page and engine pair of the paper (or of [pages], if given) in one batch
+def compare_from_store(arxiv_id, store, algos, pages=None):
+    CMP_BASELINE = 'xelatex'
+    # (pg, engine, baseline row, engine row) of every comparison
+    comparisons = []
+    for pg, cmp_grp_members in store.cmp_groups().items():
+        if pages is not None and pg not in pages: continue
+        if len(cmp_grp_members) < 2 or CMP_BASELINE not in cmp_grp_members: continue
+        baseline_row = cmp_grp_members.pop(CMP_BASELINE)
+        comparisons += [(pg, engine, baseline_row, row) for engine, row in cmp_grp_members.items()]
+    ssims = [None] * len(comparisons)
+    if 'SSIM' in algos and len(comparisons) > 0:
+        ssims = ssim_pairs(store.pages, [(baseline_row, row) for _, _, baseline_row, row in comparisons])
+    RESULT = {}
+    for (pg, engine, baseline_row, row), ssim in zip(comparisons, ssims):
+        precomputed = {} if ssim is None else { 'SSIM': { 'SSIM': ssim } }
+        engine_result = run_img_comparisons_on_arrays(store.pages[baseline_row], store.pages[row], algos, f'{arxiv_id}_{CMP_BASELINE}_{pg}<>{engine}_{pg}', precomputed, (store.page_id(baseline_row), store.page_id(row)))
+        result_for_page = RESULT.setdefault(pg, {})
+        for cmp_algo, value in engine_result.items():
+            result_for_page[f'{CMP_BASELINE[:-5]}{engine[:-5]}_{cmp_algo}'] = value
+    return RESULT
+
+# cmp page id -> { engine name: jpeg filename }, for papers converted before there was a raster store
+def get_jpeg_cmp_groups(img_subdir):
+    images_in_dir = [f for f in os.listdir(img_subdir) if f.endswith('.jpeg')]
     cmp_groups = {}
     for img_filename_with_ext in images_in_dir:
         img_filename = os.path.splitext(img_filename_with_ext)[0]
         _, engine, pg, pg_identifier = img_filename.split('_')
         if pg_identifier not in cmp_groups: cmp_groups[pg_identifier] = {}
         cmp_groups[pg_identifier][engine] = img_filename_with_ext
+    return cmp_groups
+
+# sorts cmp page ids in page order: cmp1, cmp2, ..., then cmp-3, cmp-2, cmp-1
+def cmp_page_order(pg):
+    number = int(pg[len('cmp'):])
+    return (number < 0, number)
+
+# the cmp page ids of a converted paper, in page order
+def get_cmp_pages(arxiv_id):
+    img_subdir = os.path.join(CONVERTED_IMG_FOLDER, arxiv_id)
+    if not os.path.isdir(img_subdir): return []
+    store = RasterStore.open(img_subdir)
+    cmp_groups = store.cmp_groups() if store is not None else get_jpeg_cmp_groups(img_subdir)
+    return sorted(cmp_groups, key=cmp_page_order)
+
+# compares all cmp pages of the paper, or only [pages] (cmp page ids) if given
+def main(arxiv_id, algos, pages=None):  # arxiv_id including YYMM
+    img_subdir = os.path.join(CONVERTED_IMG_FOLDER, arxiv_id)
+    if not os.path.exists(img_subdir) or not os.path.isdir(img_subdir):
+        LOGGER.debug(f'{img_subdir} not found - skipping')
+        return {}
+    store = RasterStore.open(img_subdir)
+    if store is not None: return compare_from_store(arxiv_id, store, algos, pages)
+    # converted before there was a raster store
+    # split the images into comparison groups
+    cmp_groups = get_jpeg_cmp_groups(img_subdir)
     # perform comparisons
     RESULT = {}
     assert('xe' in TEX_ENGINES)  # only for inter-engine
     CMP_BASELINE = 'xelatex'
     for pg, cmp_grp_members in cmp_groups.items():
+        if pages is not None and pg not in pages: continue
         result_for_page = {}
         # comparisons within one group
         if len(cmp_grp_members) < 2 or CMP_BASELINE not in cmp_grp_members: continue
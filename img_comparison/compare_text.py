@@ -2,7 +2,7 @@ import os
 import fitz
 from tqdm import tqdm
 import pandas as pd
-from analysis.compare_text_similarity import COMPARE_METHODS, compute_cleaned_edit_ops, compute_edit_ops, compute_edit_ops_metrics, compute_levenshtein_cleaned_and_edit_ops_summary, compute_text_comparison_metrics
+from analysis.compare_text_similarity import COMPARE_METHODS, compare_texts, compute_cleaned_edit_ops, compute_edit_ops, compute_edit_ops_metrics, compute_levenshtein_cleaned_and_edit_ops_summary, compute_text_comparison_metrics
 from img_comparison.convert_pdf_to_img import get_pages_to_convert
 from utils.logger import COMPARISON_LOGGER as LOGGER
 import analysis.text_transformer as Ttr
@@ -39,13 +39,14 @@ def collect_text_to_compare(arxiv_id):
 # @param [cmp_group] is a dictionary of engine -> text
 # @param [identifier] is 2306.12345_cmp-2
 def run_cross_engine_comparison(cmp_group, identifier):
-    edit_ops_results = compute_edit_ops(cmp_group)
+    comparisons = compare_texts(cmp_group)
+    edit_ops_results = compute_edit_ops(comparisons)
     cleaned_results, summary = compute_cleaned_edit_ops(edit_ops_results)
 
     results = pd.DataFrame(columns=[identifier] + [f'{e1}{e2}' for e1, e2 in DIFF_ENGINE_PAIRS]).set_index(identifier)
-    results = compute_text_comparison_metrics(COMPARE_METHODS, cmp_group, results)
+    results = compute_text_comparison_metrics(COMPARE_METHODS, comparisons, results)
     results = compute_levenshtein_cleaned_and_edit_ops_summary(cleaned_results, summary, results)
-    results = compute_edit_ops_metrics(edit_ops_results, results)
+    results = compute_edit_ops_metrics(comparisons, results)
     return results
 
 # convert the result of a single comparison (one page across different engines) to a row
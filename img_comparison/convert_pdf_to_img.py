@@ -1,9 +1,17 @@
 import os
+import shutil
+import cv2
 import fitz
-from config import COMPILED_FOLDER, CONVERTED_IMG_FOLDER, CONVERT_FIRST_N_PAGES, CONVERT_LAST_N_PAGES
+from collections import Counter
+from config import COMPILED_FOLDER, CONVERTED_IMG_FOLDER, CONVERT_FIRST_N_PAGES, CONVERT_LAST_N_PAGES, STRUCTURAL_PRECHECK, SIM_IMAGE_SIZE, SAVE_CONVERTED_JPEGS
+from img_comparison.raster_store import write_raster_store
+from pipeline.pdf_structure import PdfStructure
+from pipeline.raster_cache import PageRasterizer, get_raster_cache, to_pixmap
 from utils.logger import COMPARISON_LOGGER as LOGGER
 from utils.tex_engine_utils import TEX_ENGINES, get_engine_name
 
+CONVERT_DPI = 200
+
 # returns a list of (page accessor index, page comparison index)
 # e.g. [ (0,1), (1,2), (2,3), (18,-3), (19,-2), (20,-1) ]
 def get_pages_to_convert(pdf_doc: fitz.Document):
@@ -17,20 +25,47 @@ def get_pages_to_convert(pdf_doc: fitz.Document):
         pages_to_convert = first_n_pgs + last_n_pgs
     return pages_to_convert
 
-def convert_and_save(identifier, pdf_filepath, save_dir):
+# grayscale and resized for comparison, like cv2.imread(IMREAD_GRAYSCALE) + cv2.resize of the jpeg, without the jpeg loss
+def to_comparison_img(rgb_img):
+    return gray_to_comparison_img(cv2.cvtColor(rgb_img, cv2.COLOR_RGB2GRAY))
+
+def gray_to_comparison_img(gray_img):
+    return cv2.resize(gray_img, SIM_IMAGE_SIZE)
+
+# [converted] maps page comparison index -> [(PdfStructure, page accessor index, image path, comparison img)] of the pages
+# converted so far for other engines. a page that is structurally identical to one of them is reused instead of rasterized.
+# appends (engine name, cmp page id, comparison img) to [store_pages], and saves jpegs if [save_jpegs].
+# returns the opened document, which has to stay open while [converted] refers to it
+def convert_and_save(identifier, pdf_filepath, save_dir, converted, stats, store_pages, raster_cache=None, save_jpegs=SAVE_CONVERTED_JPEGS):
     try:
         doc = fitz.open(pdf_filepath)
     except Exception as err:
         LOGGER.warn(f'skipping convert due to error opening file {pdf_filepath}:\n{err}')
-        return
-    # convert images to jpeg and save
+        return None
+    structure, rasterizer = PdfStructure(doc), PageRasterizer(pdf_filepath, raster_cache, doc)
+    engine_name = identifier.split('_')[1]
+    # convert pages to comparison images (and jpegs)
     pages_to_convert = get_pages_to_convert(doc)
     LOGGER.debug(f'converting pages for {identifier}: {pages_to_convert} ...')
     for pagenum, page_cmp_id in pages_to_convert:
-        page = doc.load_page(pagenum)
         save_destination = os.path.join(save_dir, f'{identifier}_pg{pagenum+1}_cmp{page_cmp_id}.jpeg')
-        page.get_pixmap(dpi=200).save(save_destination)
-    doc.close()
+        candidates = converted.get(page_cmp_id, []) if STRUCTURAL_PRECHECK else []
+        identical = next(((img_path, cmp_img) for other, other_pagenum, img_path, cmp_img in candidates if structure.page_identical(pagenum, other, other_pagenum)), None)
+        if identical is not None:
+            img_path, cmp_img = identical
+            if save_jpegs: shutil.copyfile(img_path, save_destination)
+            stats['renders_avoided'] += 1
+        else:
+            if save_jpegs:
+                rgb_img = rasterizer.render(pagenum, CONVERT_DPI)
+                to_pixmap(rgb_img, CONVERT_DPI).save(save_destination)
+                cmp_img = to_comparison_img(rgb_img)
+            else:
+                cmp_img = gray_to_comparison_img(rasterizer.render_rgb_to_gray(pagenum, CONVERT_DPI))
+            stats['renders'] += 1
+        converted.setdefault(page_cmp_id, []).append((structure, pagenum, save_destination, cmp_img))
+        store_pages.append((engine_name, f'cmp{page_cmp_id}', cmp_img))
+    return doc
 
 def main(arxiv_id):  # arxiv_id including YYMM
     # create a subdir for the converted images
@@ -38,10 +73,16 @@ def main(arxiv_id):  # arxiv_id including YYMM
     if os.path.exists(img_subdir): LOGGER.warn(f'converted_img dir already exists for {arxiv_id} - possible overwrite')
     else: os.makedirs(img_subdir, exist_ok=False)
     # perform conversion for each engine
+    converted, docs, stats, raster_cache, store_pages = {}, [], Counter(), get_raster_cache(), []
     for engine in TEX_ENGINES:
         identifier = f'{arxiv_id}_{get_engine_name(engine)}'
         pdf_filepath = os.path.join(COMPILED_FOLDER, arxiv_id, f'{identifier}.pdf')
         if not os.path.exists(pdf_filepath):
             LOGGER.debug(f'{pdf_filepath} not found - skipping')
             continue
-        convert_and_save(identifier, pdf_filepath, img_subdir)
+        doc = convert_and_save(identifier, pdf_filepath, img_subdir, converted, stats, store_pages, raster_cache)
+        if doc is not None: docs.append(doc)
+    for doc in docs: doc.close()
+    write_raster_store(img_subdir, store_pages)
+    LOGGER.debug(f"converted {stats['renders']} pages for {arxiv_id}, copied {stats['renders_avoided']} structurally identical pages")
+    return stats
@@ -1,6 +1,15 @@
+import os
 import fitz
+import numpy as np
 from PIL import Image
-from config import PROJECT_BIN
+from tqdm import tqdm
+from config import PROJECT_BIN, DIFFS_FOLDER, HIGHLIGHTED_DIFFS_FOLDER
+from pipeline.raster_cache import PageRasterizer, get_raster_cache, render_page
+
+HIGHLIGHT_DPI = 300
+MARGIN_WIDTH = 12   # diff-pdf marks changed lines with red in the left margin
+GREY_TOLERANCE = 2
+WHITE, RED = (255, 255, 255), (255, 0, 0)
 
 def convert_to_imgs(pdf_filepath, pages_to_convert):
     try:
@@ -9,34 +18,51 @@ def convert_to_imgs(pdf_filepath, pages_to_convert):
         print(f'skipping convert due to error opening file {pdf_filepath}:\n{err}')
         return []
     images = []
-    for pagenum, page in enumerate(doc):
+    rasterizer = PageRasterizer(pdf_filepath, get_raster_cache(for_diffs=True), doc)
+    for pagenum in range(len(doc)):
         if pagenum+1 not in pages_to_convert: continue
-        # save_destination = os.path.join(save_dir, f'{identifier}_pg{pagenum+1}_cmp{page_cmp_id}.jpeg')
-        image = page.get_pixmap(dpi=300)
-        image = Image.frombytes("RGB", [image.width, image.height], image.samples)
-        images.append(image)
+        images.append(rasterizer.render(pagenum, HIGHLIGHT_DPI))
 
     doc.close()
     return images
 
+# [img] is a (height, width, 3) uint8 page of a diff pdf. returns a new page where the red diff markings in the margin and
+# grey (with some buffer) pixels, i.e. the text common to both pdfs, are white, and everything else is highlighted red
+def highlight_page(img):
+    r, g, b = (img[:, :, c].astype(np.int16) for c in range(3))
+    margin_marker = (r > g) & (r > b)
+    margin_marker[:, MARGIN_WIDTH:] = False
+    grey = (np.abs(r - g) <= GREY_TOLERANCE) & (np.abs(r - b) <= GREY_TOLERANCE)    # includes white
+    highlighted = np.empty(img.shape, dtype=np.uint8)
+    highlighted[:] = RED
+    highlighted[margin_marker | grey] = WHITE
+    return highlighted
+
 def highlight_diffs(imgs):
-    for img in imgs: 
-        data = img.load()
-        width, height = img.size
-        for x in range(width):
-            for y in range(height):
-                # skip white pixels
-                if data[x, y] == (255,255,255): continue
-                r, g, b = data[x, y]
-                # if it's the red diff markings, continue
-                if x < 12 and r > g and r > b: data[x, y] = (255,255,255)
-                # if grayscale (with some buffer), transform to white
-                elif abs(r-g) <= 2 and abs(r-b) <= 2: data[x, y] = (255,255,255)
-                # else, highlight the diffs
-                else: data[x, y] = (255, 0, 0)
+    return [Image.fromarray(highlight_page(img)) for img in imgs]
+
+# highlights every page of every diff pdf in [diffs_folder], saved as {pdf name}_pg{page}.png in [output_folder].
+# returns the number of pages written
+def highlight_all(diffs_folder=DIFFS_FOLDER, output_folder=HIGHLIGHTED_DIFFS_FOLDER):
+    os.makedirs(output_folder, exist_ok=True)
+    diff_filenames = sorted(f for f in os.listdir(diffs_folder) if f.startswith('diff_') and f.endswith('.pdf'))
+    num_written = 0
+    for diff_filename in tqdm(diff_filenames):
+        pdf_filepath = os.path.join(diffs_folder, diff_filename)
+        try:
+            doc = fitz.Document(pdf_filepath)
+        except Exception as err:
+            print(f'skipping {pdf_filepath} due to error opening file:\n{err}')
+            continue
+        # not through the raster cache: diff pages are not read by any other stage
+        for pagenum in range(len(doc)):
+            img = highlight_page(render_page(doc, pagenum, HIGHLIGHT_DPI))
+            Image.fromarray(img).save(os.path.join(output_folder, f'{os.path.splitext(diff_filename)[0]}_pg{pagenum+1}.png'))
+            num_written += 1
+        doc.close()
+    return num_written
 
 def main(arxiv_id, pages_to_convert):
     pdf_path = f'{PROJECT_BIN}/diff_pdfs/diff_2306.{arxiv_id}_xelatex_lualatex.pdf'
-    imgs = convert_to_imgs(pdf_path, pages_to_convert)
-    highlight_diffs(imgs)
+    imgs = highlight_diffs(convert_to_imgs(pdf_path, pages_to_convert))
     for img in imgs: img.show()
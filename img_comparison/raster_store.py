@@ -0,0 +1,58 @@
+import os
+import json
+import numpy as np
+
+# one file of pages per paper, in its converted_img subdir
+PAGES_FILENAME = 'pages.npy'
+INDEX_FILENAME = 'pages.json'
+
+# writes [pages] (list of (engine name, cmp page id, uint8 grayscale array), all of the same shape) as one (N, H, W) array,
+# and an index of (engine name, cmp page id) -> row. both files are replaced atomically, the index last
+def write_raster_store(folder, pages):
+    pages_path, index_path = os.path.join(folder, PAGES_FILENAME), os.path.join(folder, INDEX_FILENAME)
+    tmp_suffix = f'.{os.getpid()}.tmp'
+    if len(pages) == 0:
+        for path in (index_path, pages_path):
+            if os.path.exists(path): os.remove(path)
+        return
+    shape = (len(pages),) + pages[0][2].shape
+    array = np.lib.format.open_memmap(pages_path + tmp_suffix, mode='w+', dtype=np.uint8, shape=shape)
+    for i, (_, _, img) in enumerate(pages): array[i] = img
+    array.flush()
+    del array
+    os.replace(pages_path + tmp_suffix, pages_path)
+    with open(index_path + tmp_suffix, 'w') as file:
+        json.dump({ 'shape': shape, 'pages': [[engine, cmp_id] for engine, cmp_id, _ in pages] }, file)
+    os.replace(index_path + tmp_suffix, index_path)
+
+# the converted pages of a paper, memory-mapped. get() returns a zero-copy, read-only view of one page
+class RasterStore:
+    def __init__(self, pages, index, store_id=None):
+        self.pages = pages
+        self.index = index  # (engine name, cmp page id) -> row
+        self.store_id = store_id    # identifies this version of the store, for caching per-page results
+
+    @classmethod
+    def open(cls, folder):
+        try:
+            with open(os.path.join(folder, INDEX_FILENAME)) as file:
+                data = json.load(file)
+            pages = np.load(os.path.join(folder, PAGES_FILENAME), mmap_mode='r')
+            store_id = (os.path.abspath(folder), os.stat(os.path.join(folder, PAGES_FILENAME)).st_mtime_ns)
+        except (OSError, ValueError):
+            return None
+        if list(pages.shape) != data['shape']: return None     # written by an interrupted conversion
+        return cls(pages, { (engine, cmp_id): i for i, (engine, cmp_id) in enumerate(data['pages']) }, store_id)
+
+    def page_id(self, row):
+        return (self.store_id, row)
+
+    def get(self, engine, cmp_id):
+        return self.pages[self.index[(engine, cmp_id)]]
+
+    # cmp page id -> { engine name: row }
+    def cmp_groups(self):
+        groups = {}
+        for (engine, cmp_id), i in self.index.items():
+            groups.setdefault(cmp_id, {})[engine] = i
+        return groups
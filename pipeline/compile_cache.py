@@ -0,0 +1,75 @@
+import os
+import json
+import shutil
+import tempfile
+from pipeline.manifest import hash_values
+
+META_FILENAME = 'meta.json'
+
+"""Content-addressed cache of compile outputs (pdf, .log, .blg, stdout/stderr captures).
+Entries are keyed on the source tree, the compile command and the TeX Live version, and evicted least-recently-used first"""
+class CompileCache:
+    def __init__(self, cache_folder, max_bytes):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(source_hash, compile_command, texlive_version):
+        return hash_values(source_hash, compile_command, texlive_version)
+
+    def entry_folder(self, key):
+        return os.path.join(self.cache_folder, key[:2], key)
+
+    """Copy the cached artifacts to [destinations] (artifact name -> path). Returns the entry's metadata, or None on a miss"""
+    def restore(self, key, destinations):
+        entry_folder = self.entry_folder(key)
+        try:
+            with open(os.path.join(entry_folder, META_FILENAME)) as file:
+                meta = json.load(file)
+            for name in meta['artifacts']:
+                if name not in destinations: continue
+                os.makedirs(os.path.dirname(destinations[name]), exist_ok=True)
+                shutil.copyfile(os.path.join(entry_folder, name), destinations[name])
+            os.utime(entry_folder)  # mark as recently used
+            return meta
+        except (OSError, ValueError, KeyError):
+            # missing, or evicted concurrently
+            return None
+
+    """Store the artifacts (artifact name -> path) that exist. Entries are written to a temp folder first, so readers never see a partial entry"""
+    def put(self, key, artifacts, meta):
+        entry_folder = self.entry_folder(key)
+        if os.path.isdir(entry_folder): return
+        os.makedirs(os.path.dirname(entry_folder), exist_ok=True)
+        tmp_folder = tempfile.mkdtemp(dir=os.path.dirname(entry_folder))
+        stored = []
+        for name, path in artifacts.items():
+            if not os.path.isfile(path): continue
+            shutil.copyfile(path, os.path.join(tmp_folder, name))
+            stored.append(name)
+        with open(os.path.join(tmp_folder, META_FILENAME), 'w') as file:
+            json.dump(meta | { 'artifacts': stored }, file)
+        try:
+            os.rename(tmp_folder, entry_folder)
+        except OSError:
+            # another worker stored the same entry first
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    """Remove least recently used entries until the cache fits in max_bytes. Returns the number of entries removed"""
+    def evict(self):
+        entries = []
+        if not os.path.isdir(self.cache_folder): return 0
+        for prefix in os.scandir(self.cache_folder):
+            if not prefix.is_dir(): continue
+            for entry in os.scandir(prefix.path):
+                if not entry.is_dir() or entry.name.startswith('tmp'): continue  # skip entries being written
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        num_evicted = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes: break
+            shutil.rmtree(path, ignore_errors=True)
+            total_bytes -= size
+            num_evicted += 1
+        return num_evicted
@@ -0,0 +1,165 @@
+import os
+import re
+import csv
+import time
+import fcntl
+import signal
+import subprocess
+from typing import NamedTuple, Optional
+import numpy as np
+from pipeline.source_index import SINGLE_FILE_SUBMISSION_REGEX
+
+# latexmk logs each rule it runs. older versions (TL2020) use the first format
+RUNNING_RULE_PATTERN_2020 = re.compile(r"Latexmk: applying rule '(.+)'...")
+RUNNING_RULE_PATTERN = re.compile(r"------------\s*\n\s*Run number \d+ of rule '(.+)'")
+USEPACKAGE_REGEX = re.compile(r'\\(?:usepackage|RequirePackage)\s*(?:\[[^\]]*\])?\s*{([^}]*)}')
+SOURCE_FILE_EXTENSIONS = ('.tex', '.bib', '.bbl', '.sty', '.cls', '.bst')
+WAIT_POLL_INTERVAL = 0.05   # seconds
+
+COMPILE_STATS_COLUMNS = [ 'arxiv_id', 'engine', 'texlive_version', 'source_bytes', 'num_packages', 'documentclass',
+                          'returncode', 'timed_out', 'timeout', 'wall_time', 'num_rules', 'max_rss' ]
+
+class PaperFeatures(NamedTuple):
+    source_bytes: int
+    num_packages: int
+    documentclass: Optional[str]
+
+class ProcessStats(NamedTuple):
+    returncode: Optional[int]   # None on timeout
+    wall_time: float            # seconds
+    max_rss: Optional[int]      # bytes, None where wait4 is unavailable
+
+"""Source size (tex-like files only, not figures) and the number of distinct packages loaded by any tex file"""
+def get_paper_features(project_root, documentclass):
+    source_bytes, packages = 0, set()
+    for root, _, files in os.walk(project_root):
+        for filename in files:
+            is_tex_file = filename.lower().endswith('.tex') or SINGLE_FILE_SUBMISSION_REGEX.fullmatch(filename) is not None
+            if not is_tex_file and not filename.lower().endswith(SOURCE_FILE_EXTENSIONS): continue
+            file_path = os.path.join(root, filename)
+            source_bytes += os.path.getsize(file_path)
+            if not is_tex_file: continue
+            with open(file_path, errors='ignore') as file:
+                for match in USEPACKAGE_REGEX.finditer(file.read()):
+                    packages.update(p.strip() for p in match.group(1).split(',') if p.strip())
+    return PaperFeatures(source_bytes, len(packages), documentclass)
+
+"""Number of rules (pdflatex, bibtex, ...) that latexmk ran, from its captured stdout"""
+def count_latexmk_rules(stdout_file):
+    if not os.path.isfile(stdout_file): return None
+    with open(stdout_file, 'rb') as file:
+        text = file.read().decode('latin-1')
+    return len(RUNNING_RULE_PATTERN.findall(text)) or len(RUNNING_RULE_PATTERN_2020.findall(text))
+
+def _kill_process_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        proc.kill()
+
+"""Like subprocess.run with a timeout, but also measures wall time and peak RSS of the process tree.
+The command runs in its own process group, so that a timeout also kills the engine latexmk started"""
+def run_with_stats(cmd, timeout, stdout, stderr, cwd, env=None):
+    start_time = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, cwd=cwd, env=env, start_new_session=True)
+    if not hasattr(os, 'wait4'):
+        try:
+            returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill_process_group(proc)
+            proc.wait()
+            returncode = None
+        return ProcessStats(returncode, time.perf_counter() - start_time, None)
+    deadline = start_time + timeout
+    timed_out = False
+    while True:
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid != 0: break
+        if time.perf_counter() >= deadline and not timed_out:
+            _kill_process_group(proc)
+            timed_out = True
+        time.sleep(WAIT_POLL_INTERVAL)
+    proc.returncode = os.waitstatus_to_exitcode(status)     # reaped by wait4, so let Popen know
+    # ru_maxrss is the peak of the process and its waited-for children, in KiB on linux and bytes on macos
+    max_rss = rusage.ru_maxrss if os.uname().sysname == 'Darwin' else rusage.ru_maxrss * 1024
+    return ProcessStats(None if timed_out else proc.returncode, time.perf_counter() - start_time, max_rss)
+
+"""Appends one row per compile job to a csv file, which the cost model is fitted on. Compile threads and containers
+sharing the file append to it concurrently, so appends hold an exclusive lock on it, and the header is written by the
+one that finds it empty"""
+def append_compile_stats(stats_path, rows):
+    if len(rows) == 0: return
+    os.makedirs(os.path.dirname(stats_path), exist_ok=True)
+    with open(stats_path, 'a', newline='') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        writer = csv.DictWriter(file, fieldnames=COMPILE_STATS_COLUMNS)
+        if file.seek(0, os.SEEK_END) == 0: writer.writeheader()
+        writer.writerows(rows)
+        file.flush()
+
+"""The rows of the csv file, read under a shared lock so that no row is half-written"""
+def read_compile_stats(stats_path):
+    if not os.path.isfile(stats_path): return []
+    with open(stats_path, newline='') as file:
+        fcntl.flock(file, fcntl.LOCK_SH)
+        return list(csv.DictReader(file))
+
+"""Predicts compile wall time from the source size, package count, documentclass and engine.
+A least squares fit of log(wall time), so the prediction is a multiplicative estimate. Timeouts are set
+a few residual standard deviations above the prediction, and clamped to [min_timeout, max_timeout].
+Until there are enough samples, every job gets default_timeout"""
+class CompileCostModel:
+    def __init__(self, default_timeout, min_timeout, max_timeout, min_samples, num_std=3.0, margin=1.5):
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.num_std = num_std
+        self.margin = margin
+        self.weights = None
+        self.residual_std = None
+        self.documentclasses = []
+        self.engines = []
+
+    def _features(self, features, engine):
+        return [ 1.0, np.log1p(features.source_bytes), features.num_packages ] \
+            + [ float(features.documentclass == d) for d in self.documentclasses ] \
+            + [ float(engine == e) for e in self.engines ]
+
+    """Fit on successful (not timed out) compiles. Returns self, untrained if there are too few samples"""
+    def fit(self, stats_rows):
+        rows = [row for row in stats_rows if row['timed_out'] != 'True' and row['wall_time'] not in ('', None)]
+        self.weights = None
+        if len(rows) < self.min_samples: return self
+        # one-hot columns only for categories with enough samples to estimate
+        def frequent(column):
+            values = [row[column] for row in rows]
+            return sorted(v for v in set(values) if values.count(v) >= self.min_samples // 4 and v != '')
+        self.documentclasses = frequent('documentclass')
+        self.engines = frequent('engine')
+        X = np.array([self._features(PaperFeatures(int(row['source_bytes']), int(row['num_packages']), row['documentclass']), row['engine']) for row in rows])
+        y = np.log(np.maximum([float(row['wall_time']) for row in rows], 1e-3))
+        self.weights, _, _, _ = np.linalg.lstsq(X, y, rcond=None)
+        residuals = y - X @ self.weights
+        self.residual_std = float(np.sqrt(np.mean(residuals ** 2)))
+        return self
+
+    @property
+    def is_trained(self):
+        return self.weights is not None
+
+    """Predicted wall time in seconds, or None if the model is untrained"""
+    def predict(self, features, engine):
+        if not self.is_trained: return None
+        return float(np.exp(np.dot(self._features(features, engine), self.weights)))
+
+    def predict_timeout(self, features, engine):
+        if not self.is_trained: return self.default_timeout
+        log_time = np.dot(self._features(features, engine), self.weights) + self.num_std * self.residual_std
+        timeout = float(np.exp(log_time)) * self.margin
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    """Relative cost for scheduling. With an untrained model, larger sources are assumed to take longer"""
+    def expected_cost(self, features, engine):
+        if not self.is_trained: return float(features.source_bytes)
+        return self.predict(features, engine)
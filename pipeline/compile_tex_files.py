@@ -1,23 +1,29 @@
-from utils.tex_engine_utils import get_compile_tex_commands, get_engine_name
+from utils.tex_engine_utils import get_compile_tex_commands, get_engine_name, get_aux_folder, get_texlive_version, locked_compile_env, warm_compile_caches
 from utils.logger import PIPELINE_LOGGER as LOGGER
 from constants.engine_primitives import PDFTEX_PRIMITIVES, PDFTEX_CHECK
+from config import COMPILE_TIMEOUT, NUM_JOBS, USE_COMPILE_CACHE, COMPILE_CACHE_FOLDER, COMPILE_CACHE_MAX_BYTES, \
+    ADAPTIVE_COMPILE_TIMEOUT, COMPILE_TIMEOUT_MIN, COMPILE_TIMEOUT_MAX, COMPILE_COST_MODEL_MIN_SAMPLES, COMPILE_STATS_PATH, CONCURRENT_ENGINES
+from pipeline.compile_cache import CompileCache
+from pipeline.compile_stats import CompileCostModel, run_with_stats, count_latexmk_rules, get_paper_features, append_compile_stats, read_compile_stats
+from pipeline.manifest import STAGE_COMPILE, STAGE_EXTRACT, hash_tree, hash_values
+from pipeline.source_index import get_source_index, parse_documentclass, is_single_file_submission, is_blacklisted, \
+    ENTRYPOINT_EXACT_MATCH, ENTRYPOINT_REGEXES, TEX_FILE_EXTENSION, INDEX_VERSION
 import os
-import subprocess
 import re
+import json
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import NamedTuple, Optional
+from collections import Counter
 import pandas as pd
 
 """Identify the documentclass of a file. Returns (documentclass, params)"""
-DOCUMENTCLASS_REGEX = re.compile(r'(?:^|\n)\s*\\documentclass(?P<params>\[(?:.*?\n?)*?\])?\s*?{(?P<docclass>.+)}')
 def get_documentclass(file_path):
     with open(file_path, errors='ignore') as f:
-        file_content = f.read()
-        result = DOCUMENTCLASS_REGEX.search(file_content)
-        if result == None: return None, None
-        if result.group('docclass') == None or result.group('params') == None: return result.group('docclass'), result.group('params')
-        params_cleaned = filter(lambda s: s[0] != '%', [s.strip() for s in result.group('params').split('\n')])
-        return result.group('docclass'), ''.join(params_cleaned)
-
-"""Find the entrypoint tex file for compilation"""
+        return parse_documentclass(f.read())
+
+"""Find the entrypoint tex file for compilation, among the [files] of one folder. See source_index for the whole tree"""
 def find_entrypoint_file(files, root):
     def return_file_with_docclass(file):
         if file == None: return None, None, None
@@ -28,39 +34,24 @@ def find_entrypoint_file(files, root):
     # 0. check if it is a single uncompressed tex file
     for file in files:
         # ideally check len(files)==1, but not always true since aux files will be there if code is rerun
-        if re.search(r'\d{4}\.\d+', file) is not None:
+        if is_single_file_submission(file):
             return return_file_with_docclass(file)
-    # 1. match any entrypoint
-    ENTRYPOINT_EXACT_MATCH = { 'main.tex', 'manuscript.tex', 'mainnew.tex' }
-    # 2. eliminate non-tex files and blacklisted files
-    TEX_FILE_EXTENSION = 'tex'
-    FILE_BLACKLIST_EXACT = ['math_commands.tex', 'commands.tex', 'macros.tex']
-    FILE_BLACKLIST_REGEX = [r'.*shorthands.*\.tex$', r'.*math_commands.*\.tex$', r'.*macros.*\.tex$', r'.*preamble.*\.tex$', r'.*declarations.*\.tex$', r'.*notation.*\.tex$']
-    FILE_BLACKLIST_REGEX = [re.compile(s, re.IGNORECASE) for s in FILE_BLACKLIST_REGEX]
-    # 3. fuzzy match these, followed by any file ending in tex
-    ENTRYPOINT_REGEXES = [ r'main.*\.tex$', r'.*arxiv.*\.tex$', r'.*paper.*\.tex$', r'.*final.*\.tex$',  r'.*2023.*\.tex$', r'.*\.tex$' ]
-    ENTRYPOINT_REGEXES  = [re.compile(s, re.IGNORECASE) for s in ENTRYPOINT_REGEXES]
-
     # 1. exact match for any entrypoint
     exact_matches = ENTRYPOINT_EXACT_MATCH.intersection(files)
     if len(exact_matches) > 0:
         file = list(exact_matches)[0]
         return return_file_with_docclass(file)
     # 2. eliminate blacklisted files and non-tex files
-    ok_files = []
-    for file in files:
-        if not file.endswith(TEX_FILE_EXTENSION): continue
-        if file in FILE_BLACKLIST_EXACT: continue
-        for pattern in FILE_BLACKLIST_REGEX:
-            if pattern.search(file): break
-        else: ok_files.append(file)
-    # 3. look for a reasonable file that has a documentclass
+    ok_files = [file for file in files if file.endswith(TEX_FILE_EXTENSION) and not is_blacklisted(file)]
+    # 3. look for a reasonable file that has a documentclass. each file is read at most once
+    docclasses = {}
     for pattern in ENTRYPOINT_REGEXES:
         for file in ok_files:
             match = pattern.search(file)
             if not match: continue
             # a valid entrypoint should have a documentclass
-            file, docclass, params = return_file_with_docclass(file)
+            if file not in docclasses: docclasses[file] = return_file_with_docclass(file)
+            file, docclass, params = docclasses[file]
             if docclass == None: continue
             return file, docclass, params
     return return_file_with_docclass(None)
@@ -68,79 +59,270 @@ def find_entrypoint_file(files, root):
 def create_output_and_log_dirs(COMPILED_FOLDER, arxiv_id):
     output_folder = os.path.join(COMPILED_FOLDER, arxiv_id)
     logs_folder = os.path.join(output_folder, 'logs')
-    os.makedirs(output_folder, exist_ok=False)
-    os.makedirs(logs_folder, exist_ok=False)
+    # remove the outputs of an earlier (possibly interrupted) run
+    if os.path.exists(output_folder): shutil.rmtree(output_folder)
+    os.makedirs(output_folder)
+    os.makedirs(logs_folder)
     return output_folder, logs_folder
 
-def run_tex_engines(project_root, tex_file, logs_folder, arxiv_id, output_folder):
+class CompileJob(NamedTuple):
+    arxiv_id: str
+    tex_engine: str
+    project_root: str
+    tex_file: str
+    logs_folder: str
+    output_folder: str
+    cache_key: Optional[str] = None     # None if the compile cache is not used
+    timeout: float = COMPILE_TIMEOUT    # seconds
+    expected_cost: float = 0            # for scheduling, see CompileCostModel
+    source_folder: Optional[str] = None # the paper's sources, containing project_root. None if it is project_root
+
+class CompileResult(NamedTuple):
+    arxiv_id: str
+    tex_engine: str
+    returncode: Optional[int]   # None on timeout
+    from_cache: bool
+    wall_time: Optional[float] = None   # these are None for cache hits
+    num_rules: Optional[int] = None
+    max_rss: Optional[int] = None
+
+"""The files produced by a compile job that are kept in the compile cache"""
+def get_compile_artifacts(job):
+    jobname = f'{job.arxiv_id}_{get_engine_name(job.tex_engine)}'
+    aux_folder = get_aux_folder(job.output_folder, job.tex_engine)
+    return {
+        'pdf': os.path.join(job.output_folder, f'{jobname}.pdf'),
+        'log': os.path.join(aux_folder, f'{jobname}.log'),
+        'blg': os.path.join(aux_folder, f'{jobname}.blg'),
+        'out': os.path.join(job.logs_folder, f'{jobname}.out'),
+        'err': os.path.join(job.logs_folder, f'{jobname}.err'),
+    }
+
+"""Where a job's copy of the sources is compiled"""
+def get_source_copy_folder(output_folder, tex_engine):
+    return os.path.join(get_aux_folder(output_folder, tex_engine), 'src')
+
+"""Compile one (arxiv_id, engine) job, or restore its outputs from the compile cache"""
+def run_tex_engine(job):
+    cache = None if job.cache_key is None else CompileCache(COMPILE_CACHE_FOLDER, COMPILE_CACHE_MAX_BYTES)
+    if cache is not None:
+        meta = cache.restore(job.cache_key, get_compile_artifacts(job))
+        if meta is not None: return CompileResult(job.arxiv_id, job.tex_engine, meta['returncode'], True)
+    run_command = get_compile_tex_commands(job.arxiv_id, job.output_folder)[job.tex_engine]
+    engine_name = get_engine_name(job.tex_engine)
+    os.makedirs(get_aux_folder(job.output_folder, job.tex_engine), exist_ok=True)
+    # compile a copy of the sources, since engines write next to them (e.g. epstopdf's *-eps-converted-to.pdf). this keeps
+    # engines running at the same time apart, and the extracted sources (and so the compile cache key) unchanged
+    source_folder = job.source_folder or job.project_root
+    source_copy = get_source_copy_folder(job.output_folder, job.tex_engine)
+    if os.path.exists(source_copy): shutil.rmtree(source_copy)
+    output_folder = os.path.abspath(job.output_folder)
+    shutil.copytree(source_folder, source_copy, symlinks=True, ignore=lambda folder, names: [name for name in names if os.path.abspath(os.path.join(folder, name)) == output_folder])
+    stdout_file = os.path.join(job.logs_folder, f'{job.arxiv_id}_{engine_name}.out')
+    stderr_file = os.path.join(job.logs_folder, f'{job.arxiv_id}_{engine_name}.err')
+    try:
+        with open(stdout_file, 'w') as stdout, open(stderr_file, 'w') as stderr, locked_compile_env(job.tex_engine) as env:
+            cmd = run_command + [job.tex_file]
+            stats = run_with_stats(cmd, job.timeout, stdout, stderr, os.path.join(source_copy, os.path.relpath(job.project_root, source_folder)), env)
+    finally:
+        shutil.rmtree(source_copy, ignore_errors=True)
+    result = CompileResult(job.arxiv_id, job.tex_engine, stats.returncode, False, stats.wall_time, count_latexmk_rules(stdout_file), stats.max_rss)
+    # timeouts are not cached, since they may succeed on a less loaded machine
+    if cache is not None and stats.returncode is not None: cache.put(job.cache_key, get_compile_artifacts(job), { 'returncode': stats.returncode })
+    return result
+
+"""Log the result of a compile job and add it to rets. Logging stays in the main process so that workers need no log handlers"""
+def record_compile_result(result, rets):
+    arxiv_id, tex_engine, returncode, from_cache = result.arxiv_id, result.tex_engine, result.returncode, result.from_cache
+    engine_name = get_engine_name(tex_engine)
+    if returncode is None:
+        LOGGER.error(f"compile_tex: timed out after {result.wall_time:.0f}s for {arxiv_id} [{tex_engine}]")
+        return
+    LOGGER.debug(f'compile_tex (1): ret={returncode} for {arxiv_id} [{engine_name}]{" (cached)" if from_cache else f" in {result.wall_time:.1f}s, {result.num_rules} rules"}')
+    rets[tex_engine] = returncode
+    # log if the compile failed
+    if returncode != 0: LOGGER.warning(f'compile_tex: ret={returncode} for {arxiv_id} [{engine_name}]')
+
+"""The cache key covers the entrypoint's source directory, the engine command line and the TeX Live version"""
+def get_compile_cache_key(source_hash, arxiv_id, tex_engine, tex_file):
+    compile_command = get_compile_tex_commands(arxiv_id, '{output_folder}')[tex_engine] + [tex_file]
+    return CompileCache.make_key(source_hash, compile_command, get_texlive_version())
+
+def get_compile_stats_row(result, job, features):
+    return {
+        'arxiv_id': result.arxiv_id, 'engine': get_engine_name(result.tex_engine), 'texlive_version': get_texlive_version(),
+        'source_bytes': features.source_bytes, 'num_packages': features.num_packages, 'documentclass': features.documentclass or '',
+        'returncode': result.returncode, 'timed_out': result.returncode is None, 'timeout': job.timeout,
+        'wall_time': result.wall_time, 'num_rules': result.num_rules, 'max_rss': result.max_rss,
+    }
+
+"""Set each job's timeout and expected cost from the cost model"""
+def plan_compile_jobs(paper_jobs, features, cost_model, adaptive_timeout=ADAPTIVE_COMPILE_TIMEOUT):
+    planned = []
+    for job in paper_jobs:
+        engine_name = get_engine_name(job.tex_engine)
+        timeout = cost_model.predict_timeout(features, engine_name) if adaptive_timeout else COMPILE_TIMEOUT
+        planned.append(job._replace(timeout=timeout, expected_cost=cost_model.expected_cost(features, engine_name)))
+    return planned
+
+def get_compile_jobs(project_root, tex_file, logs_folder, arxiv_id, output_folder, use_cache=False, source_folder=None):
+    tex_engines = get_compile_tex_commands(arxiv_id, output_folder).keys()
+    source_hash = hash_tree(project_root) if use_cache else None
+    def cache_key(tex_engine):
+        return get_compile_cache_key(source_hash, arxiv_id, tex_engine, tex_file) if use_cache else None
+    return [CompileJob(arxiv_id, tex_engine, project_root, tex_file, logs_folder, output_folder, cache_key(tex_engine), source_folder=source_folder) for tex_engine in tex_engines]
+
+"""Run the jobs of one paper, yielding results as they finish. With [concurrent], all engines run at the same time: each
+compiles its own copy of the sources, and outputs, aux files and caches are separate per engine"""
+def run_paper_jobs(paper_jobs, concurrent=False):
+    if not concurrent or len(paper_jobs) <= 1:
+        for job in paper_jobs: yield run_tex_engine(job)
+        return
+    # threads are enough, since the work happens in the latexmk subprocesses
+    with ThreadPoolExecutor(max_workers=len(paper_jobs)) as executor:
+        futures = [executor.submit(run_tex_engine, job) for job in paper_jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+def run_tex_engines(project_root, tex_file, logs_folder, arxiv_id, output_folder, concurrent=False, timeout=COMPILE_TIMEOUT):
     # run all tex engines
-    COMPILE_TEX_COMMANDS = get_compile_tex_commands(arxiv_id, output_folder)
     rets = {}
-    for tex_engine, run_command in COMPILE_TEX_COMMANDS.items():
-        try:
-            engine_name = get_engine_name(tex_engine)
-            stdout_file = os.path.join(logs_folder, f'{arxiv_id}_{engine_name}.out')
-            stderr_file = os.path.join(logs_folder, f'{arxiv_id}_{engine_name}.err')
-            with open(stdout_file, 'w') as stdout, open(stderr_file, 'w') as stderr:
-                cmd = run_command + [tex_file]
-                # compile
-                proc = subprocess.run(cmd, timeout=60, stdout=stdout, stderr=stderr, cwd=project_root)
-                LOGGER.debug(f'compile_tex (1): ret={proc.returncode} for {arxiv_id} [{engine_name}]')
-                rets[tex_engine] = proc.returncode
-                # log if the compile failed
-                if proc.returncode != 0: LOGGER.warning(f'compile_tex: ret={proc.returncode} for {arxiv_id} [{engine_name}]')
-        except subprocess.TimeoutExpired:
-            LOGGER.error(f"compile_tex: timed out for {arxiv_id} [{tex_engine}]")
+    paper_jobs = [job._replace(timeout=timeout) for job in get_compile_jobs(project_root, tex_file, logs_folder, arxiv_id, output_folder)]
+    warm_compile_caches([job.tex_engine for job in paper_jobs], 1, COMPILE_TIMEOUT_MAX)
+    for result in run_paper_jobs(paper_jobs, concurrent):
+        record_compile_result(result, rets)
     return rets
 
-"""Remove engine-specific commands"""
+# a control sequence is a maximal run of letters, so each \pdf... token is looked up whole in the primitives set.
+# this matches \pdfoutput=1 and \pdfinfo{...}, but not user macros that merely start with a primitive name
+PDFTEX_CHECK_BYTES = PDFTEX_CHECK.encode()
+PDFTEX_PRIMITIVES_BYTES = frozenset(primitive.encode() for primitive in PDFTEX_PRIMITIVES)
+PDFTEX_CONTROL_SEQUENCE_REGEX = re.compile(re.escape(PDFTEX_CHECK_BYTES) + rb'[A-Za-z]*')
+PROCESS_FILE_VERSION = 2    # part of the compile stage's input hash
+PRIMITIVES_REPORT_FILENAME = 'removed_primitives.json'
+
+"""Remove lines with engine-specific commands. The file is streamed as bytes, so its encoding is preserved, and only
+rewritten if a line was removed. Returns a Counter of the removed primitives"""
 def process_file(file, arxiv_id):
+    removed = Counter()
+    num_lines_removed = 0
+    with open(file, 'rb') as src, tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(file), delete=False) as dest:
+        for line in src:
+            if PDFTEX_CHECK_BYTES in line:  # quick optimisation to avoid tokenizing
+                primitives = [cs.decode() for cs in PDFTEX_CONTROL_SEQUENCE_REGEX.findall(line) if cs in PDFTEX_PRIMITIVES_BYTES]
+                if len(primitives) > 0:
+                    removed.update(primitives)
+                    num_lines_removed += 1
+                    continue
+            dest.write(line)
+    if num_lines_removed > 0:
+        shutil.copymode(file, dest.name)
+        os.replace(dest.name, file)
+    else: os.remove(dest.name)
+    if num_lines_removed == 0: LOGGER.debug(f'process engine primitives: no lines removed for {arxiv_id} [{os.path.basename(file)}]')
+    else: LOGGER.debug(f'process engine primitives: removed {num_lines_removed} lines for {arxiv_id} [{os.path.basename(file)}]. {dict(removed)}')
+    return removed
+
+"""Remove engine-specific commands from the entrypoint and every file it includes. The removed primitives
+are reported per file in {logs_folder}/removed_primitives.json. Returns the report"""
+def process_paper(index, root, tex_file, arxiv_id, logs_folder):
     LOGGER.debug(f'processing files for engine-specific primitives...')
-    lines = []
-    lines_removed = []
-    with open(file, 'r', errors='ignore') as fp:
-        lines = fp.readlines()
-    with open(file, 'w', errors='ignore') as fp:
-        for line in lines:
-            if PDFTEX_CHECK not in line: fp.write(line)  # quick optimisation to avoid iterating
-            else:
-                should_keep_line = True
-                for primitive in PDFTEX_PRIMITIVES:
-                    if primitive in line: 
-                        should_keep_line = False
-                        lines_removed.append(line)
-                        break
-                if should_keep_line: fp.write(line)
-    if len(lines_removed) == 0: LOGGER.debug(f'process engine primitives: no lines removed for {arxiv_id}')
-    else: LOGGER.debug(f'process engine primitives: removed {len(lines_removed)} for {arxiv_id}. {lines_removed}')
-    return
-
-def main(EXTRACTED_FOLDER, COMPILED_FOLDER, RESULTS):
-    LOGGER.info('compiling tex files...')
-    results_to_concat = []
+    files = {}
+    for path in index.include_closure(index.get_path(os.path.join(root, tex_file))):
+        removed = process_file(os.path.join(index.folder, *path.split('/')), arxiv_id)
+        if len(removed) > 0: files[path] = dict(removed)
+    report = { 'arxiv_id': arxiv_id, 'entrypoint': tex_file, 'files': files, 'total': dict(sum((Counter(r) for r in files.values()), Counter())) }
+    with open(os.path.join(logs_folder, PRIMITIVES_REPORT_FILENAME), 'w') as file:
+        json.dump(report, file, indent=2)
+    return report
+
+"""Find the entrypoint and prepare the sources for compilation. Returns a df row (without compile results), or None"""
+def prepare_paper(EXTRACTED_FOLDER, COMPILED_FOLDER, arxiv_id, use_cache=False, archive_hash=None):
+    folder_path = os.path.join(EXTRACTED_FOLDER, arxiv_id)
+    output_folder, logs_folder = create_output_and_log_dirs(COMPILED_FOLDER, arxiv_id)
+    # find the root of the include graph. the index is cached by the hash of the downloaded archive
+    index = get_source_index(folder_path, archive_hash)
+    entrypoint = index.find_entrypoint()
+    if entrypoint is None:
+        LOGGER.warning(f'could not find entrypoint tex file: [{arxiv_id}]')
+        return None, []
+    root, tex_file, docclass, docclass_params = entrypoint
+    LOGGER.debug(f'found latex file: [{arxiv_id}] {os.path.relpath(os.path.join(root, tex_file), folder_path)}')
+    # make the sources engine-agnostic
+    process_paper(index, root, tex_file, arxiv_id, logs_folder)
+    row = { 'arxiv_id': arxiv_id, 'entrypoint': tex_file, 'documentclass': docclass, 'docclass_params': docclass_params }
+    return row, get_compile_jobs(root, tex_file, logs_folder, arxiv_id, output_folder, use_cache, folder_path)
+
+"""The compile stage depends on the extracted sources and on the compile settings"""
+def get_compile_input_hash(EXTRACTED_FOLDER, arxiv_id, manifest):
+    source_hash, _ = manifest.get(arxiv_id, STAGE_EXTRACT)
+    if source_hash is None: source_hash = hash_tree(os.path.join(EXTRACTED_FOLDER, arxiv_id))
+    compile_settings = (get_compile_tex_commands('{arxiv_id}', '{output_folder}'), COMPILE_TIMEOUT, PDFTEX_PRIMITIVES, PROCESS_FILE_VERSION, INDEX_VERSION)
+    return hash_values(source_hash, compile_settings)
+
+def main(EXTRACTED_FOLDER, COMPILED_FOLDER, RESULTS, jobs=NUM_JOBS, manifest=None, use_cache=USE_COMPILE_CACHE, concurrent_engines=CONCURRENT_ENGINES):
+    LOGGER.info(f'compiling tex files ({jobs=}, {use_cache=}, {concurrent_engines=})...')
+    cost_model = CompileCostModel(COMPILE_TIMEOUT, COMPILE_TIMEOUT_MIN, COMPILE_TIMEOUT_MAX, COMPILE_COST_MODEL_MIN_SAMPLES).fit(read_compile_stats(COMPILE_STATS_PATH))
+    if cost_model.is_trained: LOGGER.info(f'compile cost model: fitted on {COMPILE_STATS_PATH} (residual std {cost_model.residual_std:.2f} log-seconds)')
+    else: LOGGER.info(f'compile cost model: not enough samples yet, using {COMPILE_TIMEOUT=}')
+    rows, compile_jobs, features = {}, [], {}
+    input_hashes, num_pending_jobs, skipped = {}, {}, []
     for arxiv_id in os.listdir(EXTRACTED_FOLDER):
-        folder_path = os.path.join(EXTRACTED_FOLDER, arxiv_id)
-        output_folder, logs_folder = create_output_and_log_dirs(COMPILED_FOLDER, arxiv_id)
-        # try to find a tex file
-        for root, _, files in os.walk(folder_path):
-            tex_file, docclass, docclass_params = find_entrypoint_file(files, root)
-            if tex_file is None: 
-                LOGGER.warning(f'could not find entrypoint tex file: [{arxiv_id}]')
+        # skip papers that were compiled from the same sources and settings
+        if manifest is not None:
+            input_hashes[arxiv_id] = get_compile_input_hash(EXTRACTED_FOLDER, arxiv_id, manifest)
+            if manifest.is_done(arxiv_id, STAGE_COMPILE, input_hashes[arxiv_id]) and os.path.isdir(os.path.join(COMPILED_FOLDER, arxiv_id)):
+                row = manifest.get_result(arxiv_id, STAGE_COMPILE)
+                if row is not None: rows[arxiv_id] = row
+                skipped.append(arxiv_id)
                 continue
-            LOGGER.debug(f'found latex file: [{arxiv_id}] {tex_file}')
-            # skip compiles for some files 
-            file_path = os.path.join(root, tex_file)
-            # make the file engine-agnostic
-            process_file(file_path, arxiv_id)
-            # run the tex engines
-            rets = run_tex_engines(root, tex_file, logs_folder, arxiv_id, output_folder)
-            # convert to a new df row
-            rets['arxiv_id'] = arxiv_id
-            rets['entrypoint'] = tex_file
-            rets['documentclass'] = docclass
-            rets['docclass_params'] = docclass_params
-            results_to_concat.append(rets)
-            break
+        archive_hash = None if manifest is None else manifest.get(arxiv_id, STAGE_EXTRACT)[0]
+        row, paper_jobs = prepare_paper(EXTRACTED_FOLDER, COMPILED_FOLDER, arxiv_id, use_cache, archive_hash)
+        if row is None:
+            if manifest is not None: manifest.mark_done(arxiv_id, STAGE_COMPILE, input_hashes[arxiv_id], None)
+            continue
+        rows[arxiv_id] = row
+        features[arxiv_id] = get_paper_features(paper_jobs[0].project_root, row['documentclass'])
+        compile_jobs += plan_compile_jobs(paper_jobs, features[arxiv_id], cost_model)
+        num_pending_jobs[arxiv_id] = len(paper_jobs)
+    if len(skipped) > 0: LOGGER.info(f'skipping {len(skipped)} papers that are already compiled')
+    # longest jobs first, so that no worker is left with a long job at the end
+    compile_jobs.sort(key=lambda job: job.expected_cost, reverse=True)
+    jobs_by_key = { (job.arxiv_id, job.tex_engine): job for job in compile_jobs }
+
+    # a paper is recorded in the manifest once all of its engines have finished
+    num_cache_hits = 0
+    def on_compile_result(result):
+        nonlocal num_cache_hits
+        arxiv_id = result.arxiv_id
+        num_cache_hits += result.from_cache
+        record_compile_result(result, rows[arxiv_id])
+        if not result.from_cache:
+            append_compile_stats(COMPILE_STATS_PATH, [get_compile_stats_row(result, jobs_by_key[(arxiv_id, result.tex_engine)], features[arxiv_id])])
+        num_pending_jobs[arxiv_id] -= 1
+        if manifest is not None and num_pending_jobs[arxiv_id] == 0:
+            manifest.mark_done(arxiv_id, STAGE_COMPILE, input_hashes[arxiv_id], rows[arxiv_id])
+
+    # build the font caches once, outside of the compile timeouts. each compile that can run at once gets a copy
+    if len(compile_jobs) > 0:
+        warmed = warm_compile_caches({ job.tex_engine for job in compile_jobs }, max(jobs, 1), COMPILE_TIMEOUT_MAX)
+        if len(warmed) > 0: LOGGER.info(f'compile caches: built for {", ".join(get_engine_name(engine) for engine in warmed)}')
+    # run the tex engines: each (arxiv_id, engine) is scheduled separately
+    if jobs <= 1:
+        jobs_by_paper = {}
+        for job in compile_jobs: jobs_by_paper.setdefault(job.arxiv_id, []).append(job)
+        for paper_jobs in jobs_by_paper.values():
+            for result in run_paper_jobs(paper_jobs, concurrent_engines): on_compile_result(result)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run_tex_engine, job) for job in compile_jobs]
+            for future in as_completed(futures):
+                on_compile_result(future.result())
+    if use_cache:
+        num_evicted = CompileCache(COMPILE_CACHE_FOLDER, COMPILE_CACHE_MAX_BYTES).evict()
+        LOGGER.info(f'compile cache: {num_cache_hits}/{len(compile_jobs)} jobs restored from cache, {num_evicted} entries evicted')
+    # convert to new df rows
+    results_to_concat = list(rows.values())
     RESULTS = pd.concat([RESULTS, pd.DataFrame.from_records(results_to_concat, index='arxiv_id')])
     LOGGER.info(f'compiled {len(RESULTS.index)} papers.')
     LOGGER.debug(RESULTS)
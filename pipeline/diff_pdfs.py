@@ -1,21 +1,58 @@
 from utils.tex_engine_utils import get_engine_name, DIFF_ENGINE_PAIRS
 from utils.logger import PIPELINE_LOGGER as LOGGER
-from config import PIXEL_TOLERANCE, USE_TL2020_DIR
+from config import PIXEL_TOLERANCE, USE_TL2020_DIR, DIFF_BACKEND, DIFF_DPI, STRUCTURAL_PRECHECK, DIFF_REGIONS_PATH, DIFF_REGION_MERGE_DISTANCE, DIFF_COARSE_DPI, DIFF_TILE_SIZE
+from pipeline.manifest import STAGE_DIFF, hash_file, hash_values
+from pipeline import pdf_diff
+from pipeline.pdf_structure import pdfs_identical
+from pipeline.raster_cache import get_raster_cache
+from pipeline.diff_regions import DiffRegionIndex
+from collections import Counter
 import os
 import subprocess
+import pandas as pd
 from tqdm import tqdm
 
-def compare_engine_outputs(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS):
+def get_diff_output_path(arxiv_id, e1, e2, DIFFS_FOLDER):
+    return os.path.join(DIFFS_FOLDER, f'diff_{arxiv_id}_{e1}_{e2}.pdf')
+
+"""Diff all engine pairs of a paper in-process, rendering each engine's pdf once.
+The differing regions of each pair are recorded in [region_index], if given. With [coarse_dpi], pages are rendered at
+[coarse_dpi] first and only the differing tiles at DIFF_DPI"""
+def compare_engine_outputs_native(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS, stats, region_index=None, coarse_dpi=None):
+    engines = { engine for pair in DIFF_ENGINE_PAIRS for engine in pair }
+    pdf_paths = { engine: get_compiled_pdf_path(arxiv_id, engine, COMPILED_FOLDER, COMPILED_FOLDER_2020) for engine in engines }
+    output_paths = { (e1, e2): get_diff_output_path(arxiv_id, e1, e2, DIFFS_FOLDER) for e1, e2 in DIFF_ENGINE_PAIRS }
+    regions = {} if region_index is not None else None
+    equal = pdf_diff.diff_pdfs(pdf_paths, DIFF_ENGINE_PAIRS, DIFF_DPI, PIXEL_TOLERANCE, output_paths, STRUCTURAL_PRECHECK, stats, get_raster_cache(for_diffs=True), regions, DIFF_REGION_MERGE_DISTANCE, coarse_dpi, DIFF_TILE_SIZE)
+    if region_index is not None:
+        for e1, e2 in DIFF_ENGINE_PAIRS:
+            region_index.replace(arxiv_id, get_engine_name(e1), get_engine_name(e2), regions.get((e1, e2), []), DIFF_DPI)
+    for (engine1, engine2), pdfs_equal in equal.items():
+        LOGGER.debug(f"[{arxiv_id}] {'no diffs' if pdfs_equal else 'diffs'} for [{engine1}] <> [{engine2}]")
+        RESULTS.at[arxiv_id, f'{engine1}<>{engine2}'] = pdfs_equal
+    return RESULTS
+
+"""The native diff with a coarse pass first"""
+def compare_engine_outputs_tiled(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS, stats, region_index=None):
+    return compare_engine_outputs_native(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS, stats, region_index, DIFF_COARSE_DPI)
+
+def compare_engine_outputs(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS, stats, region_index=None):
     def get_diff_command(e1, e2):
         def output_filename(engine, arxiv_id):
-            if USE_TL2020_DIR and engine == '20': 
-                return os.path.join(os.path.join(COMPILED_FOLDER_2020, arxiv_id), f'{arxiv_id}_{get_engine_name(engine)}.pdf')
-            return os.path.join(os.path.join(COMPILED_FOLDER, arxiv_id), f'{arxiv_id}_{get_engine_name(engine)}.pdf')
-        diff_output = os.path.join(DIFFS_FOLDER, f'diff_{arxiv_id}_{e1}_{e2}.pdf')
-        return ['diff-pdf', f'--output-diff={diff_output}', '-smg', '--dpi=300', f'--per-page-pixel-tolerance={PIXEL_TOLERANCE}', output_filename(e1, arxiv_id), output_filename(e2, arxiv_id)] 
+            return get_compiled_pdf_path(arxiv_id, engine, COMPILED_FOLDER, COMPILED_FOLDER_2020)
+        diff_output = get_diff_output_path(arxiv_id, e1, e2, DIFFS_FOLDER)
+        return ['diff-pdf', f'--output-diff={diff_output}', '-smg', f'--dpi={DIFF_DPI}', f'--per-page-pixel-tolerance={PIXEL_TOLERANCE}', output_filename(e1, arxiv_id), output_filename(e2, arxiv_id)] 
 
     # returns bool of whether they match
     def diff_engines(e1, e2):
+        # diff-pdf only writes a diff pdf if there are differences, so one from an earlier run would be left behind
+        pdf_diff.remove_output(get_diff_output_path(arxiv_id, e1, e2, DIFFS_FOLDER))
+        # structurally identical pdfs are equal without rasterizing them
+        if STRUCTURAL_PRECHECK and pdfs_identical(get_compiled_pdf_path(arxiv_id, e1, COMPILED_FOLDER, COMPILED_FOLDER_2020), get_compiled_pdf_path(arxiv_id, e2, COMPILED_FOLDER, COMPILED_FOLDER_2020)):
+            LOGGER.debug(f"[{arxiv_id}] identical pdfs for [{e1}] <> [{e2}]")
+            stats['diff_pdf_runs_avoided'] += 1
+            return True
+        stats['diff_pdf_runs'] += 1
         try:
             subprocess.run(get_diff_command(e1, e2), check=True)
             LOGGER.debug(f"[{arxiv_id}] no diffs for [{e1}] <> [{e2}]")
@@ -36,9 +73,58 @@ def compare_engine_outputs(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFF
             LOGGER.debug(f'compare_engine_outputs: [{arxiv_id}] no compile result found for {engine1}<>{engine2}')
     return RESULTS
 
-def main(COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS):
-    LOGGER.info(f'diffing output pdfs...')
+"""Report how much pixel work the structural precheck avoided"""
+def log_precheck_stats(stats):
+    for work, label in [('renders', 'page renders'), ('diff_pdf_runs', 'diff-pdf runs')]:
+        total = stats[work] + stats[f'{work}_avoided']
+        if total == 0: continue
+        LOGGER.info(f"structural precheck avoided {stats[f'{work}_avoided']}/{total} {label} ({stats[f'{work}_avoided'] / total:.1%})")
+    if stats['tiles'] > 0: LOGGER.info(f"coarse pass: {stats['tiles_rendered']}/{stats['tiles']} tiles rendered at {DIFF_DPI} dpi ({stats['tiles_rendered'] / stats['tiles']:.1%})")
+
+def get_compiled_pdf_path(arxiv_id, engine, COMPILED_FOLDER, COMPILED_FOLDER_2020):
+    compiled_folder = COMPILED_FOLDER_2020 if USE_TL2020_DIR and engine == '20' else COMPILED_FOLDER
+    return os.path.join(compiled_folder, arxiv_id, f'{arxiv_id}_{get_engine_name(engine)}.pdf')
+
+"""The diff stage depends on the compiled pdfs and on the diff settings"""
+def get_diff_input_hash(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, backend=DIFF_BACKEND):
+    pdf_hashes = {}
+    for engine in sorted({ engine for pair in DIFF_ENGINE_PAIRS for engine in pair }):
+        pdf_path = get_compiled_pdf_path(arxiv_id, engine, COMPILED_FOLDER, COMPILED_FOLDER_2020)
+        pdf_hashes[engine] = hash_file(pdf_path) if os.path.isfile(pdf_path) else None
+    return hash_values(pdf_hashes, PIXEL_TOLERANCE, DIFF_ENGINE_PAIRS, backend, DIFF_DPI, DIFF_REGION_MERGE_DISTANCE, DIFF_COARSE_DPI, DIFF_TILE_SIZE)
+
+"""Whether the diff pdf of every pair recorded as not equal in [result] (a manifest result) is still there. Pairs with a
+missing compiled pdf have no diff pdf"""
+def has_diff_outputs(arxiv_id, result, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER):
+    for e1, e2 in DIFF_ENGINE_PAIRS:
+        if result.get(f'{e1}<>{e2}', True): continue
+        if not all(os.path.isfile(get_compiled_pdf_path(arxiv_id, engine, COMPILED_FOLDER, COMPILED_FOLDER_2020)) for engine in (e1, e2)): continue
+        if not os.path.isfile(get_diff_output_path(arxiv_id, e1, e2, DIFFS_FOLDER)): return False
+    return True
+
+def main(COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS, manifest=None, backend=DIFF_BACKEND):
+    LOGGER.info(f'diffing output pdfs ({backend=})...')
+    compare = { 'native': compare_engine_outputs_native, 'tiled': compare_engine_outputs_tiled, 'diff-pdf': compare_engine_outputs }[backend]
+    skipped, stats = [], Counter()
+    # diff-pdf only writes the diff pdf, so regions are only indexed by the native backend
+    region_index = DiffRegionIndex(DIFF_REGIONS_PATH) if backend != 'diff-pdf' else None
     for arxiv_id in tqdm(os.listdir(COMPILED_FOLDER)):
+        # skip papers whose pdfs were diffed before with the same settings
+        if manifest is not None:
+            input_hash = get_diff_input_hash(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, backend)
+            if manifest.is_done(arxiv_id, STAGE_DIFF, input_hash) and has_diff_outputs(arxiv_id, manifest.get_result(arxiv_id, STAGE_DIFF), COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER):
+                for col, pdfs_equal in manifest.get_result(arxiv_id, STAGE_DIFF).items(): RESULTS.at[arxiv_id, col] = pdfs_equal
+                skipped.append(arxiv_id)
+                continue
         # compare the output pdfs
-        RESULTS = compare_engine_outputs(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS)
+        RESULTS = compare(arxiv_id, COMPILED_FOLDER, COMPILED_FOLDER_2020, DIFFS_FOLDER, RESULTS, stats, region_index)
+        if manifest is not None:
+            diff_cols = [f'{e1}<>{e2}' for e1, e2 in DIFF_ENGINE_PAIRS]
+            result = { col: bool(RESULTS.at[arxiv_id, col]) for col in diff_cols if arxiv_id in RESULTS.index and col in RESULTS.columns and not pd.isna(RESULTS.at[arxiv_id, col]) }
+            manifest.mark_done(arxiv_id, STAGE_DIFF, input_hash, result)
+    if region_index is not None: region_index.close()
+    if len(skipped) > 0: LOGGER.info(f'skipped {len(skipped)} papers that are already diffed')
+    log_precheck_stats(stats)
+    raster_cache = get_raster_cache(for_diffs=True)
+    if backend != 'diff-pdf' and raster_cache is not None: LOGGER.info(f'evicted {raster_cache.evict()} pages from the raster cache')
     return RESULTS
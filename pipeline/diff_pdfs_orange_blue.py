@@ -1,9 +1,12 @@
-from utils.logger import LOGGER
+from utils.logger import PIPELINE_LOGGER as LOGGER
 import os
+import fitz
 import numpy as np
-from pdf2image import convert_from_path
 import cv2 as cv
 from config import DIFFS_FOLDER
+from pipeline.raster_cache import PageRasterizer, get_raster_cache
+
+PDF_TO_IMG_DPI = 200
 
 def show_image(img):
     cv.imshow("img", img)
@@ -14,8 +17,12 @@ def compiled_pdf_filename(COMPILED_FOLDER, engine, arxiv_id):
     return os.path.join(os.path.join(COMPILED_FOLDER, arxiv_id), f'{arxiv_id}_{engine}.pdf')
 
 def pdf_to_img_array(pdf_path):
-    images = convert_from_path(pdf_path)
-    return [np.array(image)[:, :, ::-1].copy() for image in images]
+    doc = fitz.open(pdf_path)
+    rasterizer = PageRasterizer(pdf_path, get_raster_cache(for_diffs=True), doc)
+    # rgb to bgr for opencv
+    images = [rasterizer.render(i, PDF_TO_IMG_DPI)[:, :, ::-1].copy() for i in range(len(doc))]
+    doc.close()
+    return images
     # return [cv.cvtColor(np.array(image.convert('HSV')), cv.COLOR_HSV2BGR_FULL) for image in images]
 
 def count_blue_orange_pixels(img):
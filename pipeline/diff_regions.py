@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import numpy as np
+from scipy import ndimage
+
+"""Connected regions of differing pixels on diffed pages, and an index of them, so triage can go straight to
+what changed instead of re-rendering and paging through whole diff pdfs"""
+
+"""Bounding boxes of the connected regions of [mask] (a 2d bool array of differing pixels). Pixels within [merge_distance]
+of each other are one region. Returns a list of (x0, y0, x1, y1, number of differing pixels), in pixels, x1 and y1 exclusive"""
+def find_regions(mask, merge_distance=0):
+    if not mask.any(): return []
+    merged = ndimage.maximum_filter(mask, size=merge_distance + 1) if merge_distance > 0 else mask
+    labels, num_regions = ndimage.label(merged, structure=np.ones((3, 3)))
+    # only the differing pixels, so the boxes are tight around them, not around the merged area
+    labels[~mask] = 0
+    num_pixels = np.bincount(labels.ravel(), minlength=num_regions + 1)
+    regions = []
+    for label, slices in enumerate(ndimage.find_objects(labels), start=1):
+        if slices is None: continue
+        rows, cols = slices
+        regions.append((cols.start, rows.start, cols.stop, rows.stop, int(num_pixels[label])))
+    return regions
+
+"""Differing regions of each diffed pair of engines of each paper. Boxes are in pdf points (1/72 inch) from the top left
+of the page, and pages are numbered from 1"""
+class DiffRegionIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS regions (
+            arxiv_id TEXT NOT NULL,
+            engine1 TEXT NOT NULL,
+            engine2 TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            x0 REAL NOT NULL,
+            y0 REAL NOT NULL,
+            x1 REAL NOT NULL,
+            y1 REAL NOT NULL,
+            area REAL NOT NULL,
+            diff_pixels INTEGER NOT NULL,
+            dpi INTEGER NOT NULL
+        )''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS regions_by_pair ON regions (arxiv_id, engine1, engine2, page)')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    """Replace the regions of a pair with [regions], a list of (page index, (x0, y0, x1, y1, diff pixels)) at [dpi]"""
+    def replace(self, arxiv_id, engine1, engine2, regions, dpi):
+        scale = 72 / dpi
+        rows = []
+        for page_index, (x0, y0, x1, y1, diff_pixels) in regions:
+            rows.append((arxiv_id, engine1, engine2, page_index + 1, x0 * scale, y0 * scale, x1 * scale, y1 * scale,
+                         (x1 - x0) * (y1 - y0) * scale * scale, diff_pixels, dpi))
+        with self.conn:
+            self.conn.execute('DELETE FROM regions WHERE arxiv_id = ? AND engine1 = ? AND engine2 = ?', (arxiv_id, engine1, engine2))
+            self.conn.executemany('INSERT INTO regions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    """Regions as dicts, largest first, optionally only those of one paper or pair, or with at least [min_diff_pixels]"""
+    def query(self, arxiv_id=None, engine1=None, engine2=None, min_diff_pixels=0):
+        conditions, params = ['diff_pixels >= ?'], [min_diff_pixels]
+        for column, value in [('arxiv_id', arxiv_id), ('engine1', engine1), ('engine2', engine2)]:
+            if value is None: continue
+            conditions.append(f'{column} = ?')
+            params.append(value)
+        cursor = self.conn.execute(f'SELECT * FROM regions WHERE {" AND ".join(conditions)} ORDER BY diff_pixels DESC, arxiv_id, engine1, engine2, page, y0, x0', params)
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def clear(self):
+        self.conn.execute('DELETE FROM regions')
+        self.conn.commit()
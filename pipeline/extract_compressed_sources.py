@@ -1,62 +1,150 @@
-import subprocess
 import os
+import time
+import gzip
 import shutil
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
 from utils.logger import PIPELINE_LOGGER as LOGGER
+from config import NUM_JOBS
+from pipeline.manifest import STAGE_EXTRACT, hash_file
 
-def unzip_with_tar(DOWNLOAD_FOLDER, filename, EXTRACTED_FOLDER):
-    # create a folder for the output
-    output_folder = os.path.join(EXTRACTED_FOLDER, filename)
-    os.makedirs(output_folder, exist_ok=False)
-    # attempt unzip
-    filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-    completed_proc = subprocess.run(['tar', '-xf', filepath, '-C', output_folder])
-    if completed_proc.returncode != 0:
-        if os.path.exists(output_folder): shutil.rmtree(output_folder)
-    return completed_proc
+# formats of arxiv e-prints
+FORMAT_TAR_GZ = 'tar.gz'
+FORMAT_TAR = 'tar'
+FORMAT_GZIP = 'gzip'    # a single gzipped tex file
+FORMAT_TEX = 'tex'      # an uncompressed tex file
+FORMAT_PDF = 'pdf'      # pdf-only submission, no sources
+GZIP_MAGIC = b'\x1f\x8b'
+PDF_MAGIC = b'%PDF'
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+class ExtractionResult(NamedTuple):
+    filename: str
+    format: str
+    num_bytes: int
+    seconds: float
+    error: Optional[str]
 
-def unzip_with_gunzip(DOWNLOAD_FOLDER, filename, EXTRACTED_FOLDER):
-    # create a folder for the output
+def is_tar_header(block):
+    if len(block) < TAR_BLOCK_SIZE: return False
+    try:
+        tarfile.TarInfo.frombuf(block[:TAR_BLOCK_SIZE], tarfile.ENCODING, 'surrogateescape')
+        return True
+    except tarfile.HeaderError:
+        return False
+
+"""Identify the format of a downloaded e-print from its first bytes"""
+def sniff_format(filepath):
+    with open(filepath, 'rb') as file:
+        head = file.read(TAR_BLOCK_SIZE)
+    if head.startswith(GZIP_MAGIC):
+        with gzip.open(filepath) as file:
+            return FORMAT_TAR_GZ if is_tar_header(file.read(TAR_BLOCK_SIZE)) else FORMAT_GZIP
+    if is_tar_header(head): return FORMAT_TAR
+    if head.startswith(PDF_MAGIC): return FORMAT_PDF
+    return FORMAT_TEX
+
+"""Create an empty output folder, removing the output of any earlier (possibly interrupted) extraction"""
+def create_output_folder(EXTRACTED_FOLDER, filename):
     output_folder = os.path.join(EXTRACTED_FOLDER, filename)
-    os.makedirs(output_folder, exist_ok=False)
-    # copy the file to uzip
-    output_filepath = os.path.join(output_folder, filename + '.gz')
-    shutil.copy(os.path.join(DOWNLOAD_FOLDER, filename), output_filepath)
-    # attempt unzip
-    completed_proc = subprocess.run(['gunzip', output_filepath])
-    if completed_proc.returncode != 0:
+    if os.path.exists(output_folder): shutil.rmtree(output_folder)
+    os.makedirs(output_folder)
+    return output_folder
+
+"""Reject the members that tarfile's 'data' filter rejects (for Pythons without it): paths outside [output_folder],
+links and special files. Raises ValueError"""
+def check_tar_member(member, output_folder):
+    if os.path.isabs(member.name) or '..' in member.name.replace('\\', '/').split('/'):
+        raise ValueError(f'tar member {member.name!r} is outside the destination')
+    if not (member.isfile() or member.isdir()):
+        raise ValueError(f'tar member {member.name!r} is a link or special file')
+    root = os.path.realpath(output_folder)
+    if os.path.commonpath([root, os.path.realpath(os.path.join(output_folder, member.name))]) != root:
+        raise ValueError(f'tar member {member.name!r} is outside the destination')
+
+def extract_tar(filepath, output_folder):
+    # stream the archive (r|*) instead of seeking around a decompressed copy
+    with tarfile.open(filepath, mode='r|*') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(output_folder, filter='data')
+            return
+        # members are extracted in order, as the stream is read
+        for member in tar:
+            check_tar_member(member, output_folder)
+            member.mode &= 0o755    # no setuid bits or group/other write, as with the filter
+            tar.extract(member, output_folder)
+
+"""Like gunzip, the output file is named after the archive without the .gz"""
+def extract_gzip(filepath, output_folder, filename):
+    with gzip.open(filepath) as src, open(os.path.join(output_folder, filename), 'wb') as dest:
+        shutil.copyfileobj(src, dest)
+
+def extract_tex(filepath, output_folder, filename):
+    shutil.copyfile(filepath, os.path.join(output_folder, filename))
+
+def extract_file(DOWNLOAD_FOLDER, filename, EXTRACTED_FOLDER):
+    filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+    start_time = time.perf_counter()
+    num_bytes = os.path.getsize(filepath)
+    file_format = None
+    try:
+        file_format = sniff_format(filepath)
+        if file_format == FORMAT_PDF: raise ValueError('pdf-only submission has no tex sources')
+        output_folder = create_output_folder(EXTRACTED_FOLDER, filename)
+        if file_format in (FORMAT_TAR_GZ, FORMAT_TAR): extract_tar(filepath, output_folder)
+        elif file_format == FORMAT_GZIP: extract_gzip(filepath, output_folder, filename)
+        else: extract_tex(filepath, output_folder, filename)
+        error = None
+    except Exception as e:
+        output_folder = os.path.join(EXTRACTED_FOLDER, filename)
         if os.path.exists(output_folder): shutil.rmtree(output_folder)
-    return completed_proc
+        error = f'{type(e).__name__}: {e}'
+    return ExtractionResult(filename, file_format, num_bytes, time.perf_counter() - start_time, error)
 
-def log_proc_result(proc, name, desc):
-    ret = proc.returncode
-    if ret == 0: LOGGER.debug(f'{name}: success\t{desc}')
-    else: LOGGER.debug(f'[{name}] ret={ret}\t{desc}') 
+def log_throughput(results):
+    throughput = {}
+    for result in results:
+        if result.error is not None: continue
+        num_files, num_bytes, seconds = throughput.get(result.format, (0, 0, 0))
+        throughput[result.format] = (num_files + 1, num_bytes + result.num_bytes, seconds + result.seconds)
+    for file_format, (num_files, num_bytes, seconds) in throughput.items():
+        mb = num_bytes / 1e6
+        LOGGER.info(f'extracted [{file_format}]: {num_files} files, {mb:.1f} MB in {seconds:.2f}s ({mb / max(seconds, 1e-9):.1f} MB/s, {num_files / max(seconds, 1e-9):.1f} files/s)')
 
-def main(DOWNLOAD_FOLDER, EXTRACTED_FOLDER):
+def main(DOWNLOAD_FOLDER, EXTRACTED_FOLDER, manifest=None, jobs=NUM_JOBS):
     failed_extractions = []
     success_extractions = []
-    LOGGER.info(f'extracting files...')
+    skipped_extractions = []
+    LOGGER.info(f'extracting files ({jobs=})...')
+    to_extract, input_hashes = [], {}
     for _, _, files in os.walk(DOWNLOAD_FOLDER):
         for filename in files:
-            LOGGER.debug(f'attempting extraction: {filename}')
-            try:
-                # try tar, then gunzip
-                proc_tar = unzip_with_tar(DOWNLOAD_FOLDER, filename, EXTRACTED_FOLDER)
-                log_proc_result(proc_tar, 'tar unzip', filename)
-                proc_tar.check_returncode()
-                success_extractions.append(filename)
-                continue
-            except subprocess.CalledProcessError:
-                pass
-            try:
-                proc_gunzip = unzip_with_gunzip(DOWNLOAD_FOLDER, filename, EXTRACTED_FOLDER)
-                log_proc_result(proc_gunzip, 'gunzip', filename)
-                proc_gunzip.check_returncode()
-                success_extractions.append(filename)
-                continue
-            except subprocess.CalledProcessError:
-                # log failed extractions
-                failed_extractions.append(filename)
-                LOGGER.warning(f'extraction failed: {filename}')
-    LOGGER.info(f'{len(success_extractions)} files extracted. \t{len(failed_extractions)} failures: {failed_extractions}')
+            if filename.endswith('.part'): continue  # incomplete download
+            if manifest is not None:
+                input_hashes[filename] = hash_file(os.path.join(DOWNLOAD_FOLDER, filename))
+                if manifest.is_done(filename, STAGE_EXTRACT, input_hashes[filename]) and os.path.isdir(os.path.join(EXTRACTED_FOLDER, filename)):
+                    skipped_extractions.append(filename)
+                    continue
+            to_extract.append(filename)
+    if len(skipped_extractions) > 0: LOGGER.info(f'skipped {len(skipped_extractions)} files that are already extracted')
+
+    def on_extraction_result(result):
+        if result.error is None:
+            LOGGER.debug(f'[{result.format}] extract: success\t{result.filename}')
+            success_extractions.append(result.filename)
+            if manifest is not None: manifest.mark_done(result.filename, STAGE_EXTRACT, input_hashes[result.filename], { 'format': result.format })
+        else:
+            # log failed extractions
+            failed_extractions.append(result.filename)
+            LOGGER.warning(f'extraction failed: {result.filename} [{result.format}] {result.error}')
+        return result
 
+    if jobs <= 1:
+        results = [on_extraction_result(extract_file(DOWNLOAD_FOLDER, filename, EXTRACTED_FOLDER)) for filename in to_extract]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            n = len(to_extract)
+            results = [on_extraction_result(result) for result in executor.map(extract_file, [DOWNLOAD_FOLDER] * n, to_extract, [EXTRACTED_FOLDER] * n, chunksize=16)]
+    log_throughput(results)
+    LOGGER.info(f'{len(success_extractions)} files extracted. \t{len(failed_extractions)} failures: {failed_extractions}')
@@ -0,0 +1,107 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from utils.logger import PIPELINE_LOGGER as LOGGER
+from config import DOWNLOAD_TIMEOUT
+
+RETRY_STATUS_CODES = { 429, 500, 502, 503, 504 }
+BACKOFF_SECONDS = 1
+CHUNK_SIZE = 1 << 16
+
+"""Allow at most [rate] requests per second, shared across all threads"""
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 0 if rate <= 0 else 1 / rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+
+"""Thread-pool fetcher with a shared connection pool, a global rate limit and retries with exponential backoff"""
+class Fetcher:
+    def __init__(self, max_workers, rate, num_retries, backoff=BACKOFF_SECONDS, timeout=DOWNLOAD_TIMEOUT):
+        self.max_workers = max_workers
+        self.num_retries = num_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    """Seconds to wait before retrying: the server's Retry-After, up to the longest backoff, or exponential backoff"""
+    def retry_delay(self, attempt, response=None):
+        retry_after = None if response is None else response.headers.get('Retry-After')
+        if retry_after is not None and retry_after.isdigit(): return min(int(retry_after), self.backoff * (2 ** self.num_retries))
+        return self.backoff * (2 ** attempt)
+
+    """Send a get request and ensure RESPONSE=200, retrying on connection errors, timeouts and retryable statuses.
+    The caller must close the response (or read it fully) when stream=True"""
+    def get(self, url, stream=False):
+        for attempt in range(self.num_retries + 1):
+            is_last_attempt = attempt == self.num_retries
+            self.rate_limiter.wait()
+            try:
+                response = self.session.get(url, stream=stream, timeout=self.timeout)
+            except requests.RequestException as e:
+                if is_last_attempt: raise RuntimeError(f"[get_request]: failed for {url}: {e}")
+                LOGGER.debug(f'get_request: retrying ({attempt=}) {url}: {e}')
+                time.sleep(self.retry_delay(attempt))
+                continue
+            if response.status_code == 200:
+                LOGGER.debug(f"get_request: (success) {url}")
+                return response
+            response.close()
+            if response.status_code not in RETRY_STATUS_CODES or is_last_attempt:
+                raise RuntimeError(f"[get_request]: http response {response.status_code} for {url}")
+            LOGGER.debug(f'get_request: retrying ({attempt=}, status={response.status_code}) {url}')
+            time.sleep(self.retry_delay(attempt, response))
+
+    """Stream the response body to [file_path], starting over if the connection times out or drops while reading it.
+    A partial file never replaces a completed one"""
+    def download(self, url, file_path):
+        partial_file_path = file_path + '.part'
+        for attempt in range(self.num_retries + 1):
+            try:
+                with self.get(url, stream=True) as response, open(partial_file_path, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        file.write(chunk)
+                break
+            except requests.RequestException as e:
+                # a read timeout while streaming is raised as a ConnectionError
+                if os.path.exists(partial_file_path): os.remove(partial_file_path)
+                if attempt == self.num_retries: raise RuntimeError(f"[download]: failed for {url}: {e}")
+                LOGGER.debug(f'download: retrying ({attempt=}) {url}: {e}')
+                time.sleep(self.retry_delay(attempt))
+            except Exception:
+                if os.path.exists(partial_file_path): os.remove(partial_file_path)
+                raise
+        os.replace(partial_file_path, file_path)
+        LOGGER.debug(f"file written: {file_path}")
+        return file_path
+
+    """Apply f to each item concurrently. Returns a list of (item, result, error) in the order of [items]"""
+    def map(self, f, items):
+        def run(item):
+            try: return item, f(item), None
+            except Exception as e: return item, None, e
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(run, items))
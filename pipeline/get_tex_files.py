@@ -1,33 +1,28 @@
-import requests
 from lxml import html
 import os
 from utils.logger import PIPELINE_LOGGER as LOGGER
-from config import TEX_FILE_DOWNLOAD_XPATH, NUM_ATTEMPTS, YEAR_AND_MONTH
+from config import TEX_FILE_DOWNLOAD_XPATH, NUM_ATTEMPTS, YEAR_AND_MONTH, ARXIV_BASE_URL, DOWNLOAD_JOBS, DOWNLOAD_RATE_LIMIT, DOWNLOAD_RETRIES, DOWNLOAD_TIMEOUT
 from constants.arxiv_subjects import SUBJECTS
+from pipeline.fetcher import Fetcher
+from pipeline.manifest import STAGE_DOWNLOAD, hash_file
 
 """Get the URL to download for each arxiv category (subject)"""
-def build_download_url(subject):
+def build_download_url(subject, base_url=ARXIV_BASE_URL):
     yyyy = '20' + YEAR_AND_MONTH[:2]
     mm = YEAR_AND_MONTH[-2:]
-    url = f'https://arxiv.org/list/{subject}/{yyyy}-{mm}?skip=0&show={str(NUM_ATTEMPTS)}'
+    url = f'{base_url}/list/{subject}/{yyyy}-{mm}?skip=0&show={str(NUM_ATTEMPTS)}'
     return url
 
-"""Send a get request and ensure RESPONSE=200"""
-def get_request(url):
-    response = requests.get(url)
-    if response.status_code != 200:
-        # Print the response content (JSON, XML, HTML, etc.)
-        raise RuntimeError("[get_request]: http response not 200")
-    LOGGER.debug(f"get_request: (success) {url}")
-    return response
+def build_eprint_url(arxiv_id, base_url=ARXIV_BASE_URL):
+    return f'{base_url}/e-print/{arxiv_id}'
 
 """Get the content from a URL using xpath"""
-def get_content_from_page(url, xpath):
-    response = get_request(url)
+def get_content_from_page(fetcher, url, xpath):
+    response = fetcher.get(url)
     html_source = html.fromstring(response.content)
-    try: 
+    try:
         res = html_source.xpath(xpath)
-        if len(res) == 0: 
+        if len(res) == 0:
             LOGGER.debug(f'no papers found for {url=}')
             return []
         else: return res[0]
@@ -36,8 +31,7 @@ def get_content_from_page(url, xpath):
         raise RuntimeError("failed at [get_content_from_html]")
 
 """[for arxiv] process a HTML element to get the papers"""
-def list_of_papers_to_download_links(element_list):
-    ARXIV_BASE_URL = 'https://arxiv.org'
+def list_of_papers_to_download_links(element_list, base_url=ARXIV_BASE_URL):
     # we only care about <dt></dt>
     list_of_papers = [item for item in element_list if item.tag == 'dt']
     download_links = {}
@@ -45,57 +39,69 @@ def list_of_papers_to_download_links(element_list):
         a_hrefs = list_item.findall(".//a[@href]")
         arxiv_id_raw, other_elem = a_hrefs[0].text_content().strip(), a_hrefs[-1].text_content().strip()
         # validate or throw error
-        is_valid =  arxiv_id_raw.startswith("arXiv:") and other_elem == 'other' 
+        is_valid =  arxiv_id_raw.startswith("arXiv:") and other_elem == 'other'
         if not is_valid: continue
         arxiv_id = arxiv_id_raw[6:]
-        url = ARXIV_BASE_URL + '/e-print/' + arxiv_id
+        url = build_eprint_url(arxiv_id, base_url)
         download_links[arxiv_id] = url
         LOGGER.debug(f'collected link: {arxiv_id=} {url=}')
         if len(download_links) == NUM_ATTEMPTS: break
     return download_links
 
-def get_download_links(url):
-    elem_list_of_papers = get_content_from_page(url, TEX_FILE_DOWNLOAD_XPATH)
-    return list_of_papers_to_download_links(elem_list_of_papers)
+def get_download_links(fetcher, url, base_url=ARXIV_BASE_URL):
+    elem_list_of_papers = get_content_from_page(fetcher, url, TEX_FILE_DOWNLOAD_XPATH)
+    return list_of_papers_to_download_links(elem_list_of_papers, base_url)
 
-def download_from_url_and_save(download_url, folder, filename):
-    def save_file_to_folder(folder, file_content, filename):
-        file_path = os.path.join(folder, filename)
-        with open(file_path, 'wb') as file:
-            file.write(file_content)
-            LOGGER.debug(f"file written: {file_path}")
-    response = get_request(download_url)
-    save_file_to_folder(folder, response.content, filename)
-
-def get_download_links_by_subject():
+def get_download_links_by_subject(fetcher, base_url=ARXIV_BASE_URL):
     download_links = {}
     subjects = SUBJECTS.keys()
 
-    # get the links to download
+    # get the links to download. the listing pages are fetched concurrently, but merged in subject order
     LOGGER.info('collecting urls for papers...')
-    for subject in subjects:
-        url = build_download_url(subject)
-        LOGGER.debug(f'getting papers: from {url}')
-        subject_download_links = get_download_links(url)
+    urls = [build_download_url(subject, base_url) for subject in subjects]
+    for url, subject_download_links, error in fetcher.map(lambda url: get_download_links(fetcher, url, base_url), urls):
+        if error is not None: raise error
+        LOGGER.debug(f'got papers: from {url}')
         download_links.update(subject_download_links)
     LOGGER.info(f'collected {len(download_links)} urls for papers in {len(subjects)} subjects')
     return download_links
 
-def main(DOWNLOAD_FOLDER, download_by_arxiv_ids):
-    # collect links
-    download_links = {}
-    if len(download_by_arxiv_ids) == 0:
-        download_links = get_download_links_by_subject()
-    else:
-        download_links = { arxiv_id: f'https://arxiv.org/e-print/{arxiv_id}' for arxiv_id in download_by_arxiv_ids }
+"""A download can be skipped if the same url was downloaded before and the file is still there"""
+def is_downloaded(manifest, DOWNLOAD_FOLDER, arxiv_id, link):
+    if manifest is None: return False
+    return manifest.is_done(arxiv_id, STAGE_DOWNLOAD, link) and os.path.isfile(os.path.join(DOWNLOAD_FOLDER, arxiv_id))
+
+def main(DOWNLOAD_FOLDER, download_by_arxiv_ids, base_url=ARXIV_BASE_URL, jobs=DOWNLOAD_JOBS, rate=DOWNLOAD_RATE_LIMIT, num_retries=DOWNLOAD_RETRIES, manifest=None, timeout=DOWNLOAD_TIMEOUT):
+    with Fetcher(jobs, rate, num_retries, timeout=timeout) as fetcher:
+        # collect links
+        download_links = {}
+        if len(download_by_arxiv_ids) == 0:
+            download_links = get_download_links_by_subject(fetcher, base_url)
+        else:
+            download_links = { arxiv_id: build_eprint_url(arxiv_id, base_url) for arxiv_id in download_by_arxiv_ids }
+
+        # skip completed downloads
+        already_downloaded, to_download = [], []
+        for arxiv_id, link in download_links.items():
+            if is_downloaded(manifest, DOWNLOAD_FOLDER, arxiv_id, link): already_downloaded.append(arxiv_id)
+            else: to_download.append(arxiv_id)
+        if len(already_downloaded) > 0: LOGGER.info(f'skipping {len(already_downloaded)} papers that are already downloaded')
 
-    # download and save
-    LOGGER.info(f'starting downloads...')
-    for arxiv_id, link in download_links.items():
-        LOGGER.debug(f'starting download:\n\tfrom {link}\n\tto {DOWNLOAD_FOLDER}')
-        download_from_url_and_save(link, DOWNLOAD_FOLDER, arxiv_id)
-    LOGGER.info(f'downloaded: {len(download_links)} papers')
-    arxiv_ids = list(download_links.keys())
+        # download and save
+        LOGGER.info(f'starting downloads ({jobs=}, {rate=}/s)...')
+        def download(arxiv_id):
+            link = download_links[arxiv_id]
+            LOGGER.debug(f'starting download:\n\tfrom {link}\n\tto {DOWNLOAD_FOLDER}')
+            return fetcher.download(link, os.path.join(DOWNLOAD_FOLDER, arxiv_id))
+        arxiv_ids, failed_downloads = list(already_downloaded), []
+        for arxiv_id, file_path, error in fetcher.map(download, to_download):
+            if error is None:
+                arxiv_ids.append(arxiv_id)
+                if manifest is not None: manifest.mark_done(arxiv_id, STAGE_DOWNLOAD, download_links[arxiv_id], { 'sha256': hash_file(file_path) })
+            else:
+                LOGGER.warning(f'download failed: {arxiv_id}: {error}')
+                failed_downloads.append(arxiv_id)
+    LOGGER.info(f'downloaded: {len(arxiv_ids)} papers. \t{len(failed_downloads)} failures: {failed_downloads}')
     LOGGER.debug(arxiv_ids)
 
     return arxiv_ids
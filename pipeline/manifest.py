@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+import sqlite3
+from datetime import datetime
+
+# pipeline stages, in order
+STAGE_DOWNLOAD = 'download'
+STAGE_EXTRACT = 'extract'
+STAGE_COMPILE = 'compile'
+STAGE_DIFF = 'diff'
+
+HASH_CHUNK_SIZE = 1 << 20
+
+def hash_file(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+"""Hash the relative paths and contents of all files under [folder]"""
+def hash_tree(folder):
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for filename in sorted(files):
+            file_path = os.path.join(root, filename)
+            sha.update(os.path.relpath(file_path, folder).encode(errors='surrogateescape') + b'\0')
+            sha.update(hash_file(file_path).encode())
+    return sha.hexdigest()
+
+"""Hash any json-serialisable values, e.g. the settings that a stage depends on"""
+def hash_values(*values):
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+"""Persistent record of each paper's completed stages, their input hashes and results.
+A stage is skipped on rerun only if it completed with the same input hash"""
+class Manifest:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS stages (
+            arxiv_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            input_hash TEXT NOT NULL,
+            result TEXT,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (arxiv_id, stage)
+        )''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, arxiv_id, stage):
+        row = self.conn.execute('SELECT input_hash, result FROM stages WHERE arxiv_id = ? AND stage = ?', (arxiv_id, stage)).fetchone()
+        if row is None: return None, None
+        input_hash, result = row
+        return input_hash, None if result is None else json.loads(result)
+
+    def is_done(self, arxiv_id, stage, input_hash):
+        recorded_hash, _ = self.get(arxiv_id, stage)
+        return recorded_hash is not None and recorded_hash == input_hash
+
+    def get_result(self, arxiv_id, stage):
+        return self.get(arxiv_id, stage)[1]
+
+    def mark_done(self, arxiv_id, stage, input_hash, result=None):
+        self.conn.execute('INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)',
+                          (arxiv_id, stage, input_hash, json.dumps(result, default=str), datetime.now().isoformat()))
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute('DELETE FROM stages')
+        self.conn.commit()
@@ -0,0 +1,175 @@
+import os
+from collections import Counter
+import fitz
+import numpy as np
+from scipy import ndimage
+from pipeline.pdf_structure import PdfStructure
+from pipeline.diff_regions import find_regions
+from pipeline.raster_cache import PageRasterizer, to_pixmap, COLORSPACES
+
+"""In-process replacement for `diff-pdf -smg --dpi=DPI --per-page-pixel-tolerance=N`.
+Pages are rendered with PyMuPDF, and page i of every pdf is rendered once, however many pairs it is part of"""
+
+WHITE = 255
+ITEM_MARGIN_PIXELS = 2  # at the full dpi, around what a page draws, for antialiasing
+
+"""Pad two page images with white to the same size, like overlaying pages of different sizes"""
+def pad_to_same_shape(img1, img2):
+    if img1.shape == img2.shape: return img1, img2
+    height, width = max(img1.shape[0], img2.shape[0]), max(img1.shape[1], img2.shape[1])
+    def pad(img):
+        return np.pad(img, ((0, height - img.shape[0]), (0, width - img.shape[1]), (0, 0)), constant_values=WHITE)
+    return pad(img1), pad(img2)
+
+"""Mask of the pixels that differ in any channel"""
+def diff_mask(img1, img2):
+    img1, img2 = pad_to_same_shape(img1, img2)
+    # per channel, as reducing over the short last axis is slow
+    diff = img1 != img2
+    return diff[:, :, 0] | diff[:, :, 1] | diff[:, :, 2]
+
+"""Number of pixels that differ in any channel"""
+def count_diff_pixels(img1, img2):
+    return int(np.count_nonzero(diff_mask(img1, img2)))
+
+"""The diff-pdf style overlay: ink only in the first page is blue, ink only in the second page is orange, and
+shared content is grey. As luminance L1, L2: (R, G, B) = (L1, (L1 + L2) / 2, L2)"""
+def make_diff_image(img1, img2):
+    img1, img2 = pad_to_same_shape(img1, img2)
+    def luminance(img):
+        return (img[:, :, 0].astype(np.uint16) + img[:, :, 1] + img[:, :, 2]) // 3
+    l1, l2 = luminance(img1), luminance(img2)
+    return np.stack([l1, (l1 + l2) // 2, l2], axis=2).astype(np.uint8)
+
+"""Tiles (a 2d bool grid of [tile_size] coarse pixels) with differing pixels in [mask], or next to them, as antialiasing
+can spread a difference into the neighbouring coarse pixel"""
+def flag_tiles(mask, tile_size):
+    mask = ndimage.maximum_filter(mask, size=3)
+    grid_height, grid_width = -(-mask.shape[0] // tile_size), -(-mask.shape[1] // tile_size)
+    padded = np.zeros((grid_height * tile_size, grid_width * tile_size), dtype=bool)
+    padded[:mask.shape[0], :mask.shape[1]] = mask
+    return padded.reshape(grid_height, tile_size, grid_width, tile_size).any(axis=(1, 3))
+
+"""Tiles (as flag_tiles, of [tile_size] points) where page [page_index] of two pdfs' PdfStructures draws different glyphs,
+paths or images, with their boxes grown by [margin] points for antialiasing. All tiles if the pages can't be compared so"""
+def differing_item_tiles(structure1, structure2, page_index, grid_shape, tile_size, margin):
+    if not structure1.items_comparable(page_index, structure2, page_index): return np.ones(grid_shape, dtype=bool)
+    sums1, counts1 = structure1.tile_signatures(page_index, grid_shape, tile_size, margin)
+    sums2, counts2 = structure2.tile_signatures(page_index, grid_shape, tile_size, margin)
+    return (sums1 != sums2) | (counts1 != counts2)
+
+"""A page at [dpi] where [tiles] (see flag_tiles) are rendered at [dpi] and the rest is the [coarse] page scaled up.
+[coarse_dpi] must divide [dpi]. The flagged tiles of a row are rendered together, with clip rectangles on the page's display list"""
+def render_tiles(page, coarse, tiles, tile_size, dpi, coarse_dpi, colorspace='rgb'):
+    scale = dpi // coarse_dpi
+    matrix = fitz.Matrix(dpi / 72, dpi / 72)
+    fine_rect = (page.rect * matrix).irect
+    # columns first: repeating the short rows, then whole rows, is several times faster than the other way round
+    img = np.repeat(np.repeat(coarse, scale, axis=1), scale, axis=0)
+    if img.shape[0] < fine_rect.height or img.shape[1] < fine_rect.width:
+        img = np.pad(img, ((0, max(0, fine_rect.height - img.shape[0])), (0, max(0, fine_rect.width - img.shape[1])), (0, 0)), mode='edge')
+    img = img[:fine_rect.height, :fine_rect.width]
+    fine_tile_size = tile_size * scale
+    display_list = None
+    for row, cols in enumerate(tiles):
+        # runs of flagged tiles in this row
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], cols.astype(np.int8), [0]])))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            x0, y0 = start * fine_tile_size, row * fine_tile_size
+            x1, y1 = min(stop * fine_tile_size, fine_rect.width), min(y0 + fine_tile_size, fine_rect.height)
+            if x0 >= x1 or y0 >= y1: continue
+            if display_list is None: display_list = page.get_displaylist()
+            pix = display_list.get_pixmap(matrix=matrix, colorspace=COLORSPACES[colorspace], alpha=False, clip=fitz.Rect(x0, y0, x1, y1) * (72 / dpi))
+            img[y0:y0+pix.height, x0:x0+pix.width] = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return img
+
+def add_image_page(doc, img, dpi):
+    height, width = img.shape[:2]
+    page = doc.new_page(width=width * 72 / dpi, height=height * 72 / dpi)
+    # the page already has the image's aspect ratio. centering it (keep_proportion) can write an offset like 3e-05, which is not valid pdf syntax
+    page.insert_image(page.rect, pixmap=to_pixmap(img), keep_proportion=False)
+
+def remove_output(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+"""Diff [pairs] of pdfs (name -> path). A pair is equal if both pdfs open, have the same number of pages, and no page has
+more than [tolerance] differing pixels. If [output_paths] (pair -> path) is given, the differing pages of each pair are
+written there as a diff pdf (and one left from an earlier run is removed if none differ); otherwise pairs stop being rendered once they are known to differ.
+With [precheck], pages that are structurally identical (see pdf_structure) are not rendered. [stats] (a Counter) counts
+the page renders done and avoided, and the identical pages. Pages are rendered through [cache] (a RasterCache) if given.
+If [regions] (a dict) is given, regions[pair] is set to the differing regions of each pair, as a list of
+(page index, region) with regions from diff_regions.find_regions, pixels within [merge_distance] merged.
+With [coarse_dpi], pages are rendered at [coarse_dpi] first, and only tiles of [tile_size] coarse pixels that differ in any
+pair are rendered at [dpi] (see render_tiles). Pairs whose pages do not differ at [coarse_dpi] but are not structurally
+identical are rendered in full, as a difference can be too small to show at a low dpi.
+Returns { pair: equal }"""
+def diff_pdfs(pdf_paths, pairs, dpi, tolerance, output_paths=None, precheck=True, stats=None, cache=None, regions=None, merge_distance=0, coarse_dpi=None, tile_size=32):
+    if coarse_dpi is not None and dpi % coarse_dpi != 0: raise ValueError(f'{coarse_dpi=} must divide {dpi=}')
+    docs, equal = {}, {}
+    try:
+        for name in { name for pair in pairs for name in pair }:
+            try:
+                docs[name] = fitz.open(pdf_paths[name])
+            except Exception:
+                docs[name] = None   # missing or broken pdf, like diff-pdf failing to open it
+        for pair in pairs:
+            equal[pair] = docs[pair[0]] is not None and docs[pair[1]] is not None and len(docs[pair[0]]) == len(docs[pair[1]])
+        openable_pairs = [pair for pair in pairs if docs[pair[0]] is not None and docs[pair[1]] is not None]
+        diff_docs = {} if output_paths is None else { pair: fitz.open() for pair in openable_pairs }
+        if regions is not None: regions.update({ pair: [] for pair in openable_pairs })
+        # pairs that still need rendering
+        def is_pending(pair):
+            return pair in diff_docs or (regions is not None and pair in regions) or equal[pair]
+        structures = { name: PdfStructure(doc) for name, doc in docs.items() if doc is not None }
+        rasterizers = { name: PageRasterizer(pdf_paths[name], cache, doc) for name, doc in docs.items() if doc is not None }
+        stats = stats if stats is not None else Counter()
+        num_pages = max([len(doc) for doc in docs.values() if doc is not None], default=0)
+        for page_index in range(num_pages):
+            pending_pairs = [pair for pair in pairs if is_pending(pair) and page_index < min(len(docs[pair[0]]), len(docs[pair[1]]))]
+            if len(pending_pairs) == 0: continue
+            names_without_precheck = { name for pair in pending_pairs for name in pair }
+            if precheck:
+                identical_pairs = [pair for pair in pending_pairs if structures[pair[0]].page_identical(page_index, structures[pair[1]], page_index)]
+                stats['identical_pages'] += len(identical_pairs)
+                pending_pairs = [pair for pair in pending_pairs if pair not in identical_pairs]
+            # render each pdf's page once, for all pairs
+            names = { name for pair in pending_pairs for name in pair }
+            if coarse_dpi is None:
+                pages = { name: rasterizers[name].render(page_index, dpi) for name in names }
+            else:
+                coarse_pages = { name: rasterizers[name].render(page_index, coarse_dpi) for name in names }
+                # the same tiles for every pdf, so pages are compared at the same resolution everywhere
+                tile_masks = []
+                for pair in pending_pairs:
+                    pair_tiles = flag_tiles(diff_mask(coarse_pages[pair[0]], coarse_pages[pair[1]]), tile_size)
+                    # a difference can be too small to show at the coarse dpi, so tiles are only taken from the coarse page
+                    # where both pages draw the same things
+                    pair_tiles |= differing_item_tiles(structures[pair[0]], structures[pair[1]], page_index, pair_tiles.shape, tile_size * 72 / coarse_dpi, ITEM_MARGIN_PIXELS * 72 / dpi)
+                    if pair_tiles.any(): tile_masks.append(pair_tiles)
+                grid_shape = tuple(max([m.shape[axis] for m in tile_masks], default=0) for axis in (0, 1))
+                tiles = np.zeros(grid_shape, dtype=bool)
+                for m in tile_masks: tiles[:m.shape[0], :m.shape[1]] |= m
+                pages = { name: render_tiles(docs[name][page_index], coarse_pages[name], tiles, tile_size, dpi, coarse_dpi) for name in names }
+                stats['tiles'] += tiles.size * len(names)
+                stats['tiles_rendered'] += int(np.count_nonzero(tiles)) * len(names)
+            stats['renders'] += len(pages)
+            stats['renders_avoided'] += len(names_without_precheck) - len(pages)
+            for pair in pending_pairs:
+                img1, img2 = pages[pair[0]], pages[pair[1]]
+                mask = diff_mask(img1, img2)
+                num_diff_pixels = int(np.count_nonzero(mask))
+                if num_diff_pixels > tolerance: equal[pair] = False
+                # like -s, only pages with differences are written
+                if pair in diff_docs and num_diff_pixels > 0: add_image_page(diff_docs[pair], make_diff_image(img1, img2), dpi)
+                if regions is not None and num_diff_pixels > 0: regions[pair] += [(page_index, region) for region in find_regions(mask, merge_distance)]
+        for pair in pairs if output_paths is not None else []:
+            if pair in diff_docs and len(diff_docs[pair]) > 0: diff_docs[pair].save(output_paths[pair], garbage=3, deflate=True)
+            else: remove_output(output_paths[pair])     # a diff pdf from an earlier run would still count as a difference
+            if pair in diff_docs: diff_docs[pair].close()
+    finally:
+        for doc in docs.values():
+            if doc is not None: doc.close()
+    return equal
@@ -0,0 +1,167 @@
+import re
+import hashlib
+import fitz
+import numpy as np
+
+"""Structural equality of pdf pages, as a cheap check before rasterizing. Two pages are identical if they have the same size
+and images, and either the same content stream and fonts, or the same glyphs at the same positions and the same vector drawings.
+Fonts are compared by name and by a digest of their embedded program, as a font of the same name can have other glyph
+outlines in another TeX Live"""
+
+FONT_SUBSET_PREFIX_REGEX = re.compile(r'^[A-Z]{6}\+')
+POSITION_DECIMALS = 3   # 1/1000 pt, far below a pixel at any dpi the pipeline renders at
+VOLATILE_KEYS = { 'seqno' }
+# glyphs can be drawn outside their character box (italic overhangs, accents, large operators), by up to this many ems
+GLYPH_MARGIN_EMS = 2
+# resources other than fonts that change how the same content stream renders
+RESOURCE_KEYS = ['ExtGState', 'ColorSpace', 'Pattern', 'Shading', 'Properties']
+REFERENCE_REGEX = re.compile(r'(\d+) 0 R')
+
+def _normalize(value):
+    if isinstance(value, float): return round(value, POSITION_DECIMALS)
+    if isinstance(value, (fitz.Rect, fitz.Point, fitz.Matrix, fitz.Quad)): return tuple(round(v, POSITION_DECIMALS) for v in tuple(value))
+    if isinstance(value, (list, tuple)): return tuple(_normalize(v) for v in value)
+    if isinstance(value, dict): return tuple((k, _normalize(v)) for k, v in sorted(value.items()) if k not in VOLATILE_KEYS)
+    return value
+
+def _digest(value):
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+def strip_subset_prefix(font_name):
+    return FONT_SUBSET_PREFIX_REGEX.sub('', font_name)
+
+"""The page's non-font resources with references resolved, or None if they cannot be compared by value
+(inherited resources, or objects that refer to further objects)"""
+def resolve_resources(doc, page):
+    if doc.xref_get_key(page.xref, 'Resources')[0] == 'null': return None
+    resources = []
+    for key in RESOURCE_KEYS:
+        kind, value = doc.xref_get_key(page.xref, f'Resources/{key}')
+        if kind == 'null': continue
+        if kind == 'xref': value = doc.xref_object(int(value.split()[0]), compressed=True)
+        objects = []
+        for xref in REFERENCE_REGEX.findall(value):
+            obj = doc.xref_object(int(xref), compressed=True)
+            if REFERENCE_REGEX.search(obj): return None
+            objects.append((obj, doc.xref_stream_raw(int(xref)) if doc.xref_is_stream(int(xref)) else None))
+        resources.append((key, REFERENCE_REGEX.sub('R', value), objects))
+    return resources
+
+"""Digest of the program of the font [xref] (its FontFile stream), or for a Type3 font of its dictionary and glyph procedures"""
+def font_program_digest(doc, xref):
+    _, _, _, program = doc.extract_font(xref)
+    if len(program) > 0: return hashlib.sha256(program).hexdigest()
+    kind, char_procs = doc.xref_get_key(xref, 'CharProcs')
+    if kind == 'xref': char_procs = doc.xref_object(int(char_procs.split()[0]), compressed=True)
+    glyph_streams = [doc.xref_stream_raw(int(glyph_xref)) for glyph_xref in REFERENCE_REGEX.findall(char_procs)] if kind != 'null' else []
+    return _digest((doc.xref_object(xref, compressed=True), glyph_streams))
+
+"""Per-page signatures of a document, computed lazily from the cheapest to the most expensive and cached"""
+class PdfStructure:
+    def __init__(self, doc):
+        self.doc = doc
+        self._cache = {}
+        self._font_digests = {}     # font xref -> program digest, as fonts are shared between pages
+
+    def __len__(self):
+        return len(self.doc)
+
+    def _get(self, kind, page_index, compute):
+        key = (kind, page_index)
+        if key not in self._cache: self._cache[key] = compute(self.doc[page_index])
+        return self._cache[key]
+
+    def size(self, page_index):
+        return self._get('size', page_index, lambda page: (_normalize(page.rect), page.rotation))
+
+    def font_digest(self, xref):
+        if xref not in self._font_digests: self._font_digests[xref] = font_program_digest(self.doc, xref) if xref > 0 else None
+        return self._font_digests[xref]
+
+    """(name without subset prefix, program digest) of each font of the page"""
+    def fonts(self, page_index):
+        return self._get('fonts', page_index, lambda page: sorted({ (strip_subset_prefix(basefont), self.font_digest(xref)) for xref, _, _, basefont, _, _ in page.get_fonts() }, key=repr))
+
+    def images(self, page_index):
+        return self._get('images', page_index, lambda page: _normalize([(info['digest'], info['bbox']) for info in page.get_image_info(hashes=True)]))
+
+    """The content stream, the fonts its resource names refer to, and its other resources.
+    None for pages with form xobjects (e.g. included pdf figures), which are only compared by trace"""
+    def content(self, page_index):
+        def compute(page):
+            if len(page.get_xobjects()) > 0: return None
+            resources = resolve_resources(self.doc, page)
+            if resources is None: return None
+            fonts = sorted((name, strip_subset_prefix(basefont), ext, font_type, self.font_digest(xref)) for xref, ext, font_type, basefont, name, _ in page.get_fonts())
+            return _digest((page.read_contents(), fonts, resources))
+        return self._get('content', page_index, compute)
+
+    """Every glyph (font, size, colour, glyph id, origin) and vector path as drawn, independent of how the content stream is
+    written, and the programs of the page's fonts, as the trace only names them"""
+    def trace(self, page_index):
+        def compute(page):
+            spans = [span | { 'font': strip_subset_prefix(span['font']) } for span in page.get_texttrace()]
+            return _digest((_normalize(spans), _normalize(page.get_drawings()), self.fonts(page_index)))
+        return self._get('trace', page_index, compute)
+
+    """Everything the page draws, as (hash, (x0, y0, x1, y1)) with a box in points that contains it: each glyph, vector
+    path and image. Hashes are only comparable within one process"""
+    def items(self, page_index):
+        def compute(page):
+            items = []
+            for span in page.get_texttrace():
+                span_key = hash(_normalize({ k: v for k, v in span.items() if k not in ('chars', 'bbox') } | { 'font': strip_subset_prefix(span['font']) }))
+                margin = GLYPH_MARGIN_EMS * span['size']
+                for _, glyph, origin, bbox in span['chars']:
+                    x0, y0, x1, y1 = bbox
+                    box = (min(x0, origin[0]) - margin, min(y0, origin[1]) - margin, max(x1, origin[0]) + margin, max(y1, origin[1]) + margin)
+                    items.append((hash((span_key, glyph, _normalize(origin))), box))
+            for drawing in page.get_drawings():
+                width = drawing.get('width') or 0
+                rect = drawing['rect']
+                items.append((hash(_normalize(drawing)), (rect.x0 - width, rect.y0 - width, rect.x1 + width, rect.y1 + width)))
+            for info in page.get_image_info(hashes=True):
+                items.append((hash((info['digest'], _normalize(info['transform']))), tuple(info['bbox'])))
+            return items
+        return self._get('items', page_index, compute)
+
+    """Whether the pages can be compared by their items (see tile_signatures): same size, no rotation or annotations,
+    and the same font programs"""
+    def items_comparable(self, page_index, other, other_index):
+        page, other_page = self.doc[page_index], other.doc[other_index]
+        if self.size(page_index) != other.size(other_index) or page.rotation != 0: return False
+        if page.first_annot is not None or other_page.first_annot is not None: return False
+        return self.fonts(page_index) == other.fonts(other_index)
+
+    """(sum of the item hashes, number of items) touching each tile of a (rows, cols) [grid_shape] grid of [tile_size] points,
+    with item boxes grown by [margin] points. Tiles with the same signatures on two pages draw the same things"""
+    def tile_signatures(self, page_index, grid_shape, tile_size, margin):
+        sums, counts = np.zeros(grid_shape, dtype=np.uint64), np.zeros(grid_shape, dtype=np.int64)
+        for item_hash, (x0, y0, x1, y1) in self.items(page_index):
+            col0, col1 = max(int((x0 - margin) // tile_size), 0), min(int((x1 + margin) // tile_size), grid_shape[1] - 1)
+            row0, row1 = max(int((y0 - margin) // tile_size), 0), min(int((y1 + margin) // tile_size), grid_shape[0] - 1)
+            if col0 > col1 or row0 > row1: continue
+            sums[row0:row1+1, col0:col1+1] += np.uint64(item_hash & 0xFFFFFFFFFFFFFFFF)
+            counts[row0:row1+1, col0:col1+1] += 1
+        return sums, counts
+
+    """Whether page [page_index] renders the same as page [other_index] of [other]"""
+    def page_identical(self, page_index, other, other_index):
+        if self.size(page_index) != other.size(other_index): return False
+        if self.images(page_index) != other.images(other_index): return False
+        content = self.content(page_index)
+        if content is not None and content == other.content(other_index): return True
+        return self.trace(page_index) == other.trace(other_index)
+
+"""Whether two pdfs have the same number of pages and every page is identical. False if either fails to open"""
+def pdfs_identical(pdf_path1, pdf_path2):
+    try:
+        doc1, doc2 = fitz.open(pdf_path1), fitz.open(pdf_path2)
+    except Exception:
+        return False
+    try:
+        structure1, structure2 = PdfStructure(doc1), PdfStructure(doc2)
+        return len(doc1) == len(doc2) and all(structure1.page_identical(i, structure2, i) for i in range(len(doc1)))
+    finally:
+        doc1.close()
+        doc2.close()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import cv2
+import fitz
+import numpy as np
+from config import USE_RASTER_CACHE, CACHE_DIFF_RASTERS, RASTER_CACHE_FOLDER, RASTER_CACHE_MAX_BYTES
+from pipeline.manifest import hash_file, hash_values
+
+COLORSPACES = { 'rgb': fitz.csRGB, 'gray': fitz.csGRAY }
+
+"""Render a page to a uint8 array, (height, width, 3) for rgb and (height, width) for gray"""
+def render_page(doc, page_index, dpi, colorspace='rgb'):
+    pix = doc[page_index].get_pixmap(dpi=dpi, colorspace=COLORSPACES[colorspace], alpha=False)
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return img[:, :, 0] if colorspace == 'gray' else img
+
+def to_pixmap(img, dpi=None):
+    colorspace = fitz.csGRAY if img.ndim == 2 else fitz.csRGB
+    pix = fitz.Pixmap(colorspace, img.shape[1], img.shape[0], np.ascontiguousarray(img).tobytes(), 0)
+    if dpi is not None: pix.set_dpi(dpi, dpi)
+    return pix
+
+"""Cache of rendered pdf pages, keyed on the pdf's content hash, the page, the dpi and the colorspace, so a page is rendered
+once however many stages read it. Pages are stored as .npy files and read back memory-mapped. Evicted least-recently-used first"""
+class RasterCache:
+    def __init__(self, cache_folder, max_bytes):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(pdf_hash, page_index, dpi, colorspace):
+        return hash_values(pdf_hash, page_index, dpi, colorspace)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_folder, key[:2], f'{key}.npy')
+
+    """The cached page as a read-only memory-mapped array, or None on a miss"""
+    def get(self, key):
+        entry_path = self.entry_path(key)
+        try:
+            img = np.load(entry_path, mmap_mode='r')
+            os.utime(entry_path)    # mark as recently used
+            return img
+        except (OSError, ValueError):
+            # missing, evicted concurrently, or a truncated file
+            return None
+
+    """Store a page. Written to a temp file first, so readers never see a partial entry"""
+    def put(self, key, img):
+        entry_path = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), prefix='tmp', suffix='.npy')
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, img)
+        os.replace(tmp_path, entry_path)
+
+    """Remove least recently used pages until the cache fits in max_bytes. Returns the number of pages removed"""
+    def evict(self):
+        entries = []
+        if not os.path.isdir(self.cache_folder): return 0
+        for prefix in os.scandir(self.cache_folder):
+            if not prefix.is_dir(): continue
+            for entry in os.scandir(prefix.path):
+                if not entry.is_file() or entry.name.startswith('tmp'): continue  # skip pages being written
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        num_evicted = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes: break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            num_evicted += 1
+        return num_evicted
+
+"""The cache, if enabled. The rgb pages of diffing and highlighting ([for_diffs]) are only cached with CACHE_DIFF_RASTERS:
+they are large and only read again when a paper is diffed again"""
+def get_raster_cache(for_diffs=False):
+    if not USE_RASTER_CACHE or (for_diffs and not CACHE_DIFF_RASTERS): return None
+    return RasterCache(RASTER_CACHE_FOLDER, RASTER_CACHE_MAX_BYTES)
+
+"""Renders the pages of an opened pdf ([doc], read from [pdf_path]) through [cache], if given"""
+class PageRasterizer:
+    def __init__(self, pdf_path, cache, doc):
+        self.pdf_path = pdf_path
+        self.cache = cache
+        self.doc = doc
+        self._pdf_hash = None
+
+    def cached(self, page_index, dpi, colorspace, render):
+        if self.cache is None: return render()
+        if self._pdf_hash is None: self._pdf_hash = hash_file(self.pdf_path)
+        key = RasterCache.make_key(self._pdf_hash, page_index, dpi, colorspace)
+        img = self.cache.get(key)
+        if img is None:
+            img = render()
+            self.cache.put(key, img)
+        return img
+
+    def render(self, page_index, dpi, colorspace='rgb'):
+        return self.cached(page_index, dpi, colorspace, lambda: render_page(self.doc, page_index, dpi, colorspace))
+
+    """The rgb page converted to gray with cv2 (not rendered in gray, which rounds differently), cached as one channel"""
+    def render_rgb_to_gray(self, page_index, dpi):
+        return self.cached(page_index, dpi, 'rgb-to-gray', lambda: cv2.cvtColor(render_page(self.doc, page_index, dpi), cv2.COLOR_RGB2GRAY))
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import posixpath
+from typing import NamedTuple, Optional
+from config import SOURCE_INDEX_FOLDER
+
+INDEX_VERSION = 1   # bump when the index format or the tokenizer changes, to invalidate cached indexes
+
+"""Identify the documentclass of a file. Returns (documentclass, params)"""
+DOCUMENTCLASS_REGEX = re.compile(r'(?:^|\n)\s*\\documentclass(?P<params>\[(?:.*?\n?)*?\])?\s*?{(?P<docclass>.+)}')
+SINGLE_FILE_SUBMISSION_REGEX = re.compile(r'\d{4}\.\d+')    # a single-file e-print is extracted without an extension
+COMMENT_REGEX = re.compile(r'(?<!\\)%.*')
+# one pass over each file finds \begin{document} and the include edges
+TOKEN_REGEX = re.compile(r'''
+    (?P<begin_document>\\begin\s*{document})
+  | \\(?:input|include|subfile)\s*(?:{(?P<include>[^}]+)}|\s+(?P<bare_input>[^\s\\{}]+))
+  | \\(?P<subimport>sub)?import\*?\s*{(?P<import_dir>[^}]*)}\s*{(?P<import_file>[^}]+)}
+''', re.VERBOSE)
+
+# 1. match any entrypoint
+ENTRYPOINT_EXACT_MATCH = { 'main.tex', 'manuscript.tex', 'mainnew.tex' }
+# 2. eliminate non-tex files and blacklisted files
+TEX_FILE_EXTENSION = 'tex'
+FILE_BLACKLIST_EXACT = ['math_commands.tex', 'commands.tex', 'macros.tex']
+FILE_BLACKLIST_REGEX = [re.compile(s, re.IGNORECASE) for s in [r'.*shorthands.*\.tex$', r'.*math_commands.*\.tex$', r'.*macros.*\.tex$', r'.*preamble.*\.tex$', r'.*declarations.*\.tex$', r'.*notation.*\.tex$']]
+# 3. fuzzy match these, followed by any file ending in tex
+ENTRYPOINT_REGEXES = [re.compile(s, re.IGNORECASE) for s in [r'main.*\.tex$', r'.*arxiv.*\.tex$', r'.*paper.*\.tex$', r'.*final.*\.tex$', r'.*2023.*\.tex$', r'.*\.tex$']]
+
+def parse_documentclass(file_content):
+    result = DOCUMENTCLASS_REGEX.search(file_content)
+    if result == None: return None, None
+    if result.group('docclass') == None or result.group('params') == None: return result.group('docclass'), result.group('params')
+    params_cleaned = filter(lambda s: s[0] != '%', [s.strip() for s in result.group('params').split('\n')])
+    return result.group('docclass'), ''.join(params_cleaned)
+
+def is_single_file_submission(filename):
+    return SINGLE_FILE_SUBMISSION_REGEX.search(filename) is not None
+
+def is_tex_file(filename):
+    return filename.endswith('.' + TEX_FILE_EXTENSION) or SINGLE_FILE_SUBMISSION_REGEX.fullmatch(filename) is not None
+
+def is_blacklisted(filename):
+    return filename in FILE_BLACKLIST_EXACT or any(pattern.search(filename) for pattern in FILE_BLACKLIST_REGEX)
+
+"""How likely a file name is to be the entrypoint, by the naming conventions of find_entrypoint_file. Lower is better"""
+def get_name_tier(filename):
+    if is_single_file_submission(filename): return 0
+    if filename in ENTRYPOINT_EXACT_MATCH: return 1
+    for i, pattern in enumerate(ENTRYPOINT_REGEXES):
+        if pattern.search(filename): return 2 + i
+    return 2 + len(ENTRYPOINT_REGEXES)
+
+class SourceFile(NamedTuple):
+    path: str                       # relative to the indexed folder, with '/' separators
+    size: int
+    documentclass: Optional[str]
+    docclass_params: Optional[str]
+    has_begin_document: bool
+    includes: list                  # relative paths of the indexed files that this file includes
+
+class Entrypoint(NamedTuple):
+    root: str                       # folder of the entrypoint, i.e. the cwd for compiling
+    tex_file: str
+    documentclass: Optional[str]
+    docclass_params: Optional[str]
+
+"""Tokenize a tex file once. Returns (documentclass, params, has_begin_document, include targets as written)"""
+def tokenize_tex_file(file_content):
+    documentclass, params = parse_documentclass(file_content)
+    has_begin_document, targets = False, []
+    for match in TOKEN_REGEX.finditer(COMMENT_REGEX.sub('', file_content)):
+        if match.group('begin_document') is not None: has_begin_document = True
+        elif match.group('import_file') is not None:
+            targets.append((match.group('import_dir'), match.group('import_file').strip(), match.group('subimport') is not None))
+        else:
+            targets.append(('', (match.group('include') or match.group('bare_input')).strip(), True))
+    return documentclass, params, has_begin_document, targets
+
+"""Resolve an include target to an indexed file: relative to the including file, then to the top folder, then by suffix.
+[paths_by_basename] maps file names to the indexed paths with that name"""
+def resolve_include(tex_paths, paths_by_basename, includer, import_dir, target, relative_to_includer):
+    target = posixpath.normpath(posixpath.join(import_dir.strip(), target))
+    names = [target] if target.endswith('.tex') else [target + '.tex', target]
+    includer_dir = posixpath.dirname(includer)
+    for name in names:
+        for candidate in ([posixpath.normpath(posixpath.join(includer_dir, name))] if relative_to_includer else []) + [name]:
+            if candidate in tex_paths: return candidate
+    for name in names:
+        for path in paths_by_basename.get(posixpath.basename(name), []):
+            if path.endswith('/' + name): return path
+    return None
+
+"""One-pass index of the tex sources in a folder: documentclass, \\begin{document}, include edges and size of every tex file"""
+class SourceIndex:
+    def __init__(self, folder, files):
+        self.folder = folder
+        self.files = files  # path -> SourceFile
+
+    @classmethod
+    def build(cls, folder):
+        contents = {}
+        for root, dirs, filenames in os.walk(folder):
+            dirs.sort()
+            for filename in sorted(filenames):
+                if not is_tex_file(filename): continue
+                file_path = os.path.join(root, filename)
+                with open(file_path, errors='ignore') as file:
+                    contents[os.path.relpath(file_path, folder).replace(os.sep, '/')] = (os.path.getsize(file_path), tokenize_tex_file(file.read()))
+        paths_by_basename = {}
+        for path in contents: paths_by_basename.setdefault(posixpath.basename(path), []).append(path)
+        files = {}
+        for path, (size, (documentclass, params, has_begin_document, targets)) in contents.items():
+            includes = [resolve_include(contents, paths_by_basename, path, *target) for target in targets]
+            files[path] = SourceFile(path, size, documentclass, params, has_begin_document, [p for p in includes if p is not None and p != path])
+        return cls(folder, files)
+
+    def to_json(self):
+        return { 'version': INDEX_VERSION, 'files': [f._asdict() for f in self.files.values()] }
+
+    @classmethod
+    def from_json(cls, folder, data):
+        return cls(folder, { f['path']: SourceFile(**f) for f in data['files'] })
+
+    def included_files(self):
+        return { path for f in self.files.values() for path in f.includes }
+
+    """Relative path (as indexed) of a file under the indexed folder"""
+    def get_path(self, file_path):
+        return os.path.relpath(file_path, self.folder).replace(os.sep, '/')
+
+    """[path] and every file it includes, directly or indirectly"""
+    def include_closure(self, path):
+        closure, stack = [], [path]
+        seen = { path }
+        while len(stack) > 0:
+            path = stack.pop()
+            if path not in self.files: continue
+            closure.append(path)
+            for included in self.files[path].includes:
+                if included in seen: continue
+                seen.add(included)
+                stack.append(included)
+        return closure
+
+    """The root of the include graph: a file with a documentclass that no other file includes.
+    Ties are broken by \\begin{document}, the blacklist, folder depth, then the naming conventions of find_entrypoint_file"""
+    def find_entrypoint(self):
+        included = self.included_files()
+        def priority(f):
+            filename = posixpath.basename(f.path)
+            return (f.path in included, not f.has_begin_document, is_blacklisted(filename), f.path.count('/'), get_name_tier(filename), f.path)
+        candidates = [f for f in self.files.values() if f.documentclass is not None]
+        if len(candidates) == 0:
+            # like find_entrypoint_file, a single-file submission or an exact name match is used even without a documentclass
+            candidates = [f for f in self.files.values() if get_name_tier(posixpath.basename(f.path)) <= 1]
+        if len(candidates) == 0: return None
+        entry = min(candidates, key=priority)
+        root, tex_file = posixpath.split(entry.path)
+        return Entrypoint(os.path.join(self.folder, *root.split('/')) if root else self.folder, tex_file, entry.documentclass, entry.docclass_params)
+
+"""Index the sources in [folder]. With an [archive_hash] (the hash of the downloaded e-print), the index is cached, so a
+rerun does not read the sources again"""
+def get_source_index(folder, archive_hash=None, cache_folder=SOURCE_INDEX_FOLDER):
+    cache_file = None if archive_hash is None else os.path.join(cache_folder, f'{archive_hash}.json')
+    if cache_file is not None and os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as file:
+                data = json.load(file)
+            if data['version'] == INDEX_VERSION: return SourceIndex.from_json(folder, data)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass    # rebuild a corrupt cache file
+    index = SourceIndex.build(folder)
+    if cache_file is not None:
+        os.makedirs(cache_folder, exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(index.to_json(), file)
+        os.replace(tmp_file, cache_file)
+    return index
+
+def find_entrypoint(folder, archive_hash=None):
+    return get_source_index(folder, archive_hash).find_entrypoint()
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import socket
+import threading
+from typing import NamedTuple
+
+"""Work queues that hand out (arxiv_id, target) tasks to workers, e.g. one target per TeX Live version.
+FileQueue works across containers and nodes that share a folder, InProcessQueue is a stand-in with the same interface"""
+
+class Task(NamedTuple):
+    arxiv_id: str
+    target: str     # what to compile with, e.g. 'tl2023'. workers only claim tasks for their own target
+
+def get_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}'
+
+def write_json_atomic(file_path, data):
+    tmp_file = f'{file_path}.{get_worker_id()}.tmp'
+    with open(tmp_file, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp_file, file_path)
+
+"""A queue in a shared folder. Tasks are claimed by renaming them from pending/ to claimed/, which is atomic, so every task
+goes to exactly one worker without a coordinator process or locks. Layout:
+    pending/{target}/{arxiv_id}.json
+    claimed/{target}/{arxiv_id}@{worker_id}.json    (mtime is the claim time)
+    results/{target}/{arxiv_id}.json"""
+class FileQueue:
+    def __init__(self, queue_folder):
+        self.queue_folder = queue_folder
+
+    def _folder(self, state, target):
+        folder = os.path.join(self.queue_folder, state, target)
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def _claims(self, target):
+        return [f for f in os.listdir(self._folder('claimed', target)) if f.endswith('.json')]
+
+    """Add tasks that are not already pending, claimed or done. Returns the number of tasks added"""
+    def enqueue(self, target, arxiv_ids):
+        pending_folder = self._folder('pending', target)
+        existing = set(self.results(target).keys())
+        existing.update(f[:-len('.json')] for f in os.listdir(pending_folder) if f.endswith('.json'))
+        existing.update(f.split('@')[0] for f in self._claims(target))
+        num_added = 0
+        for arxiv_id in arxiv_ids:
+            if arxiv_id in existing: continue
+            write_json_atomic(os.path.join(pending_folder, f'{arxiv_id}.json'), { 'arxiv_id': arxiv_id, 'target': target })
+            existing.add(arxiv_id)
+            num_added += 1
+        return num_added
+
+    """Claim a pending task, or return None if there are none left"""
+    def claim(self, target, worker_id):
+        pending_folder, claimed_folder = self._folder('pending', target), self._folder('claimed', target)
+        for filename in sorted(os.listdir(pending_folder)):
+            if not filename.endswith('.json'): continue
+            arxiv_id = filename[:-len('.json')]
+            claim_file = os.path.join(claimed_folder, f'{arxiv_id}@{worker_id}.json')
+            try:
+                os.rename(os.path.join(pending_folder, filename), claim_file)
+            except FileNotFoundError:
+                continue    # claimed by another worker first
+            os.utime(claim_file)
+            return Task(arxiv_id, target)
+        return None
+
+    """Store the result of a task and release its claim"""
+    def complete(self, task, worker_id, result):
+        write_json_atomic(os.path.join(self._folder('results', task.target), f'{task.arxiv_id}.json'), result)
+        try:
+            os.remove(os.path.join(self._folder('claimed', task.target), f'{task.arxiv_id}@{worker_id}.json'))
+        except FileNotFoundError:
+            pass    # the claim expired and was requeued, the result is kept anyway
+
+    """Return tasks claimed more than [lease_seconds] ago (e.g. by a worker that died) to pending. Returns the number requeued"""
+    def requeue_stale(self, target, lease_seconds):
+        pending_folder, claimed_folder = self._folder('pending', target), self._folder('claimed', target)
+        num_requeued = 0
+        for filename in self._claims(target):
+            claim_file = os.path.join(claimed_folder, filename)
+            try:
+                if time.time() - os.path.getmtime(claim_file) < lease_seconds: continue
+                os.rename(claim_file, os.path.join(pending_folder, f'{filename.split("@")[0]}.json'))
+                num_requeued += 1
+            except FileNotFoundError:
+                continue    # completed or requeued meanwhile
+        return num_requeued
+
+    def results(self, target):
+        results = {}
+        results_folder = self._folder('results', target)
+        for filename in os.listdir(results_folder):
+            if not filename.endswith('.json'): continue
+            with open(os.path.join(results_folder, filename)) as file:
+                results[filename[:-len('.json')]] = json.load(file)
+        return results
+
+    """Number of (pending, claimed, done) tasks"""
+    def counts(self, target):
+        pending = [f for f in os.listdir(self._folder('pending', target)) if f.endswith('.json')]
+        done = [f for f in os.listdir(self._folder('results', target)) if f.endswith('.json')]
+        return len(pending), len(self._claims(target)), len(done)
+
+"""In-process stand-in for FileQueue, e.g. for testing workers in threads"""
+class InProcessQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending, self.claimed, self.done = {}, {}, {}     # target -> list / {arxiv_id: (worker_id, time)} / {arxiv_id: result}
+
+    def enqueue(self, target, arxiv_ids):
+        with self.lock:
+            pending, claimed, done = self.pending.setdefault(target, []), self.claimed.setdefault(target, {}), self.done.setdefault(target, {})
+            existing = set(pending)
+            new_ids = [a for a in dict.fromkeys(arxiv_ids) if a not in existing and a not in claimed and a not in done]
+            pending.extend(new_ids)
+            return len(new_ids)
+
+    def claim(self, target, worker_id):
+        with self.lock:
+            pending = self.pending.setdefault(target, [])
+            if len(pending) == 0: return None
+            arxiv_id = pending.pop(0)
+            self.claimed.setdefault(target, {})[arxiv_id] = (worker_id, time.time())
+            return Task(arxiv_id, target)
+
+    def complete(self, task, worker_id, result):
+        with self.lock:
+            self.done.setdefault(task.target, {})[task.arxiv_id] = result
+            claimed = self.claimed.setdefault(task.target, {})
+            if claimed.get(task.arxiv_id, (None,))[0] == worker_id: del claimed[task.arxiv_id]
+
+    def requeue_stale(self, target, lease_seconds):
+        with self.lock:
+            claimed = self.claimed.setdefault(target, {})
+            stale = [a for a, (_, claim_time) in claimed.items() if time.time() - claim_time >= lease_seconds]
+            for arxiv_id in stale:
+                del claimed[arxiv_id]
+                self.pending.setdefault(target, []).append(arxiv_id)
+            return len(stale)
+
+    def results(self, target):
+        with self.lock:
+            return dict(self.done.get(target, {}))
+
+    def counts(self, target):
+        with self.lock:
+            return len(self.pending.get(target, [])), len(self.claimed.get(target, {})), len(self.done.get(target, {}))
+
+"""Claim and process tasks for [target] until none are left. A task that raises is completed with { 'error': ... }, so that it
+is not retried forever. When the queue is empty, expired claims are requeued first. Returns the number of tasks processed"""
+def run_worker(queue, target, process_task, worker_id=None, lease_seconds=3600):
+    worker_id = worker_id or get_worker_id()
+    num_processed = 0
+    while True:
+        task = queue.claim(target, worker_id)
+        if task is None:
+            if queue.requeue_stale(target, lease_seconds) > 0: continue
+            return num_processed
+        try:
+            result = process_task(task)
+        except Exception as e:
+            result = { 'error': f'{type(e).__name__}: {e}' }
+        queue.complete(task, worker_id, result)
+        num_processed += 1
@@ -0,0 +1,71 @@
+import os
+import argparse
+import tempfile
+from config import EXTRACTED_FOLDER, DIFF_DPI, DIFF_COARSE_DPI, DIFF_TILE_SIZE, PIXEL_TOLERANCE
+from benchmarks import process_file, ssim, tile_diff, text_comparison, edit_ops, text_transform, text_extract, fetcher
+
+if __name__ == '__main__':
+    # e.g. python3 run_benchmarks.py -process-file -synthetic 500
+    #      python3 run_benchmarks.py -ssim -pages 6
+    #      python3 run_benchmarks.py -tile-diff
+    #      python3 run_benchmarks.py -text-comparison -text-pages 50
+    #      python3 run_benchmarks.py -edit-ops -compiled-dir bin_tmp/compiled_tex_pdf
+    #      python3 run_benchmarks.py -text-transform
+    #      python3 run_benchmarks.py -text-extract -extract-pdfs a.pdf b.pdf
+    #      python3 run_benchmarks.py -fetcher
+    parser = argparse.ArgumentParser(description='Benchmark pipeline steps against their previous implementations')
+    parser.add_argument('-process-file', action='store_true', help="removing engine-specific primitives from tex files")
+    parser.add_argument('-corpus', default=EXTRACTED_FOLDER, help="folder of extracted sources to run on (files are copied, not modified)")
+    parser.add_argument('-synthetic', type=int, help="run on a generated corpus with this many papers instead")
+    parser.add_argument('-ssim', action='store_true', help="batched SSIM against skimage, one page pair at a time")
+    parser.add_argument('-pages', type=int, default=6, help="number of synthetic pages per engine for -ssim")
+    parser.add_argument('-img-dir', help="run -ssim on the pages of a converted paper (its converted_img subdir) instead")
+    parser.add_argument('-tile-diff', action='store_true', help="validate the coarse-then-tiles diff against the full diff (and diff-pdf, if installed) on a fixed sample of pdfs")
+    parser.add_argument('-pdf-pairs', nargs='+', help="run -tile-diff on these pdfs instead, as pairs: a1.pdf b1.pdf a2.pdf b2.pdf ...")
+    parser.add_argument('-text-comparison', action='store_true', help="text metrics and edit ops from one alignment per engine pair, against an alignment per metric, and the anchored alignment against whole-text editops")
+    parser.add_argument('-text-pages', type=int, default=50, help="number of pages of the synthetic paper for -text-comparison")
+    parser.add_argument('-edit-ops', action='store_true', help="cleaning edit ops and finding different chars with Counters against the row-by-row dataframe version, checking the results are identical")
+    parser.add_argument('-text-transform', action='store_true', help="text transformations compiled into a few passes against one str.replace per rule, checking the texts are identical")
+    parser.add_argument('-text-extract', action='store_true', help="text, font and image extraction page by page against the whole document at once, checking the contents are identical")
+    parser.add_argument('-fetcher', action='store_true', help="downloads from a local server that rate limits, stalls and truncates responses, checking retries, Retry-After and timeouts")
+    parser.add_argument('-extract-pdfs', nargs='+', help="run -text-extract on these pdfs instead of a generated 300-page one")
+    parser.add_argument('-compiled-dir', help="run -edit-ops and -text-transform on the compiled pdfs of this folder (e.g. COMPILED_FOLDER) instead of generated papers")
+    parser.add_argument('-papers', type=int, default=10, help="number of papers for -edit-ops and -text-transform")
+    parser.add_argument('-repeat', type=int, default=3, help="number of timed runs, the best is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        corpus_folder = args.corpus
+        if args.synthetic is not None:
+            corpus_folder = process_file.make_synthetic_corpus(os.path.join(tmp_folder, 'corpus'), args.synthetic)
+        if args.process_file: process_file.run(corpus_folder, args.repeat)
+        if args.tile_diff:
+            if args.pdf_pairs is not None:
+                if len(args.pdf_pairs) % 2 != 0: parser.error('-pdf-pairs takes an even number of pdfs')
+                pairs = { f'{os.path.basename(a)}<>{os.path.basename(b)}': (a, b) for a, b in zip(args.pdf_pairs[::2], args.pdf_pairs[1::2]) }
+            else:
+                pairs = tile_diff.make_sample_pdfs(os.path.join(tmp_folder, 'tile_diff'))
+            tile_diff.run(pairs, DIFF_DPI, PIXEL_TOLERANCE, DIFF_COARSE_DPI, DIFF_TILE_SIZE)
+        if args.fetcher: fetcher.run(os.path.join(tmp_folder, 'fetcher'))
+    if args.ssim:
+        pages, pairs = ssim.load_store_pages(args.img_dir) if args.img_dir is not None else ssim.make_synthetic_pages(args.pages)
+        ssim.run(pages, pairs, args.repeat)
+    if args.text_comparison:
+        pdf_texts = text_comparison.make_synthetic_texts(args.text_pages)
+        text_comparison.run(pdf_texts, args.repeat)
+        text_comparison.run_alignment(pdf_texts, args.repeat)
+        text_comparison.run_alignment(text_comparison.make_moved_block_texts(), args.repeat)
+    if args.edit_ops:
+        corpus = edit_ops.load_corpus_texts(args.compiled_dir, args.papers) if args.compiled_dir is not None else edit_ops.make_synthetic_corpus(args.papers, args.text_pages)
+        edit_ops.run(corpus, args.repeat)
+    if args.text_transform:
+        papers_pages = text_transform.load_corpus_pages(args.compiled_dir, args.papers) if args.compiled_dir is not None \
+            else [pages for seed in range(args.papers) for pages in text_transform.make_synthetic_pages(args.text_pages, seed).values()]
+        text_transform.run(papers_pages, args.repeat)
+    if args.text_extract:
+        with tempfile.TemporaryDirectory() as folder:
+            pdf_paths = args.extract_pdfs
+            if pdf_paths is None:
+                pdf_paths = [os.path.join(folder, 'sample.pdf')]
+                text_extract.make_sample_pdf(pdf_paths[0], 300)
+            text_extract.run(pdf_paths)
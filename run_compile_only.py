@@ -2,17 +2,30 @@
 use the -e '$bibtex_fudge=1;' option, and only for 2020
 """
 import os
-import time
 import argparse
-import subprocess
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from pipeline.compile_tex_files import find_entrypoint_file
+from pipeline.source_index import find_entrypoint
+from pipeline.compile_cache import CompileCache
+from pipeline.manifest import hash_tree
+from pipeline.compile_stats import CompileCostModel, run_with_stats, count_latexmk_rules, get_paper_features, append_compile_stats, read_compile_stats
+from pipeline.work_queue import FileQueue, run_worker
+from utils.tex_engine_utils import get_texlive_version
+from config import COMPILE_TIMEOUT_MIN, COMPILE_TIMEOUT_MAX, COMPILE_COST_MODEL_MIN_SAMPLES
 
 # these depend on the dockerfile
 DOCKER_PROJECT_ROOT = '/diff_test_tex_engines'
 EXTRACTED_FOLDER = os.path.join(DOCKER_PROJECT_ROOT, 'bin', 'tex_sources')
 DOCKER_BIN = os.path.join(DOCKER_PROJECT_ROOT, 'docker_bin_2')
+# shared by all containers (docker_bin_2 is a volume). keys include the TeX Live version
+COMPILE_CACHE = CompileCache(os.path.join(DOCKER_BIN, 'compile_cache'), 20 * 1024**3)
+# per-run timeouts are predicted from the stats of earlier compiles (in all containers), see CompileCostModel
+COMPILE_STATS_PATH = os.path.join(DOCKER_BIN, 'compile_stats.csv')
+DEFAULT_COMPILE_TIMEOUT = 300
+# with -queue, containers on any node that mount docker_bin_2 pull (arxiv_id, version) tasks from here
+WORK_QUEUE_FOLDER = os.path.join(DOCKER_BIN, 'work_queue')
+QUEUE_LEASE_SECONDS = 4 * COMPILE_TIMEOUT_MAX     # claims older than this are assumed dead and requeued
 
 LATEXMK_COMPILE_CMD_BASE  = [ 'latexmk', '-pdf', '-interaction=nonstopmode' ]
 LATEXMK_COMPILE_FLAG = [ '-e', '$bibtex_fudge=1;' ] 
@@ -33,49 +46,101 @@ def checkpaths(texlive_version, VERSION_COMPILED_FOLDER, COMPILE_RESULTS_FOLDER)
         raise Exception(f'results file already exists: {results_file}')
     os.makedirs(COMPILE_RESULTS_FOLDER, exist_ok=True)
 
-def compile_tex_to_pdf(texlive_version, with_flag, root, tex_file, logs_folder, arxiv_id, output_folder):
-    compile_command = LATEXMK_COMPILE_CMD_BASE + LATEXMK_COMPILE_FLAG if with_flag else LATEXMK_COMPILE_CMD_BASE
+def get_compile_artifacts(texlive_version, logs_folder, arxiv_id, output_folder):
+    jobname = f'{arxiv_id}_tl{texlive_version}'
+    return {
+        'pdf': os.path.join(output_folder, f'{jobname}.pdf'),
+        'log': os.path.join(output_folder, f'{jobname}.log'),
+        'blg': os.path.join(output_folder, f'{jobname}.blg'),
+        'out': os.path.join(logs_folder, f'{jobname}.out'),
+        'err': os.path.join(logs_folder, f'{jobname}.err'),
+    }
+
+def compile_tex_to_pdf(texlive_version, with_flag, root, tex_file, logs_folder, arxiv_id, output_folder, timeout=DEFAULT_COMPILE_TIMEOUT):
+    compile_command = LATEXMK_COMPILE_CMD_BASE + LATEXMK_COMPILE_FLAG if with_flag else list(LATEXMK_COMPILE_CMD_BASE)  # a copy, since it is extended below
     compile_command += [ f'-jobname={arxiv_id}_tl{texlive_version}', f'-output-directory={output_folder}', tex_file ]
-    latexmk_run_1, latexmk_run_2  = -1, -1
-    try:
-        stdout_file = os.path.join(logs_folder, f'{arxiv_id}_tl{texlive_version}.out')
-        stderr_file = os.path.join(logs_folder, f'{arxiv_id}_tl{texlive_version}.err')
-        with open(stdout_file, 'w') as stdout, open(stderr_file, 'w') as stderr:
-            time_1 = time.time()
-            proc = subprocess.run(compile_command, timeout=300, stdout=stdout, stderr=stderr, cwd=root)
-            time_2 = time.time()
-            proc = subprocess.run(compile_command, timeout=300, stdout=stdout, stderr=stderr, cwd=root)
-            time_3 = time.time()
-            latexmk_run_1, latexmk_run_2 = time_2 - time_1, time_3 - time_2
-            return proc.returncode, latexmk_run_1, latexmk_run_2
-    except subprocess.TimeoutExpired:
-        return 'TIMED_OUT', latexmk_run_1, latexmk_run_2
+    # restore from the compile cache if these sources were compiled before with the same command and TeX Live
+    cache_key = CompileCache.make_key(hash_tree(root), compile_command[:-2] + [tex_file], get_texlive_version())
+    artifacts = get_compile_artifacts(texlive_version, logs_folder, arxiv_id, output_folder)
+    meta = COMPILE_CACHE.restore(cache_key, artifacts)
+    if meta is not None: return meta['returncode'], meta['latexmk_run_1'], meta['latexmk_run_2'], None, None
+    stdout_file = os.path.join(logs_folder, f'{arxiv_id}_tl{texlive_version}.out')
+    stderr_file = os.path.join(logs_folder, f'{arxiv_id}_tl{texlive_version}.err')
+    with open(stdout_file, 'w') as stdout, open(stderr_file, 'w') as stderr:
+        run_1 = run_with_stats(compile_command, timeout, stdout, stderr, root)
+        num_rules = count_latexmk_rules(stdout_file)
+        if run_1.returncode is None: return 'TIMED_OUT', run_1.wall_time, -1, run_1, num_rules
+        run_2 = run_with_stats(compile_command, timeout, stdout, stderr, root)
+    if run_2.returncode is None: return 'TIMED_OUT', run_1.wall_time, run_2.wall_time, run_1, num_rules
+    COMPILE_CACHE.put(cache_key, artifacts, { 'returncode': run_2.returncode, 'latexmk_run_1': run_1.wall_time, 'latexmk_run_2': run_2.wall_time })
+    return run_2.returncode, run_1.wall_time, run_2.wall_time, run_1, num_rules
+
+"""Stats of the first latexmk run, which does the actual compile, for fitting the cost model"""
+def get_compile_stats_row(texlive_version, arxiv_id, features, timeout, ret):
+    returncode, _, _, run_1, num_rules = ret
+    return {
+        'arxiv_id': arxiv_id, 'engine': f'tl{texlive_version}', 'texlive_version': get_texlive_version(),
+        'source_bytes': features.source_bytes, 'num_packages': features.num_packages, 'documentclass': features.documentclass or '',
+        'returncode': run_1.returncode, 'timed_out': run_1.returncode is None, 'timeout': timeout,
+        'wall_time': run_1.wall_time, 'num_rules': num_rules, 'max_rss': run_1.max_rss,
+    }
+
+def get_cost_model():
+    cost_model = CompileCostModel(DEFAULT_COMPILE_TIMEOUT, COMPILE_TIMEOUT_MIN, COMPILE_TIMEOUT_MAX, COMPILE_COST_MODEL_MIN_SAMPLES).fit(read_compile_stats(COMPILE_STATS_PATH))
+    print(f'compile cost model: {"fitted on " + COMPILE_STATS_PATH if cost_model.is_trained else f"not enough samples, using {DEFAULT_COMPILE_TIMEOUT=}"}')
+    return cost_model
+
+"""Compile one paper. Returns (returncode, docclass, latexmk_run_1, latexmk_run_2)"""
+def compile_paper(texlive_version, with_flag, VERSION_COMPILED_FOLDER, arxiv_id, cost_model):
+    # create the subdirs for output, if it doesn't exist
+    compile_output_folder = os.path.join(VERSION_COMPILED_FOLDER, arxiv_id)
+    compile_logs_folder = os.path.join(compile_output_folder, 'logs')
+    os.makedirs(compile_output_folder, exist_ok=True)
+    os.makedirs(compile_logs_folder, exist_ok=True)
+    # run compilation
+    entrypoint = find_entrypoint(os.path.join(EXTRACTED_FOLDER, arxiv_id))
+    if entrypoint is None: return (-1, 'NO_ENTRYPOINT', -1, -1)
+    root, tex_file, docclass, _ = entrypoint
+    # if entrypoint is identified, begin compilation
+    features = get_paper_features(root, docclass)
+    timeout = cost_model.predict_timeout(features, f'tl{texlive_version}')
+    ret = compile_tex_to_pdf(texlive_version, with_flag, root, tex_file, compile_logs_folder, arxiv_id, compile_output_folder, timeout)
+    if ret[3] is not None: append_compile_stats(COMPILE_STATS_PATH, [get_compile_stats_row(texlive_version, arxiv_id, features, timeout, ret)])
+    return (ret[0], docclass, ret[1], ret[2])
 
 def run(texlive_version, with_flag, VERSION_COMPILED_FOLDER, COMPILE_RESULTS_FOLDER):
     results = {}
-    a_results_csv_filepath = os.path.join(COMPILE_RESULTS_FOLDER, f'a_results_{tl_version}.csv')
+    cost_model = get_cost_model()
+    a_results_csv_filepath = os.path.join(COMPILE_RESULTS_FOLDER, f'a_results_{texlive_version}.csv')
     with open(a_results_csv_filepath,'a') as f:
         a_writer = csv.writer(f)
         for arxiv_id in tqdm(os.listdir(EXTRACTED_FOLDER)):
-            # create the subdirs for output, if it doesn't exist
-            compile_output_folder = os.path.join(VERSION_COMPILED_FOLDER, arxiv_id)
-            compile_logs_folder = os.path.join(compile_output_folder, 'logs')
-            os.makedirs(compile_output_folder, exist_ok=True)
-            os.makedirs(compile_logs_folder, exist_ok=True)
-            # run compilation
-            for root, _, files in os.walk(os.path.join(EXTRACTED_FOLDER, arxiv_id)):
-                tex_file, docclass, _ = find_entrypoint_file(files, root)
-                if tex_file is None: continue
-                # if entrypoint is identified, begin compilation
-                ret = compile_tex_to_pdf(texlive_version, with_flag, root, tex_file, compile_logs_folder, arxiv_id, compile_output_folder)
-                results[arxiv_id] = (ret[0], docclass, ret[1], ret[2])
-                break
-            else:
-                results[arxiv_id] = (-1, 'NO_ENTRYPOINT', -1, -1)
+            results[arxiv_id] = compile_paper(texlive_version, with_flag, VERSION_COMPILED_FOLDER, arxiv_id, cost_model)
             a_writer.writerow([arxiv_id] + list(results[arxiv_id]))
             f.flush()  # save immediately
     return results
 
+"""Queue tasks are per (arxiv_id, target), and each container only works on the target of its TeX Live version"""
+def get_queue_target(texlive_version, with_flag):
+    return f'tl{texlive_version}_flags' if with_flag else f'tl{texlive_version}'
+
+"""Pull and compile papers from the shared queue until it is empty, in [num_workers] threads (the compiles are subprocesses)"""
+def run_queue_workers(queue, texlive_version, with_flag, VERSION_COMPILED_FOLDER, num_workers=1):
+    cost_model = get_cost_model()
+    target = get_queue_target(texlive_version, with_flag)
+    def process_task(task):
+        return compile_paper(texlive_version, with_flag, VERSION_COMPILED_FOLDER, task.arxiv_id, cost_model)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        num_processed = sum(executor.map(lambda _: run_worker(queue, target, process_task, lease_seconds=QUEUE_LEASE_SECONDS), range(num_workers)))
+    print(f'compiled {num_processed} papers from the queue [{target}]. (pending, claimed, done) = {queue.counts(target)}')
+
+"""Results of all workers, in the format of run(). Tasks that raised are recorded as ERROR"""
+def collect_queue_results(queue, texlive_version, with_flag):
+    results = {}
+    for arxiv_id, result in sorted(queue.results(get_queue_target(texlive_version, with_flag)).items()):
+        results[arxiv_id] = (-1, f'ERROR: {result["error"]}', -1, -1) if isinstance(result, dict) else tuple(result)
+    return results
+
 def save_results(results, texlive_version, COMPILE_RESULTS_FOLDER):
     results_csv_filepath = os.path.join(COMPILE_RESULTS_FOLDER, f'results_{texlive_version}.csv')
     with open(results_csv_filepath, 'w') as csv_file:  
@@ -88,14 +153,28 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run text-based comparison (text, formatting, images)')
     parser.add_argument('-ver', required=True, help="texlive version for labelling")
     parser.add_argument('-flags', action='store_true', help="add the $bibtex_fudge=1; flag to compilation (for tl2020)")
-    tl_version, with_flag = parser.parse_args().ver, parser.parse_args().flags
+    parser.add_argument('-queue', choices=['enqueue', 'work', 'collect'], help="use the shared work queue: add all papers as tasks, compile tasks until none are left, or save the results of all workers")
+    parser.add_argument('-workers', type=int, default=1, help="number of concurrent compiles with -queue work")
+    args = parser.parse_args()
+    tl_version, with_flag = args.ver, args.flags
 
     VERSION_COMPILED_FOLDER = os.path.join(DOCKER_BIN, 'version_compiled_pdf_2020' if with_flag else 'version_compiled_pdf')
     COMPILE_RESULTS_FOLDER = os.path.join(DOCKER_BIN, 'compile_results_2020' if with_flag else 'compile_results')
 
-    checkpaths(tl_version, VERSION_COMPILED_FOLDER, COMPILE_RESULTS_FOLDER)
-    results = run(tl_version, with_flag, VERSION_COMPILED_FOLDER, COMPILE_RESULTS_FOLDER)
-    save_results(results, tl_version, COMPILE_RESULTS_FOLDER)
+    if args.queue is None:
+        checkpaths(tl_version, VERSION_COMPILED_FOLDER, COMPILE_RESULTS_FOLDER)
+        results = run(tl_version, with_flag, VERSION_COMPILED_FOLDER, COMPILE_RESULTS_FOLDER)
+        save_results(results, tl_version, COMPILE_RESULTS_FOLDER)
+    elif args.queue == 'enqueue':
+        queue, target = FileQueue(WORK_QUEUE_FOLDER), get_queue_target(tl_version, with_flag)
+        num_added = queue.enqueue(target, sorted(os.listdir(EXTRACTED_FOLDER)))
+        print(f'added {num_added} tasks to {WORK_QUEUE_FOLDER} [{target}]. (pending, claimed, done) = {queue.counts(target)}')
+    elif args.queue == 'work':
+        run_queue_workers(FileQueue(WORK_QUEUE_FOLDER), tl_version, with_flag, VERSION_COMPILED_FOLDER, args.workers)
+    else:
+        checkpaths(tl_version, VERSION_COMPILED_FOLDER, COMPILE_RESULTS_FOLDER)
+        save_results(collect_queue_results(FileQueue(WORK_QUEUE_FOLDER), tl_version, with_flag), tl_version, COMPILE_RESULTS_FOLDER)
+    if args.queue in (None, 'work'): print(f'evicted {COMPILE_CACHE.evict()} compile cache entries')
 
 
 
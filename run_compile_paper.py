@@ -0,0 +1,49 @@
+import os
+import argparse
+import logging
+from datetime import datetime
+from utils import logger
+from utils.tex_engine_utils import get_engine_name
+from config import COMPILE_TIMEOUT, LOGS_FOLDER
+from pipeline.compile_tex_files import create_output_and_log_dirs, process_paper, run_tex_engines
+from pipeline.source_index import SourceIndex
+
+"""Compile one paper with all engines at the same time, e.g. to rerun a paper interactively.
+The sources are only read: outputs and aux files go to {out}/{name}, with a separate aux dir per engine"""
+def compile_paper(source_folder, name, out_folder, tex_file=None, timeout=COMPILE_TIMEOUT, strip_primitives=False):
+    LOGGER = logger.PIPELINE_LOGGER
+    source_folder = os.path.abspath(source_folder)
+    index = SourceIndex.build(source_folder)
+    if tex_file is None:
+        entrypoint = index.find_entrypoint()
+        if entrypoint is None: raise RuntimeError(f'could not find entrypoint tex file in {source_folder}')
+        source_folder, tex_file, docclass, _ = entrypoint
+        LOGGER.info(f'found latex file: {os.path.join(source_folder, tex_file)} ({docclass})')
+    output_folder = os.path.abspath(os.path.join(out_folder, name))
+    if os.path.commonpath([output_folder, source_folder]) == output_folder:
+        raise RuntimeError(f'output folder {output_folder} would overwrite the sources')
+    output_folder, logs_folder = create_output_and_log_dirs(os.path.abspath(out_folder), name)
+    # same preprocessing as the pipeline. this edits the sources in place
+    if strip_primitives:
+        report = process_paper(index, source_folder, tex_file, name, logs_folder)
+        LOGGER.info(f'removed primitives: {report["total"]}')
+    rets = run_tex_engines(source_folder, tex_file, logs_folder, name, output_folder, concurrent=True, timeout=timeout)
+    for tex_engine, ret in rets.items():
+        LOGGER.info(f'{get_engine_name(tex_engine)}: ret={ret}\t{os.path.join(output_folder, f"{name}_{get_engine_name(tex_engine)}.pdf")}')
+    return rets
+
+if __name__ == '__main__':
+    # e.g. python3 run_compile_paper.py -dir bin/arxiv_tars_extracted/2306.00207 -out compiled
+    parser = argparse.ArgumentParser(description='Compile one paper with all tex engines concurrently')
+    parser.add_argument('-dir', default='.', help="folder with the tex sources")
+    parser.add_argument('-tex', help="entrypoint tex file. found automatically if not given")
+    parser.add_argument('-name', help="name for the outputs (jobname prefix). defaults to the folder name")
+    parser.add_argument('-out', default='compiled', help="outputs are saved to {out}/{name}")
+    parser.add_argument('-timeout', type=float, default=COMPILE_TIMEOUT, help="timeout per engine, in seconds")
+    parser.add_argument('-strip-primitives', action='store_true', help="remove pdftex-specific primitives from the sources first, like the pipeline (edits the files)")
+    args = parser.parse_args()
+
+    logger.init_logger(logger.PIPELINE_LOGGER_ID, LOGS_FOLDER, datetime.now().strftime('%Y%m%d_%H%M%S'),
+                       console_log_level=logging.INFO, has_file_handler=False)
+    name = args.name or os.path.basename(os.path.abspath(args.dir))
+    compile_paper(args.dir, name, args.out, args.tex, args.timeout, args.strip_primitives)
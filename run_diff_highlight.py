@@ -3,10 +3,17 @@ from img_comparison import highlight_diffs
 
 if __name__ == '__main__':
     # e.g. python3 run_diff_highlight.py -id 00207 -pg 1 2 3
+    # or   python3 run_diff_highlight.py -all
     parser = argparse.ArgumentParser(description='Highlight diffs in a diff-pdf')
-    parser.add_argument('-id', required=True, help="arxiv_id to run on")
-    parser.add_argument('-pg', required=True, nargs='+', help="pages to run on")
+    parser.add_argument('-id', help="arxiv_id to run on")
+    parser.add_argument('-pg', nargs='+', help="pages to run on")
+    parser.add_argument('-all', action='store_true', help="highlight every page of every diff pdf in DIFFS_FOLDER, saved as pngs in HIGHLIGHTED_DIFFS_FOLDER")
     args = parser.parse_args()
 
-    pages = [int(x) for x in args.pg]
-    highlight_diffs.main(args.id, pages)
+    if args.all:
+        num_written = highlight_diffs.highlight_all()
+        print(f'wrote {num_written} highlighted pages to {highlight_diffs.HIGHLIGHTED_DIFFS_FOLDER}')
+    else:
+        if args.id is None or args.pg is None: parser.error('-id and -pg are required without -all')
+        pages = [int(x) for x in args.pg]
+        highlight_diffs.main(args.id, pages)
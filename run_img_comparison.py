@@ -1,33 +1,93 @@
 import argparse
 import logging
 import os
+import json
 from datetime import datetime
 import warnings
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 import pandas as pd
 import img_comparison.compare_text as text_cmp
 
 from utils import logger
-from config import YEAR_AND_MONTH, LOGS_FOLDER, COMPILED_FOLDER
+from config import YEAR_AND_MONTH, LOGS_FOLDER, COMPILED_FOLDER, NUM_JOBS, IMG_CMP_PAGES_PER_TASK
 from img_comparison import convert_pdf_to_img, compare_imgs
+from pipeline.raster_cache import get_raster_cache
 from utils.tex_engine_utils import DIFF_ENGINE_PAIRS
 
 LOGGER = logger.COMPARISON_LOGGER
 
-def convert_for_all():
+def convert_for_all(jobs=1):
     LOGGER.info('converting PDFs to image...')
-    for arxiv_id in tqdm(os.listdir(COMPILED_FOLDER)):
-        convert_pdf_to_img.main(arxiv_id)
+    stats = Counter()
+    arxiv_ids = sorted(os.listdir(COMPILED_FOLDER))
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for paper_stats in tqdm(executor.map(convert_pdf_to_img.main, arxiv_ids), total=len(arxiv_ids)):
+                stats += paper_stats
+    else:
+        for arxiv_id in tqdm(arxiv_ids):
+            stats += convert_pdf_to_img.main(arxiv_id)
+    total = stats['renders'] + stats['renders_avoided']
+    if total > 0: LOGGER.info(f"structural precheck avoided {stats['renders_avoided']}/{total} page renders ({stats['renders_avoided'] / total:.1%})")
+    raster_cache = get_raster_cache()
+    if raster_cache is not None: LOGGER.info(f'evicted {raster_cache.evict()} pages from the raster cache')
 
-def compare_for_all(algos):
-    dirs = os.listdir(COMPILED_FOLDER)
+# (arxiv_id, cmp page ids) tasks. serially a task is a whole paper, so SSIM is batched over all its pages.
+# in parallel papers are split into tasks of IMG_CMP_PAGES_PER_TASK pages, so a paper with many pages doesn't hold up the pool
+def get_compare_tasks(jobs):
+    tasks = []
+    for arxiv_id in sorted(os.listdir(COMPILED_FOLDER)):
+        if jobs <= 1:
+            tasks.append((arxiv_id, None))
+            continue
+        pages = compare_imgs.get_cmp_pages(arxiv_id)
+        for start in range(0, len(pages), IMG_CMP_PAGES_PER_TASK):
+            tasks.append((arxiv_id, pages[start:start+IMG_CMP_PAGES_PER_TASK]))
+    return tasks
+
+# returns the result rows of one task, and how many keypoint descriptors it computed and reused
+def compare_task(arxiv_id, pages, algos):
+    cache = compare_imgs.DESCRIPTOR_CACHE
+    misses, hits = cache.misses, cache.hits
+    result = compare_imgs.main(arxiv_id, algos, pages)
+    rows = []
+    for page, page_results in result.items():
+        page_results['identifier'] = f'{arxiv_id}_{page}'
+        rows.append(page_results)
+    return rows, (cache.misses - misses, cache.hits - hits)
+
+# runs the comparisons in [jobs] processes. rows are appended to [rows_path] (json lines) as tasks complete, so a partial run
+# keeps its results. the summary is sorted by paper and page, so it is the same whatever order the tasks complete in
+def compare_for_all(algos, jobs=1, rows_path=None):
+    tasks = get_compare_tasks(jobs)
     rows = []
-    LOGGER.info('running image comparisons...')
-    for arxiv_id in tqdm(dirs):
-        result = compare_imgs.main(arxiv_id, algos)
-        for page, page_results in result.items():
-            page_results['identifier'] = f'{arxiv_id}_{page}'
-            rows.append(page_results)
+    descriptors = Counter()
+    LOGGER.info(f'running image comparisons ({len(tasks)} tasks, {jobs} jobs)...')
+    rows_file = open(rows_path, 'a') if rows_path is not None else None
+    def collect(task_rows, task_descriptors):
+        rows.extend(task_rows)
+        descriptors.update(dict(zip(('described', 'reused'), task_descriptors)))
+        if rows_file is None: return
+        for row in task_rows: rows_file.write(json.dumps(row) + '\n')
+        rows_file.flush()
+    try:
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(compare_task, arxiv_id, pages, algos) for arxiv_id, pages in tasks]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    collect(*future.result())
+        else:
+            for arxiv_id, pages in tqdm(tasks):
+                collect(*compare_task(arxiv_id, pages, algos))
+    finally:
+        if rows_file is not None: rows_file.close()
+    if descriptors['described'] + descriptors['reused'] > 0: LOGGER.info(f"keypoint descriptors: {descriptors['described']} pages described, {descriptors['reused']} reused")
+    def row_order(row):
+        arxiv_id, page = row['identifier'].rsplit('_', 1)
+        return (arxiv_id, compare_imgs.cmp_page_order(page))
+    rows.sort(key=row_order)
     RESULTS_SUMMARY = pd.DataFrame.from_records(rows, index='identifier')
     LOGGER.debug('full results summary:\n' + RESULTS_SUMMARY.to_string())
     return RESULTS_SUMMARY
@@ -45,7 +105,7 @@ def pretty_print_results(results_df, arxiv_id):
             cmp_data[new_colname] = results_df[colname]
         LOGGER.info(f'{col_key}:\n{cmp_data}')
 
-def run(run_for_id, do_convert, do_compare, do_text):
+def run(run_for_id, do_convert, do_compare, do_text, jobs=1):
     current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
     os.makedirs(LOGS_FOLDER, exist_ok=True)
     if run_for_id is None: 
@@ -53,10 +113,10 @@ def run(run_for_id, do_convert, do_compare, do_text):
                            console_log_level=logging.INFO, has_file_handler=True)
         warnings.filterwarnings('ignore')
         LOGGER.info(f'logfile timestamp: {current_time}')
-        LOGGER.info(f'{do_convert=}\t{do_compare=}\t{do_text=}')
-        if do_convert: convert_for_all()
+        LOGGER.info(f'{do_convert=}\t{do_compare=}\t{do_text=}\t{jobs=}')
+        if do_convert: convert_for_all(jobs)
         if do_compare: 
-            results = compare_for_all(algos=do_compare)
+            results = compare_for_all(algos=do_compare, jobs=jobs, rows_path=os.path.join(LOGS_FOLDER, f'{current_time}_imgcompare_rows.jsonl'))
             results.to_csv(os.path.join(LOGS_FOLDER, f'{current_time}_imgcompare.csv'))
         if do_text:
             results = text_cmp.run_text_cmp_for_all()
@@ -81,10 +141,11 @@ if __name__ == '__main__':
     cmp_choices = list(compare_imgs.CMP_ALGORITHMS.keys())
     parser.add_argument('-cmpalgo', action='append', choices=cmp_choices, default=[], help="run image comparison with a specific algorithm")
     parser.add_argument('-text', action='store_true', help="run text comparison only")
+    parser.add_argument('-jobs', type=int, default=NUM_JOBS, help="number of worker processes for converting and comparing all PDFs")
     args = parser.parse_args()
 
     do_all = not args.compare and not args.convert and not args.text
     do_compare = (args.compare or do_all) and (args.cmpalgo or cmp_choices)
     do_convert = args.convert or do_all
     do_text = args.text or do_all
-    run(args.id, do_convert, do_compare, do_text)
+    run(args.id, do_convert, do_compare, do_text, args.jobs)
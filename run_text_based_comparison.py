@@ -24,10 +24,19 @@ def compare_for_one(arxiv_id, should_save, should_save_debug, should_save_editop
         pdf_filepath = os.path.join(COMPILED_FOLDER, arxiv_id, f'{arxiv_id}_{tex_engine_utils.get_engine_name(engine)}.pdf')
         if USE_TL2020_DIR and engine == '20': pdf_filepath = os.path.join(COMPILED_FOLDER_2020, arxiv_id, f'{arxiv_id}_{tex_engine_utils.get_engine_name(engine)}.pdf')
         if not os.path.isfile(pdf_filepath): continue
-        pdf_infos[engine], debug_content = extract.get_text_fonts_images(pdf_filepath)
-        # save if needed
+        # save if needed: the debug content is written page by page as it's extracted (one entry per line, as when it
+        # was written at once), and only built for debug runs
         if should_save_debug:
-            with open(f'debug_log/debug_text_{engine}.txt', 'w') as file: file.write('\n'.join([ str(x) for x in debug_content ]))
+            with open(f'debug_log/debug_text_{engine}.txt', 'w') as file:
+                is_first_entry = True
+                def write_debug_content(page):
+                    nonlocal is_first_entry
+                    if len(page.debug) == 0: return
+                    file.write(('' if is_first_entry else '\n') + '\n'.join([ str(x) for x in page.debug ]))
+                    is_first_entry = False
+                pdf_infos[engine] = extract.get_text_fonts_images(pdf_filepath, extract.CONTENT_FIELDS + ('debug',), on_page=write_debug_content)
+        else:
+            pdf_infos[engine] = extract.get_text_fonts_images(pdf_filepath)
         if should_save:
             try:
                 with open(f'debug_log/text_{engine}.txt', 'w') as file: file.write(pdf_infos[engine].text)
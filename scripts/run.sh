@@ -1,8 +1,7 @@
 #!/bin/bash
-# sample script for manually compiling, comparing diffs, and cleaning up aux files
-latexmk -pdf -jobname="pdflatex_compiled" main.tex
-latexmk -xelatex -jobname="xelatex_compiled" main.tex
-latexmk -lualatex -jobname="lualatex_compiled" main.tex
-diff-pdf --output-diff='xe_pdf_diff.pdf' -smg --dpi=100 --per-page-pixel-tolerance=3000 xelatex_compiled.pdf pdflatex_compiled.pdf
-diff-pdf --output-diff='xe_lua_diff.pdf' -smg --dpi=100 --per-page-pixel-tolerance=3000 xelatex_compiled.pdf lualatex_compiled.pdf
-rm *.aux *.fls *.fdb_latexmk *.dvi *.xdv
+# sample script for manually compiling and comparing diffs
+# all engines compile main.tex at the same time. pdfs, aux files and logs are saved to compiled/paper/
+PROJECT_ROOT="$(cd "$(dirname "$0")/.." && pwd)"
+python3 "$PROJECT_ROOT/run_compile_paper.py" -dir . -tex main.tex -name paper -out compiled
+diff-pdf --output-diff='xe_pdf_diff.pdf' -smg --dpi=100 --per-page-pixel-tolerance=3000 compiled/paper/paper_xelatex.pdf compiled/paper/paper_pdflatex.pdf
+diff-pdf --output-diff='xe_lua_diff.pdf' -smg --dpi=100 --per-page-pixel-tolerance=3000 compiled/paper/paper_xelatex.pdf compiled/paper/paper_lualatex.pdf
@@ -1,29 +1,27 @@
+from collections import Counter
 from typing import Any, Dict
 
 import pandas as pd
+from config import ANCHORED_EDIT_OPS
 from analysis import compare_text_similarity
 from analysis.helpers import init_df_with_cols
-from analysis.text_transformer import COMMON_ACCENTS, IGNORE_HYPHENS, TextTransformer
+from analysis.text_transformer import COMMON_ACCENTS, IGNORE_HYPHENS, CompiledTransform
 from text_based_comparison.extract import PdfContent
 from utils.logger import ANALYSIS_LOGGER as LOGGER, pad_with_char
 from utils.tex_engine_utils import DIFF_ENGINE_PAIRS
 
+TEXT_TRANSFORM = CompiledTransform([IGNORE_HYPHENS] + COMMON_ACCENTS + [ ('ϕ', ''), ('φ', '') ])
+
 def text_transformation(text: str):
-    text = TextTransformer.apply_transform(text, [IGNORE_HYPHENS])
-    text = TextTransformer.apply_transform(text, COMMON_ACCENTS)
-    text = TextTransformer.apply_transform(text, [ ('ϕ', ''), ('φ', '') ])
-    return text
+    return TEXT_TRANSFORM(text)
 
 def find_different_chars(edit_ops: Dict[str, pd.DataFrame]):
     different_chars: Dict[str, Dict[str, int]] = {}  # { [cmp]: { [char]: [count] }
     different_chars_count: Dict[str, Any] = { 'comparison': 'chars_diff_nett' }
     different_chars_count_uniq: Dict[str, Any] = { 'comparison': 'chars_diff_uniq' }
     for cmp, edit_ops_df in edit_ops.items():
-        char_counts = {}
-        for _, row in edit_ops_df.iterrows():
-            from_char, to_char, char_count = row['from'], row['to'], row['count']
-            if from_char not in char_counts: char_counts[from_char] = 0
-            if to_char not in char_counts: char_counts[to_char] = 0
+        char_counts = Counter()
+        for from_char, to_char, char_count in zip(edit_ops_df['from'].tolist(), edit_ops_df['to'].tolist(), edit_ops_df['count'].tolist()):
             char_counts[from_char] -= char_count
             char_counts[to_char] += char_count
         # [from] or [to] may be blank (== '') if it's not a replace op, so delete all '' keys
@@ -34,17 +32,20 @@ def find_different_chars(edit_ops: Dict[str, pd.DataFrame]):
     return different_chars, [ different_chars_count, different_chars_count_uniq ]
 
 def text_comparison(pdf_texts: Dict[str, str], with_debug_info=False):
-    edit_ops_results = compare_text_similarity.compute_edit_ops(pdf_texts)
+    # each pair's alignment is computed once, and every metric below is derived from it. the saved edit ops are grouped by
+    # position, so they are from the whole-text alignment, whatever ANCHORED_EDIT_OPS
+    comparisons = compare_text_similarity.compare_texts(pdf_texts, anchored=ANCHORED_EDIT_OPS and not with_debug_info)
+    edit_ops_results = compare_text_similarity.compute_edit_ops(comparisons)
     cleaned_results, summary = compare_text_similarity.compute_cleaned_edit_ops(edit_ops_results)
     different_chars, different_chars_summary_rows = find_different_chars(edit_ops_results)
 
     RESULTS = init_df_with_cols(['comparison'] + [f'{e1}{e2}' for e1, e2 in DIFF_ENGINE_PAIRS], 'comparison')
-    RESULTS = compare_text_similarity.compute_text_comparison_metrics(compare_text_similarity.COMPARE_METHODS, pdf_texts, RESULTS)
+    RESULTS = compare_text_similarity.compute_text_comparison_metrics(compare_text_similarity.COMPARE_METHODS, comparisons, RESULTS)
     RESULTS = compare_text_similarity.compute_levenshtein_cleaned_and_edit_ops_summary(cleaned_results, summary, RESULTS)
-    RESULTS = compare_text_similarity.compute_edit_ops_metrics(edit_ops_results, RESULTS)
+    RESULTS = compare_text_similarity.compute_edit_ops_metrics(comparisons, RESULTS)
     RESULTS = pd.concat([RESULTS, pd.DataFrame.from_records(different_chars_summary_rows, index='comparison')])
     
-    grouped_edit_ops = compare_text_similarity.compute_debug_edit_ops(pdf_texts) if with_debug_info else None
+    grouped_edit_ops = compare_text_similarity.compute_debug_edit_ops(comparisons) if with_debug_info else None
 
     for e1, e2 in DIFF_ENGINE_PAIRS:
         cmp = f'{e1}{e2}'
@@ -1,5 +1,5 @@
 import fitz  # PyMuPDF
-from typing import Dict, List, NamedTuple, Set
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set
 import hashlib
 
 TEXT_EXTRACTION_FLAGS = (fitz.TEXTFLAGS_DICT \
@@ -16,33 +16,69 @@ class ImageInfo(NamedTuple):
     digest: str
     dimensions: tuple[int, int]
 
+# fields of PageContent (and PdfContent) that extract_pages can build. debug is only for PageContent
+PAGE_FIELDS = ('text', 'text_with_formatting', 'fonts', 'images', 'debug')
+CONTENT_FIELDS = ('text', 'fonts', 'images')
+
+# fields that weren't requested are None
+class PageContent(NamedTuple):
+    page_num: int
+    text: Optional[str]     # the text of each span, spaces as line breaks, each followed by a line break
+    text_with_formatting: Optional[Dict[FontInformation, List[str]]]
+    fonts: Optional[Set[FontInformation]]
+    images: Optional[List[ImageInfo]]
+    debug: Optional[list]   # (FontInformation, text) per span and ImageInfo per image block, in reading order
+
 class PdfContent(NamedTuple):
-    text: str
-    text_with_formatting: Dict[str, str]
-    fonts: Set[FontInformation]
-    images: List[ImageInfo]
+    text: Optional[str]
+    text_with_formatting: Optional[Dict[FontInformation, List[str]]]
+    fonts: Optional[Set[FontInformation]]
+    images: Optional[List[ImageInfo]]
     num_pages: int
 
-def get_text_fonts_images(pdf_path: str):
-    pdf_document = fitz.Document(pdf_path)
-    debug_content = []
-    full_text, text_with_formatting, fonts_used, images, num_pages = [], {}, set(), [], pdf_document.page_count
-    for page_num in range(pdf_document.page_count):
-        page = pdf_document[page_num]
-        images += [ImageInfo( imginfo['digest'], (imginfo['width'], imginfo['height']) ) for imginfo in page.get_image_info(hashes=True)]
-        blocks = page.get_text("dict", sort=True, flags=TEXT_EXTRACTION_FLAGS)['blocks']
-        # block structure: https://pymupdf.readthedocs.io/en/latest/_images/img-textpage.png
-        for block in blocks:
-            if block['type'] == 1:   # image block
-                debug_content.append(ImageInfo(hashlib.md5(block['image']).hexdigest(), (block['width'], block['height'])))
-                continue
-            for line in block['lines']:
-                for span in line['spans']:
-                    font_information = FontInformation(span['font'], span['flags'], span['color'], round(span['size']*2)/2)
-                    fonts_used.add(font_information)
-                    debug_content.append( (font_information, span['text']) )
-                    if font_information not in text_with_formatting: text_with_formatting[font_information] = []
-                    text_with_formatting[font_information].append(span['text'])
-                    full_text.append(span['text'].replace(' ', '\n'))
-    pdf_document.close()
-    return PdfContent('\n'.join(full_text), text_with_formatting, fonts_used, images, num_pages), debug_content
+def extract_pages(pdf_path: str, fields=CONTENT_FIELDS) -> Iterator[PageContent]:
+    unknown_fields = set(fields) - set(PAGE_FIELDS)
+    if len(unknown_fields) > 0: raise ValueError(f'unknown fields: {unknown_fields}')
+    with_spans = any(field in fields for field in ('text', 'text_with_formatting', 'fonts', 'debug'))
+    with_font_information = any(field in fields for field in ('text_with_formatting', 'fonts', 'debug'))
+    # image blocks carry the image's bytes, and are only needed for debug
+    flags = TEXT_EXTRACTION_FLAGS if 'debug' in fields else TEXT_EXTRACTION_FLAGS & ~fitz.TEXT_PRESERVE_IMAGES
+    with fitz.Document(pdf_path) as pdf_document:
+        for page_num in range(pdf_document.page_count):
+            page = pdf_document[page_num]
+            text = [] if 'text' in fields else None
+            text_with_formatting = {} if 'text_with_formatting' in fields else None
+            fonts_used = set() if 'fonts' in fields else None
+            debug_content = [] if 'debug' in fields else None
+            images = [ImageInfo( imginfo['digest'], (imginfo['width'], imginfo['height']) ) for imginfo in page.get_image_info(hashes=True)] if 'images' in fields else None
+            blocks = page.get_text("dict", sort=True, flags=flags)['blocks'] if with_spans else []
+            # block structure: https://pymupdf.readthedocs.io/en/latest/_images/img-textpage.png
+            for block in blocks:
+                if block['type'] == 1:   # image block
+                    if debug_content is not None: debug_content.append(ImageInfo(hashlib.md5(block['image']).hexdigest(), (block['width'], block['height'])))
+                    continue
+                for line in block['lines']:
+                    for span in line['spans']:
+                        if with_font_information: font_information = FontInformation(span['font'], span['flags'], span['color'], round(span['size']*2)/2)
+                        if fonts_used is not None: fonts_used.add(font_information)
+                        if debug_content is not None: debug_content.append( (font_information, span['text']) )
+                        if text_with_formatting is not None: text_with_formatting.setdefault(font_information, []).append(span['text'])
+                        if text is not None: text.append(span['text'].replace(' ', '\n') + '\n')
+            yield PageContent(page_num, None if text is None else ''.join(text), text_with_formatting, fonts_used, images, debug_content)
+
+# [on_page] is called with each PageContent, e.g. to write out its debug content, so only one page of it is held at a time
+def get_text_fonts_images(pdf_path: str, fields=CONTENT_FIELDS, on_page=None):
+    texts, text_with_formatting, fonts_used, images, num_pages = [], {}, set(), [], 0
+    for page in extract_pages(pdf_path, fields):
+        if on_page is not None: on_page(page)
+        if page.text is not None: texts.append(page.text)
+        if page.text_with_formatting is not None:
+            for font_information, span_texts in page.text_with_formatting.items(): text_with_formatting.setdefault(font_information, []).extend(span_texts)
+        if page.fonts is not None: fonts_used |= page.fonts
+        if page.images is not None: images += page.images
+        num_pages += 1
+    return PdfContent(''.join(texts)[:-1] if 'text' in fields else None,
+                      text_with_formatting if 'text_with_formatting' in fields else None,
+                      fonts_used if 'fonts' in fields else None,
+                      images if 'images' in fields else None,
+                      num_pages)
@@ -1,4 +1,11 @@
-from config import CMP_TYPE
+import os
+import re
+import fcntl
+import shutil
+import subprocess
+from contextlib import contextmanager
+from functools import lru_cache
+from config import CMP_TYPE, TEXMF_CACHE_FOLDER
 
 TEX_ENGINES = ['pdf', 'lua', 'xe'] if CMP_TYPE == 'ENGINE' else ['20', '21', '22', '23']
 DIFF_ENGINE_PAIRS = [ ('xe', 'pdf'), ('xe', 'lua') ] if CMP_TYPE == 'ENGINE' else [('20', '21'), ('21', '22'), ('22', '23'), ('20', '23')]
@@ -7,6 +14,61 @@ TEX_ENGINES_NAMES = { 'pdf': 'pdflatex', 'lua': 'lualatex', 'xe': 'xelatex'} if
 def get_engine_name(engine):
     return TEX_ENGINES_NAMES[engine]
 
+# each engine gets its own aux dir so that concurrent compiles do not collide
+def get_aux_folder(output_folder, engine):
+    return os.path.join(output_folder, 'aux', get_engine_name(engine))
+
+# each compile gets its own TEXMFVAR and font caches (luaotfload, fontconfig), so that compiles running at the same time
+# do not race on cache writes. an engine has one cache slot per compile that can run at once, and slots are kept across
+# papers, so that e.g. the lualatex font database is only built once
+TEXMF_CACHE_VARS = { 'TEXMFVAR': 'texmf-var', 'TEXMFCACHE': 'texmf-cache', 'XDG_CACHE_HOME': 'xdg-cache' }
+def get_compile_env(engine, slot=0, texmf_cache_folder=TEXMF_CACHE_FOLDER):
+    cache_folder = os.path.join(texmf_cache_folder, get_engine_name(engine), f'slot-{slot}')
+    return os.environ | { var: os.path.join(cache_folder, folder) for var, folder in TEXMF_CACHE_VARS.items() }
+
+# lock the first free cache slot of the engine while the compile runs, and yield its env
+@contextmanager
+def locked_compile_env(engine, texmf_cache_folder=TEXMF_CACHE_FOLDER):
+    engine_folder = os.path.join(texmf_cache_folder, get_engine_name(engine))
+    os.makedirs(engine_folder, exist_ok=True)
+    slot = 0
+    while True:
+        lock_file = open(os.path.join(engine_folder, f'slot-{slot}.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            lock_file.close()
+            slot += 1
+    try:
+        env = get_compile_env(engine, slot, texmf_cache_folder)
+        for var in TEXMF_CACHE_VARS: os.makedirs(env[var], exist_ok=True)
+        yield env
+    finally:
+        lock_file.close()
+
+# caches that are slow to build on first use, and would otherwise be built inside the first compiles' timeouts
+WARM_CACHE_COMMANDS = { 'lua': ['luaotfload-tool', '-u'] }
+
+# build the caches of slot 0 of each engine, and copy them to the other [num_slots] slots that do not exist yet.
+# called before any compile runs, so no slot is in use. Returns the engines whose caches were built
+def warm_compile_caches(engines, num_slots, timeout, texmf_cache_folder=TEXMF_CACHE_FOLDER):
+    warmed = []
+    for engine in engines:
+        if engine not in WARM_CACHE_COMMANDS: continue
+        env = get_compile_env(engine, 0, texmf_cache_folder)
+        for var in TEXMF_CACHE_VARS: os.makedirs(env[var], exist_ok=True)
+        try:
+            subprocess.run(WARM_CACHE_COMMANDS[engine], env=env, capture_output=True, timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        slot_folder = os.path.dirname(env['TEXMFVAR'])
+        for slot in range(1, num_slots):
+            other_folder = os.path.join(os.path.dirname(slot_folder), f'slot-{slot}')
+            if not os.path.exists(other_folder): shutil.copytree(slot_folder, other_folder, symlinks=True)
+        warmed.append(engine)
+    return warmed
+
 def get_compile_tex_commands(arxiv_id, output_folder):
     COMPILE_TEX_COMMANDS = {
         'pdf': [
@@ -14,22 +76,37 @@ def get_compile_tex_commands(arxiv_id, output_folder):
             '-pdf',
             '-interaction=nonstopmode',
             f'-jobname={arxiv_id}_pdflatex',
-            f'-output-directory={output_folder}'
+            f'-output-directory={output_folder}',
+            f'-auxdir={get_aux_folder(output_folder, "pdf")}'
         ], 
         'lua': [
             'latexmk',
             '-lualatex',
             '-interaction=nonstopmode',
             f'-jobname={arxiv_id}_lualatex',
-            f'-output-directory={output_folder}'
+            f'-output-directory={output_folder}',
+            f'-auxdir={get_aux_folder(output_folder, "lua")}'
         ],
         'xe': [
             'latexmk',
             '-xelatex',
             '-interaction=nonstopmode',
             f'-jobname={arxiv_id}_xelatex',
-            f'-output-directory={output_folder}'
+            f'-output-directory={output_folder}',
+            f'-auxdir={get_aux_folder(output_folder, "xe")}'
         ]
     }
     assert(set(TEX_ENGINES) == set(COMPILE_TEX_COMMANDS.keys()))
     return COMPILE_TEX_COMMANDS
+
+"""The TeX Live release of the tex binaries on the PATH, e.g. 'TeX Live 2023'"""
+@lru_cache(maxsize=None)
+def get_texlive_version():
+    try:
+        version_info = subprocess.run(['tex', '--version'], capture_output=True, text=True).stdout
+    except OSError:
+        return 'unknown'
+    match = re.search(r'TeX Live \d{4}', version_info)
+    if match is not None: return match.group()
+    lines = version_info.splitlines()
+    return lines[0] if len(lines) > 0 else 'unknown'